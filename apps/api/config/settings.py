@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -165,12 +166,188 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Google Gemini API
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 
+# LLM backend: 'gemini' | 'record' (Gemini, every call saved to LLM_CASSETTE_DIR)
+# | 'replay' (saved calls served offline, no API key) | 'fake' (core/langchain/fake.py)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+LLM_CASSETTE_DIR = os.getenv('LLM_CASSETTE_DIR', str(BASE_DIR / '.cache' / 'cassettes'))
+# Replay latency per model: 'model=kind:params,...' ('*' = other models), kinds:
+# recorded[:scale] | fixed:seconds | uniform:low:high | lognormal:median:sigma
+LLM_REPLAY_LATENCY = os.getenv('LLM_REPLAY_LATENCY', '*=recorded')
+LLM_REPLAY_SEED = int(os.getenv('LLM_REPLAY_SEED', '0'))
+# Prompt without a cassette in replay: 'error' | 'fake' (structured fake output, replay latency)
+LLM_REPLAY_MISS = os.getenv('LLM_REPLAY_MISS', 'error')
+
 # LangSmith Configuration
 LANGCHAIN_TRACING_V2 = os.getenv('LANGCHAIN_TRACING_V2', 'true').lower() == 'true'
 LANGCHAIN_PROJECT = os.getenv('LANGCHAIN_PROJECT', 'student-planner')
 LANGSMITH_API_KEY = os.getenv('LANGSMITH_API_KEY', '')
 LANGSMITH_HUB_REPO = os.getenv('LANGSMITH_HUB_REPO', 'maisonhai3/student-planner')
 
+# Prompt versions pulled from LangSmith Hub ("latest" or a specific commit/tag)
+PROMPT_VERSIONS = {
+    'router': os.getenv('PROMPT_VERSION_ROUTER', 'latest'),
+    'planner': os.getenv('PROMPT_VERSION_PLANNER', 'latest'),
+    'planner_extract': os.getenv('PROMPT_VERSION_PLANNER_EXTRACT', 'latest'),
+    'planner_outline': os.getenv('PROMPT_VERSION_PLANNER_OUTLINE', 'latest'),
+    'planner_week': os.getenv('PROMPT_VERSION_PLANNER_WEEK', 'latest'),
+    'coder': os.getenv('PROMPT_VERSION_CODER', 'latest'),
+    'judge': os.getenv('PROMPT_VERSION_JUDGE', 'latest'),
+    'refiner': os.getenv('PROMPT_VERSION_REFINER', 'latest'),
+    'repair': os.getenv('PROMPT_VERSION_REPAIR', 'latest'),
+}
+
+# Prompt cache: entries older than the TTL are refreshed in the background
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv('PROMPT_CACHE_TTL_SECONDS', '300'))
+# Last-known-good prompt snapshots, used on cold start and hub outages ('' to disable)
+PROMPT_SNAPSHOT_DIR = os.getenv('PROMPT_SNAPSHOT_DIR', str(BASE_DIR / '.cache' / 'prompts'))
+
+# Build router/planner/coder chains once at startup instead of on the first request
+LLM_WARM_CHAINS_ON_STARTUP = os.getenv('LLM_WARM_CHAINS_ON_STARTUP', 'false').lower() == 'true'
+
+# HTML rendering: 'template' (local, no LLM call) | 'llm' (coder chain)
+PLAN_RENDER_MODE = os.getenv('PLAN_RENDER_MODE', 'template')
+
+# Local scheduler: the LLM only extracts subjects, hours, deadlines and availability,
+# and planner/services/scheduler.py builds the daily sessions (no LLM calendar arithmetic)
+PLANNER_LOCAL_SCHEDULER = os.getenv('PLANNER_LOCAL_SCHEDULER', 'false').lower() == 'true'
+
+# Chunked planning for long-horizon inputs (months / semester): an outline call, then
+# the weekly schedules in parallel (at most PLANNER_CHUNK_CONCURRENCY at a time), merged into one plan
+PLANNER_CHUNKED_ENABLED = os.getenv('PLANNER_CHUNKED_ENABLED', 'false').lower() == 'true'
+PLANNER_CHUNK_CONCURRENCY = int(os.getenv('PLANNER_CHUNK_CONCURRENCY', '4'))
+PLANNER_CHUNK_MAX_WEEKS = int(os.getenv('PLANNER_CHUNK_MAX_WEEKS', '26'))
+
+# Structured output: pass StudyPlan / RouterDecision to Gemini as the response schema
+# (falls back to the text path + Output Guard when the call or validation fails)
+LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'false').lower() == 'true'
+# Schema in planner prompts: 'compact' (TypeScript-like, ~1/3 the tokens) | 'json_schema' (PydanticOutputParser)
+PLANNER_FORMAT_INSTRUCTIONS = os.getenv('PLANNER_FORMAT_INSTRUCTIONS', 'compact')
+
+# Output repair: send only invalid fields back to Flash instead of failing the request
+OUTPUT_REPAIR_ENABLED = os.getenv('OUTPUT_REPAIR_ENABLED', 'true').lower() == 'true'
+# Token budget (prompt + completion) for all repair attempts of one output
+OUTPUT_REPAIR_MAX_TOKENS = int(os.getenv('OUTPUT_REPAIR_MAX_TOKENS', '4000'))
+# Streaming parse aborts once more items than this are invalid (regenerating is cheaper)
+OUTPUT_REPAIR_MAX_INVALID_ITEMS = int(os.getenv('OUTPUT_REPAIR_MAX_INVALID_ITEMS', '3'))
+
+# Admission control: concurrent planner calls per lane, extra requests wait in a bounded queue
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_FLASH_CONCURRENCY = int(os.getenv('ADMISSION_FLASH_CONCURRENCY', '32'))
+ADMISSION_PRO_CONCURRENCY = int(os.getenv('ADMISSION_PRO_CONCURRENCY', '8'))
+# Waiting requests per lane; beyond this requests get 429 + Retry-After
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))
+# A request not admitted within this many seconds of arriving gets 503 + Retry-After
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', '15'))
+
+# Deadlines: per-request budget (X-Request-Timeout header, seconds) split across stages
+REQUEST_DEFAULT_BUDGET_SECONDS = float(os.getenv('REQUEST_DEFAULT_BUDGET_SECONDS', '90'))
+REQUEST_MAX_BUDGET_SECONDS = float(os.getenv('REQUEST_MAX_BUDGET_SECONDS', '300'))
+# Each stage also gets its own ceiling, whichever is shorter wins
+STAGE_TIMEOUTS = {
+    'router': float(os.getenv('STAGE_TIMEOUT_ROUTER_SECONDS', '15')),
+    'planner_flash': float(os.getenv('STAGE_TIMEOUT_PLANNER_FLASH_SECONDS', '60')),
+    'planner_pro': float(os.getenv('STAGE_TIMEOUT_PLANNER_PRO_SECONDS', '150')),
+    'coder': float(os.getenv('STAGE_TIMEOUT_CODER_SECONDS', '60')),
+}
+# HTTP timeout of a single Gemini call (also bounds sync code paths that cannot be cancelled)
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv('LLM_REQUEST_TIMEOUT_SECONDS', '150'))
+
+# Hedged LLM requests: fire a second request when the first exceeds the stage's latency percentile
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'false').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_MIN_DELAY_SECONDS', '1.0'))
+LLM_HEDGE_WINDOW = int(os.getenv('LLM_HEDGE_WINDOW', '200'))
+# Hedge the Pro planner with the Flash planner instead of a second Pro call
+LLM_HEDGE_FALLBACK_TO_FLASH = os.getenv('LLM_HEDGE_FALLBACK_TO_FLASH', 'true').lower() == 'true'
+
+# Circuit breaker per Gemini model: open when the failure rate (429 / 5xx / timeouts / slow calls)
+# over the last WINDOW calls crosses FAILURE_RATE, probe again after OPEN_SECONDS
+CIRCUIT_BREAKER_ENABLED = os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+CIRCUIT_BREAKER_WINDOW = int(os.getenv('CIRCUIT_BREAKER_WINDOW', '20'))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv('CIRCUIT_BREAKER_MIN_CALLS', '5'))
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv('CIRCUIT_BREAKER_FAILURE_RATE', '0.5'))
+# A call is slow past this share of its model's stage timeout (Pro: planner_pro, Flash: planner_flash)
+CIRCUIT_BREAKER_SLOW_CALL_RATIO = float(os.getenv('CIRCUIT_BREAKER_SLOW_CALL_RATIO', '0.8'))
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', '30'))
+# Hard requests go to Flash (with adjusted instructions) while Pro is failing or its breaker is open
+MODEL_FALLBACK_ENABLED = os.getenv('MODEL_FALLBACK_ENABLED', 'true').lower() == 'true'
+# Retries of transient Gemini errors: full-jitter backoff, never earlier than Retry-After
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_SECONDS = float(os.getenv('LLM_RETRY_BASE_SECONDS', '1.0'))
+LLM_RETRY_MAX_SECONDS = float(os.getenv('LLM_RETRY_MAX_SECONDS', '10'))
+
+# Local complexity router: skip the router LLM when the local classifier is confident.
+# Off by default: weights were fitted on tests/sample_inputs.json (no held-out set yet)
+LOCAL_ROUTER_ENABLED = os.getenv('LOCAL_ROUTER_ENABLED', 'false').lower() == 'true'
+LOCAL_ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv('LOCAL_ROUTER_CONFIDENCE_THRESHOLD', '0.85'))
+
+# Speculative routing: start the Flash planner in parallel with the router
+ROUTER_SPECULATIVE_PLANNER = os.getenv('ROUTER_SPECULATIVE_PLANNER', 'false').lower() == 'true'
+# A "hard" decision below this confidence keeps the speculative Flash plan
+ROUTER_SPECULATION_CONFIDENCE_THRESHOLD = float(os.getenv('ROUTER_SPECULATION_CONFIDENCE_THRESHOLD', '0.7'))
+ROUTER_SPECULATION_MAX_WORKERS = int(os.getenv('ROUTER_SPECULATION_MAX_WORKERS', '16'))
+
+# Generation response cache (exact match on normalized input + parameters)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '86400'))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Optional persistent tier (SQLite file path, '' to disable)
+RESPONSE_CACHE_DISK_PATH = os.getenv('RESPONSE_CACHE_DISK_PATH', '')
+RESPONSE_CACHE_DISK_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Near-duplicate reuse: return a stored plan for lightly edited inputs (off by default;
+# only reused when absolute dates and numeric quantities match exactly)
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', 'false').lower() == 'true'
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', '0.85'))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', '20000'))
+
+# Single-flight: identical in-flight generate requests share one chain execution
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+# Followers stop waiting for the leader after this many seconds and run on their own
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '120'))
+
+# Batch endpoint: max items per request and max items generated concurrently
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '200'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+
+# Generation jobs: durable SQLite queue + worker pool (POST /jobs/, GET /jobs/<id>/)
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', str(BASE_DIR / '.cache' / 'jobs.sqlite3'))
+# Run workers inside the web process (started on the first job); otherwise use `manage.py run_job_workers`
+JOB_WORKERS_IN_PROCESS = os.getenv('JOB_WORKERS_IN_PROCESS', 'true').lower() == 'true'
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1.0'))
+# Attempts before a job is dead-lettered; retries back off exponentially from the base delay
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BASE_SECONDS = float(os.getenv('JOB_RETRY_BASE_SECONDS', '5'))
+JOB_RETRY_MAX_SECONDS = float(os.getenv('JOB_RETRY_MAX_SECONDS', '300'))
+# A running job whose worker stops heartbeating is handed to another worker after this
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv('JOB_VISIBILITY_TIMEOUT_SECONDS', '300'))
+# Deadline of one job attempt (all stages together), keep it below the visibility timeout
+JOB_BUDGET_SECONDS = float(os.getenv('JOB_BUDGET_SECONDS', '240'))
+# Allowed callback_url hosts (comma-separated, empty = callbacks disabled); hosts that resolve to
+# loopback / private / link-local addresses are rejected even when listed
+JOB_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv('JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()
+]
+
+# Token prices (USD per 1M tokens) used for per-request cost estimates in timings / health
+LLM_TOKEN_PRICES = {
+    'gemini-2.5-flash': {
+        'input': float(os.getenv('LLM_PRICE_FLASH_INPUT', '0.30')),
+        'output': float(os.getenv('LLM_PRICE_FLASH_OUTPUT', '2.50')),
+    },
+    'gemini-2.5-pro': {
+        'input': float(os.getenv('LLM_PRICE_PRO_INPUT', '1.25')),
+        'output': float(os.getenv('LLM_PRICE_PRO_OUTPUT', '10.00')),
+    },
+}
+
+# Prometheus metrics (GET /metrics)
+# Multiple worker processes: point every process at the same directory; each writes its snapshot there
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv('METRICS_FLUSH_INTERVAL_SECONDS', '5'))
+
 # Firebase Configuration
 FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID', '')
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', '')
@@ -4,8 +4,11 @@ URL configuration for config project.
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view),
     path('api/v1/', include('planner.urls')),
     path('api/v1/', include('feedback.urls')),
 ]
@@ -1,12 +1,19 @@
 """
 Firebase Firestore client for storing and retrieving study plans.
+
+Firestore Admin SDK calls are blocking, so every call runs in a worker
+thread (asyncio.to_thread) to keep the event loop free.
 """
 import os
 import json
+import asyncio
 import logging
 from typing import Optional
 from datetime import datetime
 
+from core.langchain.tracing import trace_stage
+from core.metrics import FIRESTORE_FALLBACKS, FIRESTORE_LATENCY
+
 logger = logging.getLogger(__name__)
 
 # Firebase Admin SDK (lazy initialization)
@@ -76,6 +83,11 @@ def get_firestore_client():
     return _initialize_firebase()
 
 
+def _fetch_all(query) -> list:
+    """Run a Firestore query and materialize the results (blocking)."""
+    return [doc.to_dict() for doc in query.stream()]
+
+
 class StudyPlanRepository:
     """
     Repository for study plan CRUD operations.
@@ -111,13 +123,16 @@ class StudyPlanRepository:
         if self.db:
             try:
                 doc_ref = self.db.collection(self.COLLECTION).document(plan_id)
-                doc_ref.set(document)
+                with trace_stage("firestore_save"), FIRESTORE_LATENCY.time(operation="save"):
+                    await asyncio.to_thread(doc_ref.set, document)
                 logger.info(f"Saved plan {plan_id} to Firestore")
             except Exception as e:
                 logger.error(f"Failed to save plan to Firestore: {e}")
+                FIRESTORE_FALLBACKS.inc(operation="save", reason="error")
                 self._in_memory_store[plan_id] = document
         else:
             # Demo mode: use in-memory storage
+            FIRESTORE_FALLBACKS.inc(operation="save", reason="demo_mode")
             self._in_memory_store[plan_id] = document
             logger.info(f"Saved plan {plan_id} to in-memory store (demo mode)")
         
@@ -136,7 +151,8 @@ class StudyPlanRepository:
         if self.db:
             try:
                 doc_ref = self.db.collection(self.COLLECTION).document(plan_id)
-                doc = doc_ref.get()
+                with FIRESTORE_LATENCY.time(operation="get"):
+                    doc = await asyncio.to_thread(doc_ref.get)
                 
                 if doc.exists:
                     return doc.to_dict()
@@ -144,9 +160,11 @@ class StudyPlanRepository:
                 
             except Exception as e:
                 logger.error(f"Failed to get plan from Firestore: {e}")
+                FIRESTORE_FALLBACKS.inc(operation="get", reason="error")
                 return self._in_memory_store.get(plan_id)
         else:
             # Demo mode
+            FIRESTORE_FALLBACKS.inc(operation="get", reason="demo_mode")
             return self._in_memory_store.get(plan_id)
     
     async def update(self, plan_id: str, updates: dict) -> Optional[dict]:
@@ -165,22 +183,25 @@ class StudyPlanRepository:
         if self.db:
             try:
                 doc_ref = self.db.collection(self.COLLECTION).document(plan_id)
-                doc = doc_ref.get()
-                
-                if not doc.exists:
-                    return None
-                
-                doc_ref.update(updates)
-                return doc_ref.get().to_dict()
+                with FIRESTORE_LATENCY.time(operation="update"):
+                    doc = await asyncio.to_thread(doc_ref.get)
+                    
+                    if not doc.exists:
+                        return None
+                    
+                    await asyncio.to_thread(doc_ref.update, updates)
+                    return (await asyncio.to_thread(doc_ref.get)).to_dict()
                 
             except Exception as e:
                 logger.error(f"Failed to update plan in Firestore: {e}")
+                FIRESTORE_FALLBACKS.inc(operation="update", reason="error")
                 if plan_id in self._in_memory_store:
                     self._in_memory_store[plan_id].update(updates)
                     return self._in_memory_store[plan_id]
                 return None
         else:
             # Demo mode
+            FIRESTORE_FALLBACKS.inc(operation="update", reason="demo_mode")
             if plan_id in self._in_memory_store:
                 self._in_memory_store[plan_id].update(updates)
                 return self._in_memory_store[plan_id]
@@ -199,23 +220,26 @@ class StudyPlanRepository:
         if self.db:
             try:
                 doc_ref = self.db.collection(self.COLLECTION).document(plan_id)
-                doc = doc_ref.get()
-                
-                if not doc.exists:
-                    return False
-                
-                doc_ref.delete()
+                with FIRESTORE_LATENCY.time(operation="delete"):
+                    doc = await asyncio.to_thread(doc_ref.get)
+                    
+                    if not doc.exists:
+                        return False
+                    
+                    await asyncio.to_thread(doc_ref.delete)
                 logger.info(f"Deleted plan {plan_id} from Firestore")
                 return True
                 
             except Exception as e:
                 logger.error(f"Failed to delete plan from Firestore: {e}")
+                FIRESTORE_FALLBACKS.inc(operation="delete", reason="error")
                 if plan_id in self._in_memory_store:
                     del self._in_memory_store[plan_id]
                     return True
                 return False
         else:
             # Demo mode
+            FIRESTORE_FALLBACKS.inc(operation="delete", reason="demo_mode")
             if plan_id in self._in_memory_store:
                 del self._in_memory_store[plan_id]
                 return True
@@ -241,14 +265,16 @@ class StudyPlanRepository:
                     .limit(limit)
                 )
                 
-                docs = query.stream()
-                return [doc.to_dict() for doc in docs]
+                with FIRESTORE_LATENCY.time(operation="list"):
+                    return await asyncio.to_thread(_fetch_all, query)
                 
             except Exception as e:
                 logger.error(f"Failed to list plans from Firestore: {e}")
+                FIRESTORE_FALLBACKS.inc(operation="list", reason="error")
                 return []
         else:
             # Demo mode
+            FIRESTORE_FALLBACKS.inc(operation="list", reason="demo_mode")
             user_plans = [
                 plan for plan in self._in_memory_store.values()
                 if plan.get("userId") == user_id
@@ -284,7 +310,7 @@ class FeedbackRepository:
         if self.db:
             try:
                 doc_ref = self.db.collection(self.COLLECTION).document(feedback_id)
-                doc_ref.set(document)
+                await asyncio.to_thread(doc_ref.set, document)
                 logger.info(f"Saved feedback {feedback_id} to Firestore")
             except Exception as e:
                 logger.error(f"Failed to save feedback to Firestore: {e}")
@@ -305,8 +331,7 @@ class FeedbackRepository:
                     .order_by("createdAt", direction="DESCENDING")
                 )
                 
-                docs = query.stream()
-                return [doc.to_dict() for doc in docs]
+                return await asyncio.to_thread(_fetch_all, query)
                 
             except Exception as e:
                 logger.error(f"Failed to get feedback from Firestore: {e}")
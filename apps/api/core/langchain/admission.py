@@ -0,0 +1,336 @@
+"""
+Admission Control - Giới hạn số LLM calls đồng thời theo lane (Flash / Pro)
+
+Mỗi lane có concurrency limit + hàng đợi giới hạn. Request vượt quá:
+- hàng đợi đầy → AdmissionRejected(429) ngay lập tức
+- đợi quá deadline → AdmissionRejected(503), không chạy việc không ai chờ nữa
+Cả hai kèm retry_after (giây) ước lượng từ thời gian xử lý trung bình.
+
+Dùng được từ event loop (async views) lẫn threads (chain.invoke):
+một threading.Lock bảo vệ state, waiter async được đánh thức bằng
+loop.call_soon_threadsafe.
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from core.metrics import ADMISSION_SHED, ADMISSION_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Thời điểm (time.monotonic) request phải được admit, do view set khi nhận request
+admission_deadline: ContextVar[Optional[float]] = ContextVar("admission_deadline", default=None)
+
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối: quá tải (429) hoặc hết hạn khi đang đợi (503)"""
+    
+    def __init__(self, lane: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(f"{lane} lane: {reason}")
+        self.lane = lane
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("deadline", "enqueued_at", "state", "event", "loop", "future")
+    
+    def __init__(self, deadline: float, loop=None):
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.state = "waiting"  # waiting | granted | expired | abandoned
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+    
+    def notify(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Lane:
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queue: deque = deque()
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_deadline": 0,
+            "max_queue_depth": 0,
+            "wait_ms": 0.0,
+            "completed": 0,
+            "service_ms": 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    Concurrency limit + bounded queue + deadline cho từng lane
+    
+    Usage:
+        async with admission_controller.aslot("pro"):
+            plan = await planner_hard.ainvoke(inputs)
+        
+        with admission_controller.slot("flash"):
+            plan = planner_easy.invoke(inputs)
+    """
+    
+    # Retry-After khi chưa có số liệu thời gian xử lý
+    DEFAULT_RETRY_AFTER = 5
+    MAX_RETRY_AFTER = 120
+    
+    def __init__(self, limits: Dict[str, int], max_queue: int, max_wait_seconds: float):
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._lanes = {name: _Lane(name, limit, max_queue) for name, limit in limits.items()}
+    
+    # ============================================
+    # Acquire / release
+    # ============================================
+    
+    async def acquire_async(self, lane_name: str) -> None:
+        lane = self._lanes[lane_name]
+        waiter = _Waiter(self._deadline(), loop=asyncio.get_running_loop())
+        if self._enter(lane, waiter):
+            return
+        
+        try:
+            timeout = max(waiter.deadline - time.monotonic(), 0)
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client bỏ request: trả lại slot nếu đã được cấp
+            if not self._abandon(lane, waiter, reject=False):
+                self.release(lane_name)
+            raise
+        
+        self._finish_wait(lane, waiter)
+    
+    def acquire(self, lane_name: str) -> None:
+        lane = self._lanes[lane_name]
+        waiter = _Waiter(self._deadline())
+        if self._enter(lane, waiter):
+            return
+        
+        waiter.event.wait(max(waiter.deadline - time.monotonic(), 0))
+        self._finish_wait(lane, waiter)
+    
+    def release(self, lane_name: str, started_at: Optional[float] = None) -> None:
+        """Trả slot, cấp cho waiter kế tiếp còn hạn"""
+        lane = self._lanes[lane_name]
+        now = time.monotonic()
+        
+        with self._lock:
+            lane.in_flight -= 1
+            if started_at is not None:
+                lane.stats["completed"] += 1
+                lane.stats["service_ms"] += (now - started_at) * 1000
+            
+            while lane.queue:
+                waiter = lane.queue.popleft()
+                if waiter.state != "waiting":
+                    continue
+                if waiter.deadline <= now:
+                    waiter.state = "expired"
+                    waiter.notify()
+                    continue
+                waiter.state = "granted"
+                lane.in_flight += 1
+                waiter.notify()
+                break
+    
+    @asynccontextmanager
+    async def aslot(self, lane_name: str):
+        await self.acquire_async(lane_name)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lane_name, started_at)
+    
+    @contextmanager
+    def slot(self, lane_name: str):
+        self.acquire(lane_name)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lane_name, started_at)
+    
+    def precheck(self) -> None:
+        """
+        Từ chối sớm (trước routing) khi hàng đợi của mọi lane đều đầy
+        
+        Raises:
+            AdmissionRejected(429)
+        """
+        with self._lock:
+            full = [
+                lane for lane in self._lanes.values()
+                if lane.in_flight >= lane.limit and len(lane.queue) >= lane.max_queue
+            ]
+            if len(full) < len(self._lanes):
+                return
+            retry_after = min(self._retry_after(lane) for lane in full)
+            for lane in full:
+                lane.stats["rejected_queue_full"] += 1
+                ADMISSION_SHED.inc(lane=lane.name, reason="queue_full")
+        raise AdmissionRejected("all", 429, retry_after, "queue full")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for name, lane in self._lanes.items():
+                data = lane.stats
+                waited = data["queued"] or 1
+                completed = data["completed"] or 1
+                result[name] = {
+                    "limit": lane.limit,
+                    "in_flight": lane.in_flight,
+                    "queue_depth": len(lane.queue),
+                    "max_queue": lane.max_queue,
+                    "admitted": data["admitted"],
+                    "queued": data["queued"],
+                    "max_queue_depth": data["max_queue_depth"],
+                    "avg_wait_ms": round(data["wait_ms"] / waited, 1),
+                    "avg_service_ms": round(data["service_ms"] / completed, 1),
+                    "shed_queue_full": data["rejected_queue_full"],
+                    "shed_deadline": data["rejected_deadline"],
+                }
+            return result
+    
+    # ============================================
+    # Internals (gọi khi đang giữ hoặc lấy self._lock)
+    # ============================================
+    
+    def _deadline(self) -> float:
+        deadline = admission_deadline.get()
+        fallback = time.monotonic() + self.max_wait_seconds
+        return min(deadline, fallback) if deadline is not None else fallback
+    
+    def _enter(self, lane: _Lane, waiter: _Waiter) -> bool:
+        """True nếu được admit ngay; False nếu đã vào hàng đợi"""
+        with self._lock:
+            if lane.in_flight < lane.limit and not lane.queue:
+                lane.in_flight += 1
+                lane.stats["admitted"] += 1
+                return True
+            
+            if len(lane.queue) >= lane.max_queue:
+                lane.stats["rejected_queue_full"] += 1
+                ADMISSION_SHED.inc(lane=lane.name, reason="queue_full")
+                retry_after = self._retry_after(lane)
+            elif waiter.deadline <= time.monotonic():
+                lane.stats["rejected_deadline"] += 1
+                ADMISSION_SHED.inc(lane=lane.name, reason="deadline")
+                raise AdmissionRejected(lane.name, 503, self._retry_after(lane), "deadline exceeded")
+            else:
+                lane.queue.append(waiter)
+                lane.stats["queued"] += 1
+                lane.stats["max_queue_depth"] = max(lane.stats["max_queue_depth"], len(lane.queue))
+                return False
+        
+        logger.warning(f"Admission: {lane.name} queue full, shedding request")
+        raise AdmissionRejected(lane.name, 429, retry_after, "queue full")
+    
+    def _abandon(self, lane: _Lane, waiter: _Waiter, reject: bool = True) -> bool:
+        """Rời hàng đợi; False nếu slot đã được cấp (caller phải release)"""
+        with self._lock:
+            if waiter.state == "granted":
+                return False
+            if waiter.state == "waiting":
+                lane.queue.remove(waiter)
+            waiter.state = "abandoned"
+            if reject:
+                lane.stats["rejected_deadline"] += 1
+                ADMISSION_SHED.inc(lane=lane.name, reason="deadline")
+            return True
+    
+    def _finish_wait(self, lane: _Lane, waiter: _Waiter) -> None:
+        """Sau khi hết đợi: đã được cấp slot hoặc raise 503"""
+        if self._abandon(lane, waiter):
+            logger.warning(f"Admission: {lane.name} request expired after waiting in queue")
+            raise AdmissionRejected(lane.name, 503, self._retry_after(lane), "deadline exceeded")
+        
+        waited = time.monotonic() - waiter.enqueued_at
+        ADMISSION_WAIT.observe(waited, lane=lane.name)
+        with self._lock:
+            lane.stats["admitted"] += 1
+            lane.stats["wait_ms"] += waited * 1000
+    
+    def _retry_after(self, lane: _Lane) -> int:
+        """Ước lượng số giây tới khi hàng đợi hiện tại được xử lý hết"""
+        completed = lane.stats["completed"]
+        if not completed:
+            return self.DEFAULT_RETRY_AFTER
+        avg_service_s = lane.stats["service_ms"] / completed / 1000
+        estimate = avg_service_s * (len(lane.queue) + 1) / max(lane.limit, 1)
+        return max(1, min(self.MAX_RETRY_AFTER, math.ceil(estimate)))
+
+
+def lane_for(use_pro: bool) -> str:
+    return "pro" if use_pro else "flash"
+
+
+@asynccontextmanager
+async def admission_slot(lane: str):
+    """`async with` một slot của lane (không làm gì khi ADMISSION_ENABLED tắt)"""
+    if not settings.ADMISSION_ENABLED:
+        yield
+        return
+    async with admission_controller.aslot(lane):
+        yield
+
+
+def with_admission(runnable: Runnable, lane: str) -> Runnable:
+    """
+    Bọc runnable: mỗi lần invoke/ainvoke phải có slot của lane
+    (không làm gì khi ADMISSION_ENABLED tắt)
+    """
+    def invoke(inputs, config):
+        if not settings.ADMISSION_ENABLED:
+            return runnable.invoke(inputs, config)
+        with admission_controller.slot(lane):
+            return runnable.invoke(inputs, config)
+    
+    async def ainvoke(inputs, config):
+        if not settings.ADMISSION_ENABLED:
+            return await runnable.ainvoke(inputs, config)
+        async with admission_controller.aslot(lane):
+            return await runnable.ainvoke(inputs, config)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"admission_{lane}")
+
+
+# Singleton instance
+admission_controller = AdmissionController(
+    limits={
+        "flash": settings.ADMISSION_FLASH_CONCURRENCY,
+        "pro": settings.ADMISSION_PRO_CONCURRENCY,
+    },
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    max_wait_seconds=settings.ADMISSION_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,376 @@
+"""
+LLM Cassettes - Ghi / phát lại LLM calls để benchmark pipeline offline
+
+- record: gọi Gemini như bình thường, lưu prompt, response text,
+  usage_metadata và latency của mỗi call vào LLM_CASSETTE_DIR
+- replay: trả response đã lưu (không network, không API key), sleep theo
+  phân phối latency cấu hình cho từng model (LLM_REPLAY_LATENCY)
+
+Cassette key = model + messages (ngày YYYY-MM-DD được che, để current_date
+khác ngày ghi vẫn khớp) + response schema nếu dùng structured output.
+Mỗi call là một file JSON: {dir}/{model}/{key}.json
+
+Usage:
+    LLM_BACKEND=record python manage.py bench_pipeline   # ghi một lần với API key
+    LLM_BACKEND=replay LLM_REPLAY_LATENCY="gemini-2.5-pro=lognormal:9:0.4" python manage.py bench_pipeline
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, AsyncIterator, List, Optional, Tuple
+
+from django.conf import settings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from core.langchain.fake import FakeChatModel
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Replay streaming: chunk đầu tiên sau phần này của latency, phần còn lại rải đều
+FIRST_CHUNK_SHARE = 0.2
+STREAM_CHUNK_CHARS = 200
+
+LATENCY_KINDS = {"recorded": 1, "fixed": 1, "uniform": 2, "lognormal": 2}
+
+
+class CassetteMiss(LookupError):
+    """Replay không tìm thấy cassette cho prompt (LLM_REPLAY_MISS=error)"""
+
+
+def cassette_key(model: str, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> str:
+    schema = kwargs.get("response_json_schema") or {}
+    payload = {
+        "model": model,
+        "messages": [(m.type, DATE_PATTERN.sub("<date>", str(m.content))) for m in messages],
+        "schema": schema.get("title") if isinstance(schema, dict) else str(schema),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:32]
+
+
+# ============================================
+# Latency distributions
+# ============================================
+
+@lru_cache(maxsize=16)
+def parse_latency_spec(spec: str) -> Dict[str, Tuple[str, Tuple[float, ...]]]:
+    """
+    "gemini-2.5-flash=lognormal:1.5:0.35,*=recorded" → {model: (kind, params)}
+    
+    Kinds:
+        recorded[:scale]         latency lúc ghi (× scale)
+        fixed:seconds
+        uniform:low:high
+        lognormal:median:sigma
+    
+    Raises:
+        ValueError: spec sai cú pháp
+    """
+    distributions = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, value = item.partition("=")
+        kind, *params = value.strip().split(":")
+        if not model.strip() or kind not in LATENCY_KINDS:
+            raise ValueError(f"Invalid LLM_REPLAY_LATENCY entry: {item!r}")
+        if kind == "recorded" and not params:
+            params = ["1"]
+        if len(params) != LATENCY_KINDS[kind]:
+            raise ValueError(f"{kind} takes {LATENCY_KINDS[kind]} parameter(s): {item!r}")
+        distributions[model.strip()] = (kind, tuple(float(p) for p in params))
+    return distributions
+
+
+class LatencySampler:
+    """Latency giả lập của replay theo từng model (seeded → chạy lại cho cùng chuỗi latency)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rngs: Dict[str, random.Random] = {}
+    
+    def sample(self, model: str, recorded_seconds: float) -> float:
+        distributions = parse_latency_spec(settings.LLM_REPLAY_LATENCY)
+        kind, params = distributions.get(model) or distributions.get("*") or ("recorded", (1.0,))
+        with self._lock:
+            rng = self._rngs.setdefault(model, random.Random(f"{settings.LLM_REPLAY_SEED}:{model}"))
+            if kind == "recorded":
+                return recorded_seconds * params[0]
+            if kind == "fixed":
+                return params[0]
+            if kind == "uniform":
+                return rng.uniform(*params)
+            return params[0] * rng.lognormvariate(0.0, params[1])
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._rngs.clear()
+
+
+# Singleton instance
+latency_sampler = LatencySampler()
+
+
+# ============================================
+# Store
+# ============================================
+
+class CassetteStore:
+    """File JSON cho mỗi LLM call + số lần ghi / hit / miss (thread-safe)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "hits": 0, "misses": 0}
+    
+    @staticmethod
+    def _path(model: str, key: str) -> Path:
+        return Path(settings.LLM_CASSETTE_DIR) / model / f"{key}.json"
+    
+    def load(self, model: str, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            entry = json.loads(self._path(model, key).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            entry = None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cassette {model}/{key}: {e}")
+            entry = None
+        self._bump("hits" if entry else "misses")
+        return entry
+    
+    def save(self, model: str, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(model, key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Ghi ra file tạm rồi rename: request song song không đọc phải file dở
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cassette {model}/{key}: {e}")
+            return
+        self._bump("recorded")
+    
+    def _bump(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._stats)
+        data["backend"] = settings.LLM_BACKEND
+        if data["backend"] in ("record", "replay"):
+            data["dir"] = str(settings.LLM_CASSETTE_DIR)
+        return data
+    
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"recorded": 0, "hits": 0, "misses": 0}
+
+
+# Singleton instance
+cassette_store = CassetteStore()
+
+
+# ============================================
+# Chat model
+# ============================================
+
+class CassetteChatModel(BaseChatModel):
+    """
+    Chat model ghi / phát lại cassette
+    
+    Attributes:
+        model: tên model Gemini (cassette key, latency distribution, tracing)
+        mode: "record" (gọi inner) | "replay"
+        inner: model thật khi record (ChatGoogleGenerativeAI)
+    """
+    
+    model: str
+    mode: str = "replay"
+    inner: Optional[BaseChatModel] = None
+    
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.mode}"
+    
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "mode": self.mode}
+    
+    def _get_ls_params(self, stop=None, **kwargs):
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.model
+        return params
+    
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs) -> Runnable:
+        """
+        Giống Gemini method="json_schema": bind response schema, parse bằng
+        PydanticOutputParser (include_raw → {"raw", "parsed", "parsing_error"})
+        """
+        parser = PydanticOutputParser(pydantic_object=schema)
+        
+        def parse(message: AIMessage):
+            try:
+                parsed = parser.invoke(message)
+            except Exception as e:
+                if include_raw:
+                    return {"raw": message, "parsed": None, "parsing_error": e}
+                raise
+            if include_raw:
+                return {"raw": message, "parsed": parsed, "parsing_error": None}
+            return parsed
+        
+        bound = self.bind(response_mime_type="application/json", response_json_schema=schema.model_json_schema())
+        return bound | RunnableLambda(parse)
+    
+    # ============================================
+    # Generation
+    # ============================================
+    
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = cassette_key(self.model, messages, kwargs)
+        if self.mode == "record":
+            start = time.perf_counter()
+            result = self._require_inner()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            self._record(key, messages, result, time.perf_counter() - start)
+            return result
+        
+        entry = self._replay_entry(key, messages, kwargs)
+        time.sleep(self._latency(entry))
+        return ChatResult(generations=[ChatGeneration(message=self._message(entry))])
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = cassette_key(self.model, messages, kwargs)
+        if self.mode == "record":
+            start = time.perf_counter()
+            result = await self._require_inner()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            self._record(key, messages, result, time.perf_counter() - start)
+            return result
+        
+        entry = self._replay_entry(key, messages, kwargs)
+        await asyncio.sleep(self._latency(entry))
+        return ChatResult(generations=[ChatGeneration(message=self._message(entry))])
+    
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.mode == "record":
+            # Ghi cả response (không stream): cassette luôn là output hoàn chỉnh
+            result = self._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            yield ChatGenerationChunk(message=AIMessageChunk(**_chunk_fields(result.generations[0].message)))
+            return
+        
+        entry = self._replay_entry(cassette_key(self.model, messages, kwargs), messages, kwargs)
+        for delay, chunk in self._chunks(entry):
+            time.sleep(delay)
+            if run_manager and chunk.message.content:
+                run_manager.on_llm_new_token(str(chunk.message.content), chunk=chunk)
+            yield chunk
+    
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.mode == "record":
+            result = await self._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            yield ChatGenerationChunk(message=AIMessageChunk(**_chunk_fields(result.generations[0].message)))
+            return
+        
+        entry = self._replay_entry(cassette_key(self.model, messages, kwargs), messages, kwargs)
+        for delay, chunk in self._chunks(entry):
+            await asyncio.sleep(delay)
+            if run_manager and chunk.message.content:
+                await run_manager.on_llm_new_token(str(chunk.message.content), chunk=chunk)
+            yield chunk
+    
+    # ============================================
+    # Helpers
+    # ============================================
+    
+    def _require_inner(self) -> BaseChatModel:
+        if self.inner is None:
+            raise ValueError("CassetteChatModel in record mode needs an inner model")
+        return self.inner
+    
+    def _record(self, key: str, messages: List[BaseMessage], result: ChatResult, seconds: float) -> None:
+        message = result.generations[0].message
+        cassette_store.save(self.model, key, {
+            "model": self.model,
+            "messages": [{"type": m.type, "content": str(m.content)} for m in messages],
+            "content": str(message.content),
+            "usage_metadata": dict(getattr(message, "usage_metadata", None) or {}),
+            "response_metadata": _jsonable(message.response_metadata or {}),
+            "latency_ms": round(seconds * 1000, 1),
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+    
+    def _replay_entry(self, key: str, messages: List[BaseMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        entry = cassette_store.load(self.model, key)
+        if entry is not None:
+            return entry
+        if settings.LLM_REPLAY_MISS != "fake":
+            raise CassetteMiss(f"No cassette for {self.model} prompt {key} in {settings.LLM_CASSETTE_DIR}")
+        
+        # Chưa ghi prompt này: output giả lập đúng cấu trúc, latency theo distribution của model
+        schema = kwargs.get("response_json_schema") or {}
+        message = FakeChatModel(model=self.model)._result(messages, schema.get("title")).generations[0].message
+        return {
+            "content": str(message.content),
+            "usage_metadata": dict(message.usage_metadata or {}),
+            "response_metadata": message.response_metadata,
+            "latency_ms": 0.0,
+        }
+    
+    def _latency(self, entry: Dict[str, Any]) -> float:
+        return max(latency_sampler.sample(self.model, entry.get("latency_ms", 0.0) / 1000), 0.0)
+    
+    def _message(self, entry: Dict[str, Any]) -> AIMessage:
+        response_metadata = dict(entry.get("response_metadata") or {})
+        response_metadata.setdefault("model_name", self.model)
+        return AIMessage(
+            content=entry["content"],
+            usage_metadata=entry.get("usage_metadata") or None,
+            response_metadata=response_metadata,
+        )
+    
+    def _chunks(self, entry: Dict[str, Any]) -> Iterator[Tuple[float, ChatGenerationChunk]]:
+        """(delay trước chunk, chunk): latency chia thành time-to-first-chunk + phần đều nhau"""
+        content = entry["content"]
+        pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or [""]
+        latency = self._latency(entry)
+        first = latency * FIRST_CHUNK_SHARE if len(pieces) > 1 else latency
+        rest = (latency - first) / max(len(pieces) - 1, 1)
+        message = self._message(entry)
+        for index, piece in enumerate(pieces):
+            last = index == len(pieces) - 1
+            chunk = AIMessageChunk(
+                content=piece,
+                # usage + metadata ở chunk cuối như Gemini
+                usage_metadata=message.usage_metadata if last else None,
+                response_metadata=message.response_metadata if last else {},
+            )
+            yield (first if index == 0 else rest), ChatGenerationChunk(message=chunk)
+
+
+def _chunk_fields(message: BaseMessage) -> Dict[str, Any]:
+    return {
+        "content": message.content,
+        "usage_metadata": getattr(message, "usage_metadata", None),
+        "response_metadata": message.response_metadata,
+    }
+
+
+def _jsonable(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
@@ -2,25 +2,281 @@
 LangChain Chains - Router, Planner, Coder chains
 """
 
+import json
+import time
+import asyncio
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 
-from langchain_core.runnables import RunnableLambda, RunnableBranch
+from langchain_core.runnables import Runnable, RunnableLambda, RunnableBranch
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from django.conf import settings
 
 from planner.guards.input_guard import InputGuard
 from planner.guards.output_guard import (
     OutputGuard, 
-    StudyPlan, 
     RouterDecision,
     study_plan_guard,
     router_guard,
+    plan_outline_guard,
+    plan_constraints_guard,
+    week_schedule_guard,
+    PlanConstraints,
 )
+from planner.services import generate_plan_html, schedule_plan
 from core.langsmith.versioning import PromptManager
+from core.langchain.usage import UsageStats, summarize_usage
+from core.langchain.speculation import arun_speculative, run_speculative
+from core.langchain.local_router import local_router
+from core.langchain.admission import with_admission
+from core.langchain.resilience import track_served_model, with_deadline, with_hedging
+from core.langchain.circuit_breaker import (
+    atrack_stream,
+    is_transient,
+    track_call,
+    track_stream,
+    with_circuit_breaker,
+    with_model_fallback,
+)
+from core.langsmith.prompts import PLANNER_FALLBACK_INSTRUCTIONS, STRUCTURED_OUTPUT_INSTRUCTIONS
+from core.langchain.tracing import trace_stage
+from core.langchain.chunked import ChunkedPlanner, is_long_horizon
+from core.metrics import ROUTER_DECISIONS, STRUCTURED_OUTPUT
 
 logger = logging.getLogger(__name__)
 
+RENDER_MODES = ("template", "llm")
+
+# Latency / token cost của từng render mode
+render_stats = UsageStats()
+
+
+def model_name(use_pro: bool) -> str:
+    return "gemini-2.5-pro" if use_pro else "gemini-2.5-flash"
+
+
+def build_planner_inputs(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Inputs cho planner prompt từ request data"""
+    return {
+        "user_input": data["user_input"],
+        "current_date": datetime.now().strftime("%Y-%m-%d"),
+        "study_hours_per_day": data.get("study_hours_per_day", "3-4"),
+        "available_days": data.get("available_days", "Tất cả các ngày"),
+    }
+
+
+def route_locally(user_input: str) -> Tuple[Optional[RouterDecision], bool]:
+    """
+    Local router (nếu bật)
+    
+    Returns:
+        (decision, confident) - (None, False) khi LOCAL_ROUTER_ENABLED tắt
+    """
+    if not settings.LOCAL_ROUTER_ENABLED:
+        return None, False
+    with trace_stage("router_local", model="local"):
+        return local_router.route(user_input)
+
+
+def log_router_decision(router_result: Dict[str, Any]) -> None:
+    """Log + metrics cho quyết định của router (local hoặc LLM)"""
+    complexity = router_result.get("complexity", "easy")
+    ROUTER_DECISIONS.inc(complexity=complexity, source=router_result.get("source", "llm"))
+    logger.info(
+        f"Router decision: {complexity} "
+        f"(confidence: {router_result.get('confidence', 0)})"
+    )
+
+
+def structured_output_chain(
+    prompt: Runnable, llm, guard: OutputGuard, name: str, model: Optional[str] = None
+) -> Runnable:
+    """
+    prompt | llm với guard.model_class làm response schema (JSON mode)
+    
+    Output không khớp schema → parse raw text bằng guard (cùng parser /
+    repair như text mode), không gọi lại LLM. model: chỉ LLM call tính vào
+    breaker của model đó (không tính repair).
+    
+    Returns:
+        Chain that outputs guard.model_class instance
+    """
+    structured = prompt | llm.with_structured_output(
+        guard.model_class, method="json_schema", include_raw=True
+    )
+    
+    def unwrap(result: Dict[str, Any]) -> Optional[str]:
+        if result.get("parsed") is not None:
+            STRUCTURED_OUTPUT.inc(chain=name, outcome="ok")
+            return None
+        logger.warning(f"Structured output of {name} failed validation: {result.get('parsing_error')}")
+        STRUCTURED_OUTPUT.inc(chain=name, outcome="parse_fallback")
+        return str(result["raw"].content)
+    
+    def invoke(inputs, config):
+        with track_call(model):
+            result = structured.invoke(inputs, config)
+        text = unwrap(result)
+        return result["parsed"] if text is None else guard.parse(text)
+    
+    async def ainvoke(inputs, config):
+        with track_call(model):
+            result = await structured.ainvoke(inputs, config)
+        text = unwrap(result)
+        # guard.parse có thể gọi repair (sync LLM call)
+        return result["parsed"] if text is None else await asyncio.to_thread(guard.parse, text)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"structured_{name}")
+
+
+def should_use_text_path(name: str, error: Exception) -> bool:
+    """
+    Structured call lỗi → chạy lại bằng text path? (vd. schema không được hỗ trợ)
+    
+    Lỗi tạm thời (429 / 5xx / timeout) thì không: để retry + breaker xử lý.
+    """
+    if is_transient(error):
+        return False
+    logger.warning(f"Structured output of {name} failed, using text path: {error}")
+    STRUCTURED_OUTPUT.inc(chain=name, outcome="error_fallback")
+    return True
+
+
+def with_text_fallback(structured: Runnable, text_chain: Runnable, name: str) -> Runnable:
+    """structured lỗi (không phải lỗi tạm thời) → text_chain"""
+    def invoke(inputs, config):
+        try:
+            return structured.invoke(inputs, config)
+        except Exception as e:
+            if not should_use_text_path(name, e):
+                raise
+        return text_chain.invoke(inputs, config)
+    
+    async def ainvoke(inputs, config):
+        try:
+            return await structured.ainvoke(inputs, config)
+        except Exception as e:
+            if not should_use_text_path(name, e):
+                raise
+        return await text_chain.ainvoke(inputs, config)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"text_fallback_{name}")
+
+
+def invoke_llm_router(
+    router_chain: Runnable,
+    user_input: str,
+    local_decision: Optional[RouterDecision] = None,
+) -> Dict[str, Any]:
+    """Gọi Router LLM, ghi nhận độ đồng thuận với local router"""
+    start = time.perf_counter()
+    with trace_stage("router", prompt="router"):
+        result = {**router_chain.invoke({"user_input": user_input}), "source": "llm"}
+    if local_decision is not None:
+        local_router.record_fallback(
+            local_decision, result, (time.perf_counter() - start) * 1000
+        )
+    return result
+
+
+async def ainvoke_llm_router(
+    router_chain: Runnable,
+    user_input: str,
+    local_decision: Optional[RouterDecision] = None,
+) -> Dict[str, Any]:
+    """Async version of invoke_llm_router"""
+    start = time.perf_counter()
+    with trace_stage("router", prompt="router"):
+        result = {**await router_chain.ainvoke({"user_input": user_input}), "source": "llm"}
+    if local_decision is not None:
+        local_router.record_fallback(
+            local_decision, result, (time.perf_counter() - start) * 1000
+        )
+    return result
+
+
+def render_plan(
+    plan: Dict[str, Any],
+    render_mode: Optional[str],
+    coder_chain: Runnable,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Render HTML from plan
+    
+    render_mode:
+    - template: render local bằng generate_plan_html, không gọi LLM
+    - llm: gọi coder chain một lần với plan JSON đã minify
+    
+    Returns:
+        (html, render_info)
+    """
+    render_mode = render_mode or settings.PLAN_RENDER_MODE
+    usage_handler = UsageMetadataCallbackHandler()
+    start = time.perf_counter()
+    
+    if render_mode == "llm":
+        with trace_stage("coder", prompt="coder"):
+            html = coder_chain.invoke(_coder_inputs(plan), config={"callbacks": [usage_handler]})
+    else:
+        with trace_stage("html_render"):
+            html = generate_plan_html(plan)
+    
+    return html, _record_render(render_mode, start, usage_handler)
+
+
+async def arender_plan(
+    plan: Dict[str, Any],
+    render_mode: Optional[str],
+    coder_chain: Runnable,
+) -> Tuple[str, Dict[str, Any]]:
+    """Async version of render_plan"""
+    render_mode = render_mode or settings.PLAN_RENDER_MODE
+    usage_handler = UsageMetadataCallbackHandler()
+    start = time.perf_counter()
+    
+    if render_mode == "llm":
+        with trace_stage("coder", prompt="coder"):
+            html = await coder_chain.ainvoke(_coder_inputs(plan), config={"callbacks": [usage_handler]})
+    else:
+        with trace_stage("html_render"):
+            html = generate_plan_html(plan)
+    
+    return html, _record_render(render_mode, start, usage_handler)
+
+
+def _coder_inputs(plan: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "plan_json": json.dumps(plan, ensure_ascii=False, separators=(",", ":")),
+        "theme": "light",
+        "accent_color": plan.get("subjects", [{}])[0].get("color", "#3b82f6"),
+        "layout": "calendar",
+    }
+
+
+def _record_render(
+    render_mode: str,
+    start: float,
+    usage_handler: UsageMetadataCallbackHandler,
+) -> Dict[str, Any]:
+    latency_ms = (time.perf_counter() - start) * 1000
+    usage = summarize_usage(usage_handler)
+    render_stats.record(render_mode, latency_ms=latency_ms, usage=usage)
+    
+    return {
+        "mode": render_mode,
+        "latency_ms": round(latency_ms, 1),
+        **usage,
+    }
+
+
+def schedule_locally(constraints: PlanConstraints) -> Dict[str, Any]:
+    """Xếp lịch từ constraints đã trích (local scheduler, không gọi LLM)"""
+    with trace_stage("scheduler", model="local"):
+        return schedule_plan(constraints).model_dump()
+
 
 class ChainFactory:
     """Factory for creating LangChain chains with guards"""
@@ -33,44 +289,217 @@ class ChainFactory:
         Returns:
             Chain that outputs RouterDecision
         """
-        prompt = PromptManager.get_prompt("router")
+        prompt = PromptManager.get_prompt(
+            "router", version=PromptManager.get_configured_version("router")
+        )
         llm = InputGuard.get_safe_llm_flash(temperature=0)
         
         chain = prompt | llm | StrOutputParser() | RunnableLambda(
             lambda x: router_guard.parse(x).model_dump()
         )
+        if settings.LLM_STRUCTURED_OUTPUT:
+            structured = structured_output_chain(prompt, llm, router_guard, "router") | RunnableLambda(
+                lambda decision: decision.model_dump()
+            )
+            chain = with_text_fallback(structured, chain, "router")
         
-        return chain
+        return with_circuit_breaker(chain, model_name(False))
     
     @staticmethod
-    def create_planner_chain(use_pro: bool = False):
+    def create_planner_text_chain(use_pro: bool = False, fallback: bool = False):
         """
-        Create Planner chain với guards
+        Create Planner chain trả về raw text (chưa parse)
+        
+        Dùng cho streaming: tokens được đẩy ra client trước khi plan
+        hoàn chỉnh rồi mới qua Output Guard.
         
         Args:
             use_pro: True để dùng Gemini Pro cho Hard tasks
-            
+            fallback: Flash thay Pro cho Hard tasks (prompt thêm hướng dẫn cho request phức tạp)
+        
         Returns:
-            Chain that outputs StudyPlan dict
+            Chain that outputs raw LLM text
+        """
+        format_instructions = study_plan_guard.get_format_instructions()
+        prompt = ChainFactory._planner_prompt(format_instructions, fallback)
+        return prompt | ChainFactory._planner_llm(use_pro) | StrOutputParser()
+    
+    @staticmethod
+    def create_planner_structured_chain(use_pro: bool = False, fallback: bool = False):
         """
-        prompt = PromptManager.get_prompt("planner")
+        Create Planner chain dùng StudyPlan làm response schema
+        
+        Prompt không chứa schema (STRUCTURED_OUTPUT_INSTRUCTIONS thay format instructions).
         
-        # Inject format instructions
-        prompt = prompt.partial(
-            format_instructions=study_plan_guard.get_format_instructions()
+        Returns:
+            Chain that outputs StudyPlan
+        """
+        prompt = ChainFactory._planner_prompt(STRUCTURED_OUTPUT_INSTRUCTIONS, fallback)
+        stage = "planner_fallback" if fallback else "planner_pro" if use_pro else "planner_flash"
+        return structured_output_chain(
+            prompt, ChainFactory._planner_llm(use_pro), study_plan_guard, stage, model=model_name(use_pro)
         )
+    
+    @staticmethod
+    def create_extract_chain(use_pro: bool = False, fallback: bool = False):
+        """
+        Create chain trích PlanConstraints (môn, giờ, deadline, ngày rảnh) trả về raw text
+        
+        Lịch từng ngày do local scheduler xếp (schedule_locally).
+        """
+        prompt = ChainFactory._planner_prompt(
+            plan_constraints_guard.get_format_instructions(), fallback, name="planner_extract"
+        )
+        return prompt | ChainFactory._planner_llm(use_pro) | StrOutputParser()
+    
+    @staticmethod
+    def create_chunked_planner(use_pro: bool = False, fallback: bool = False) -> ChunkedPlanner:
+        """
+        Create Planner cho kế hoạch dài hạn: outline call + week calls song song
         
+        Returns:
+            ChunkedPlanner that outputs StudyPlan
+        """
+        llm = ChainFactory._planner_llm(use_pro)
+        outline_prompt = ChainFactory._planner_prompt(
+            plan_outline_guard.get_format_instructions(), fallback, name="planner_outline"
+        )
+        week_prompt = ChainFactory._planner_prompt(
+            week_schedule_guard.get_format_instructions(), fallback, name="planner_week"
+        )
+        return ChunkedPlanner(
+            outline_prompt | llm | StrOutputParser(),
+            week_prompt | llm | StrOutputParser(),
+            model=model_name(use_pro),
+        )
+    
+    @staticmethod
+    def _planner_prompt(format_instructions: str, fallback: bool = False, name: str = "planner"):
+        prompt = PromptManager.get_prompt(
+            name, version=PromptManager.get_configured_version(name)
+        )
+        if fallback:
+            format_instructions = f"{format_instructions}\n\n{PLANNER_FALLBACK_INSTRUCTIONS}"
+        return prompt.partial(format_instructions=format_instructions)
+    
+    @staticmethod
+    def _planner_llm(use_pro: bool = False):
         # Choose model based on complexity
         if use_pro:
-            llm = InputGuard.get_safe_llm_pro(temperature=0.7)
-        else:
-            llm = InputGuard.get_safe_llm_flash(temperature=0.7)
+            return InputGuard.get_safe_llm_pro(temperature=0.7)
+        return InputGuard.get_safe_llm_flash(temperature=0.7)
+    
+    @staticmethod
+    def create_planner_chain(
+        use_pro: bool = False,
+        text_chain: Optional[Runnable] = None,
+        fallback: bool = False,
+    ):
+        """
+        Create Planner chain với guards
         
-        chain = prompt | llm | StrOutputParser() | RunnableLambda(
-            lambda x: study_plan_guard.parse(x).model_dump()
+        Args:
+            use_pro: True để dùng Gemini Pro cho Hard tasks
+            text_chain: Planner text chain đã build sẵn (None → build mới)
+            fallback: Flash planner cho Hard tasks khi Pro không khả dụng
+        
+        Returns:
+            Chain that outputs StudyPlan dict
+        """
+        text_chain = text_chain or ChainFactory.create_planner_text_chain(use_pro, fallback)
+        stage = "planner_fallback" if fallback else "planner_pro" if use_pro else "planner_flash"
+        model = model_name(use_pro)
+        structured = (
+            ChainFactory.create_planner_structured_chain(use_pro, fallback)
+            if settings.LLM_STRUCTURED_OUTPUT else None
+        )
+        chunked = (
+            ChainFactory.create_chunked_planner(use_pro, fallback)
+            if settings.PLANNER_CHUNKED_ENABLED else None
+        )
+        extract_chain = (
+            ChainFactory.create_extract_chain(use_pro, fallback)
+            if settings.PLANNER_LOCAL_SCHEDULER else None
         )
         
-        return chain
+        # Parse trong lúc stream: output hỏng → dừng LLM call sớm
+        # Breaker chỉ tính LLM stream / call, không tính parse và repair (Flash) sau đó
+        def parse(inputs: Dict[str, Any], config) -> Dict[str, Any]:
+            with trace_stage(stage, model=model, prompt="planner"):
+                if extract_chain is not None:
+                    constraints = plan_constraints_guard.parse_stream(
+                        track_stream(extract_chain.stream(inputs, config), model)
+                    )
+                    return schedule_locally(constraints)
+                if chunked is not None and is_long_horizon(inputs["user_input"]):
+                    return chunked.invoke(inputs, config).model_dump()
+                if structured is not None:
+                    try:
+                        return structured.invoke(inputs, config).model_dump()
+                    except Exception as e:
+                        if not should_use_text_path(stage, e):
+                            raise
+                plan = study_plan_guard.parse_stream(track_stream(text_chain.stream(inputs, config), model))
+            return plan.model_dump()
+        
+        async def aparse(inputs: Dict[str, Any], config) -> Dict[str, Any]:
+            with trace_stage(stage, model=model, prompt="planner"):
+                if extract_chain is not None:
+                    constraints = await plan_constraints_guard.aparse_stream(
+                        atrack_stream(extract_chain.astream(inputs, config), model)
+                    )
+                    return schedule_locally(constraints)
+                if chunked is not None and is_long_horizon(inputs["user_input"]):
+                    return (await chunked.ainvoke(inputs, config)).model_dump()
+                if structured is not None:
+                    try:
+                        return (await structured.ainvoke(inputs, config)).model_dump()
+                    except Exception as e:
+                        if not should_use_text_path(stage, e):
+                            raise
+                plan = await study_plan_guard.aparse_stream(
+                    atrack_stream(text_chain.astream(inputs, config), model)
+                )
+            return plan.model_dump()
+        
+        chain = RunnableLambda(parse, afunc=aparse)
+        
+        # Retry lỗi tạm thời quanh cả stage; breaker đã tính từng LLM call ở trên
+        return with_circuit_breaker(chain, model, track_calls=False)
+    
+    @staticmethod
+    def create_refiner_chain(use_pro: bool = False):
+        """
+        Create Refiner chain (REFINE_PROMPT) cho regenerate
+        
+        Inputs: refiner_inputs(...) của core/langchain/regenerate.py
+        
+        Returns:
+            Chain that outputs StudyPlan dict
+        """
+        prompt = PromptManager.get_prompt(
+            "refiner", version=PromptManager.get_configured_version("refiner")
+        ).partial(format_instructions=study_plan_guard.get_format_instructions())
+        text_chain = prompt | ChainFactory._planner_llm(use_pro) | StrOutputParser()
+        
+        model = model_name(use_pro)
+        
+        def parse(inputs: Dict[str, Any], config) -> Dict[str, Any]:
+            with trace_stage("refiner", model=model, prompt="refiner"):
+                plan = study_plan_guard.parse_stream(track_stream(text_chain.stream(inputs, config), model))
+            return plan.model_dump()
+        
+        async def aparse(inputs: Dict[str, Any], config) -> Dict[str, Any]:
+            with trace_stage("refiner", model=model, prompt="refiner"):
+                plan = await study_plan_guard.aparse_stream(
+                    atrack_stream(text_chain.astream(inputs, config), model)
+                )
+            return plan.model_dump()
+        
+        chain = with_circuit_breaker(RunnableLambda(parse, afunc=aparse), model, track_calls=False)
+        chain = with_admission(chain, "pro" if use_pro else "flash")
+        # Cùng timeout với planner của model đó
+        return with_deadline(chain, "planner_pro" if use_pro else "planner_flash")
     
     @staticmethod
     def create_coder_chain():
@@ -80,85 +509,311 @@ class ChainFactory:
         Returns:
             Chain that outputs HTML string
         """
-        prompt = PromptManager.get_prompt("coder")
+        prompt = PromptManager.get_prompt(
+            "coder", version=PromptManager.get_configured_version("coder")
+        )
         llm = InputGuard.get_safe_llm_flash(temperature=0.5)
         
         chain = prompt | llm | StrOutputParser()
         
-        return chain
+        return with_circuit_breaker(chain, model_name(False))
     
     @staticmethod
-    def create_full_chain():
+    def create_full_chain(
+        router_chain: Optional[Runnable] = None,
+        planner_easy: Optional[Runnable] = None,
+        planner_hard: Optional[Runnable] = None,
+        coder_chain: Optional[Runnable] = None,
+        planner_fallback: Optional[Runnable] = None,
+    ):
         """
         Create full chain: Input → Router → Planner → Coder
         
+        Args:
+            router_chain, planner_easy, planner_hard, coder_chain, planner_fallback:
+                Chains đã build sẵn (từ ChainRegistry). Nếu None sẽ build mới.
+        
         Returns:
             Chain that takes user_input and returns {plan, html}
         """
-        router_chain = ChainFactory.create_router_chain()
-        planner_easy = ChainFactory.create_planner_chain(use_pro=False)
-        planner_hard = ChainFactory.create_planner_chain(use_pro=True)
-        coder_chain = ChainFactory.create_coder_chain()
+        router_chain = router_chain or ChainFactory.create_router_chain()
+        planner_easy = planner_easy or ChainFactory.create_planner_chain(use_pro=False)
+        planner_hard = planner_hard or ChainFactory.create_planner_chain(use_pro=True)
+        coder_chain = coder_chain or ChainFactory.create_coder_chain()
+        planner_fallback = planner_fallback or ChainFactory.create_planner_chain(use_pro=False, fallback=True)
+        
+        # Mỗi planner/coder call cần slot của lane tương ứng (Router LLM ngắn, không giới hạn)
+        planner_easy = with_admission(planner_easy, "flash")
+        planner_hard = with_admission(planner_hard, "pro")
+        coder_chain = with_admission(coder_chain, "flash")
+        
+        # Pro bị rate limit / breaker open / chậm (hedge) → Flash với prompt cho request phức tạp
+        planner_fallback = with_admission(planner_fallback, "flash")
+        planner_hard = with_model_fallback(
+            planner_hard,
+            planner_fallback,
+            primary_model=model_name(True),
+            fallback_model=model_name(False),
+        )
+        
+        # Timeout từng stage theo deadline của request + hedging khi bật (resilience.py)
+        router_chain = with_deadline(with_hedging(router_chain, "router"), "router")
+        planner_hard = with_deadline(
+            with_hedging(planner_hard, "planner_pro", fallback=planner_fallback, fallback_model=model_name(False)),
+            "planner_pro",
+        )
+        planner_easy = with_deadline(with_hedging(planner_easy, "planner_flash"), "planner_flash")
+        coder_chain = with_deadline(with_hedging(coder_chain, "coder"), "coder")
         
         def route_to_planner(data: Dict[str, Any]) -> Dict[str, Any]:
             """Route based on complexity"""
             user_input = data["user_input"]
+            planner_inputs = build_planner_inputs(data)
+            local_decision, confident = route_locally(user_input)
             
-            # Run router
-            router_result = router_chain.invoke({"user_input": user_input})
-            complexity = router_result.get("complexity", "easy")
+            with track_served_model() as served:
+                if confident:
+                    # Local router đủ tự tin → bỏ qua Router LLM
+                    router_result = {**local_decision.model_dump(), "source": "local"}
+                    use_pro = local_decision.complexity == "hard"
+                    plan = (planner_hard if use_pro else planner_easy).invoke(planner_inputs)
+                elif settings.ROUTER_SPECULATIVE_PLANNER:
+                    # Flash planner chạy song song với Router
+                    router_result, plan, use_pro = run_speculative(
+                        RunnableLambda(
+                            lambda x: invoke_llm_router(router_chain, x["user_input"], local_decision)
+                        ),
+                        planner_easy,
+                        planner_hard,
+                        user_input,
+                        planner_inputs,
+                    )
+                else:
+                    # Run router, then the chosen planner
+                    router_result = invoke_llm_router(router_chain, user_input, local_decision)
+                    use_pro = router_result.get("complexity", "easy") == "hard"
+                    plan = (planner_hard if use_pro else planner_easy).invoke(planner_inputs)
             
-            logger.info(f"Router decision: {complexity} (confidence: {router_result.get('confidence', 0)})")
-            
-            # Choose planner based on complexity
-            if complexity == "hard":
-                plan = planner_hard.invoke({
-                    "user_input": user_input,
-                    "current_date": datetime.now().strftime("%Y-%m-%d"),
-                    "study_hours_per_day": data.get("study_hours_per_day", "3-4"),
-                    "available_days": data.get("available_days", "Tất cả các ngày"),
-                })
-            else:
-                plan = planner_easy.invoke({
-                    "user_input": user_input,
-                    "current_date": datetime.now().strftime("%Y-%m-%d"),
-                    "study_hours_per_day": data.get("study_hours_per_day", "3-4"),
-                    "available_days": data.get("available_days", "Tất cả các ngày"),
-                })
+            log_router_decision(router_result)
             
             return {
                 "plan": plan,
                 "router_decision": router_result,
-                "model_used": "gemini-2.5-pro" if complexity == "hard" else "gemini-2.5-flash",
+                "model_used": served.get("model", model_name(use_pro)),
+                "render_mode": data.get("render_mode"),
             }
         
-        def generate_html(data: Dict[str, Any]) -> Dict[str, Any]:
-            """Generate HTML from plan"""
-            import json
+        async def aroute_to_planner(data: Dict[str, Any]) -> Dict[str, Any]:
+            """Async version of route_to_planner"""
+            user_input = data["user_input"]
+            planner_inputs = build_planner_inputs(data)
+            local_decision, confident = route_locally(user_input)
             
-            plan = data["plan"]
+            with track_served_model() as served:
+                if confident:
+                    router_result = {**local_decision.model_dump(), "source": "local"}
+                    use_pro = local_decision.complexity == "hard"
+                    plan = await (planner_hard if use_pro else planner_easy).ainvoke(planner_inputs)
+                elif settings.ROUTER_SPECULATIVE_PLANNER:
+                    router_result, plan, use_pro = await arun_speculative(
+                        RunnableLambda(
+                            lambda x: invoke_llm_router(router_chain, x["user_input"], local_decision),
+                            afunc=lambda x: ainvoke_llm_router(router_chain, x["user_input"], local_decision),
+                        ),
+                        planner_easy,
+                        planner_hard,
+                        user_input,
+                        planner_inputs,
+                    )
+                else:
+                    router_result = await ainvoke_llm_router(router_chain, user_input, local_decision)
+                    use_pro = router_result.get("complexity", "easy") == "hard"
+                    plan = await (planner_hard if use_pro else planner_easy).ainvoke(planner_inputs)
             
-            html = coder_chain.invoke({
-                "plan_json": json.dumps(plan, ensure_ascii=False, indent=2),
-                "theme": "light",
-                "accent_color": plan.get("subjects", [{}])[0].get("color", "#3b82f6"),
-                "layout": "calendar",
-            })
+            log_router_decision(router_result)
             
             return {
-                **data,
-                "html": html,
+                "plan": plan,
+                "router_decision": router_result,
+                # Flash thay Pro (fallback / thắng hedge) → báo đúng model đã trả kết quả
+                "model_used": served.get("model", model_name(use_pro)),
+                "render_mode": data.get("render_mode"),
             }
         
-        # Build full chain
+        def generate_html(data: Dict[str, Any]) -> Dict[str, Any]:
+            """Render HTML from plan (xem render_plan)"""
+            html, render = render_plan(data["plan"], data.get("render_mode"), coder_chain)
+            return {**data, "html": html, "render": render}
+        
+        async def agenerate_html(data: Dict[str, Any]) -> Dict[str, Any]:
+            html, render = await arender_plan(data["plan"], data.get("render_mode"), coder_chain)
+            return {**data, "html": html, "render": render}
+        
+        # Build full chain (invoke/batch chạy sync, ainvoke/abatch chạy async)
         full_chain = (
-            RunnableLambda(route_to_planner)
-            | RunnableLambda(generate_html)
+            RunnableLambda(route_to_planner, afunc=aroute_to_planner)
+            | RunnableLambda(generate_html, afunc=agenerate_html)
         )
         
         return full_chain
 
 
+class ChainRegistry:
+    """
+    Process-wide registry cho các chains đã build sẵn
+    
+    Router, planners và coder (cùng các ChatGoogleGenerativeAI clients và
+    prompts bên trong) được build một lần rồi dùng chung cho mọi request.
+    Runnables không đổi sau khi build nên chia sẻ an toàn giữa threads và
+    async tasks; lock chỉ bảo vệ lúc build/rebuild.
+    
+    Usage:
+        chain_registry.warm()               # startup
+        chain = chain_registry.get("full")  # request path
+        chain_registry.rebuild()            # sau khi đổi prompt version / settings
+    """
+    
+    CHAIN_NAMES = (
+        "router",
+        "planner_easy",
+        "planner_hard",
+        "planner_easy_text",
+        "planner_hard_text",
+        "planner_fallback",
+        "planner_fallback_text",
+        "coder",
+        "refiner_easy",
+        "refiner_hard",
+        "full",
+    )
+    
+    # Prompts mà chains (và repair của Output Guard) pull từ PromptManager
+    PROMPT_NAMES = (
+        "router",
+        "planner",
+        "planner_extract",
+        "planner_outline",
+        "planner_week",
+        "coder",
+        "refiner",
+        "repair",
+    )
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chains: Optional[Dict[str, Runnable]] = None
+        self._generation = 0
+    
+    @property
+    def is_built(self) -> bool:
+        return self._chains is not None
+    
+    @property
+    def generation(self) -> int:
+        """Số lần registry đã được build (tăng sau mỗi rebuild)"""
+        return self._generation
+    
+    def get(self, name: str) -> Runnable:
+        """
+        Lấy chain đã build, build lần đầu nếu cần
+        
+        Args:
+            name: router | planner_easy | planner_hard | planner_easy_text |
+                  planner_hard_text | planner_fallback | planner_fallback_text |
+                  coder | refiner_easy | refiner_hard | full
+        """
+        chains = self._chains
+        if chains is None:
+            chains = self._ensure_built()
+        
+        if name not in chains:
+            raise KeyError(f"Unknown chain: {name}")
+        return chains[name]
+    
+    def warm(self) -> None:
+        """Pull prompts và build tất cả chains trước khi nhận request"""
+        versions = getattr(settings, "PROMPT_VERSIONS", {}) or {}
+        PromptManager.prefetch(list(dict.fromkeys([*self.PROMPT_NAMES, *versions])))
+        self._ensure_built()
+    
+    def rebuild(self) -> None:
+        """
+        Build lại toàn bộ chains (prompt versions hoặc settings đã đổi)
+        
+        Request đang chạy tiếp tục dùng chains cũ; request mới nhận chains mới.
+        """
+        with self._lock:
+            self._chains = self._build()
+            self._generation += 1
+        logger.info(f"Chain registry rebuilt (generation {self._generation})")
+    
+    def clear(self) -> None:
+        """Bỏ chains hiện tại, lần get() tiếp theo sẽ build lại"""
+        with self._lock:
+            self._chains = None
+    
+    def _ensure_built(self) -> Dict[str, Runnable]:
+        with self._lock:
+            if self._chains is None:
+                self._chains = self._build()
+                self._generation += 1
+                logger.info(f"Chain registry built (generation {self._generation})")
+            return self._chains
+    
+    @staticmethod
+    def _build() -> Dict[str, Runnable]:
+        router_chain = ChainFactory.create_router_chain()
+        planner_easy_text = ChainFactory.create_planner_text_chain(use_pro=False)
+        planner_hard_text = ChainFactory.create_planner_text_chain(use_pro=True)
+        planner_easy = ChainFactory.create_planner_chain(use_pro=False, text_chain=planner_easy_text)
+        planner_hard = ChainFactory.create_planner_chain(use_pro=True, text_chain=planner_hard_text)
+        planner_fallback_text = ChainFactory.create_planner_text_chain(use_pro=False, fallback=True)
+        planner_fallback = ChainFactory.create_planner_chain(
+            use_pro=False, text_chain=planner_fallback_text, fallback=True
+        )
+        coder_chain = ChainFactory.create_coder_chain()
+        refiner_easy = ChainFactory.create_refiner_chain(use_pro=False)
+        
+        return {
+            "router": router_chain,
+            "planner_easy": planner_easy,
+            "planner_hard": planner_hard,
+            "planner_easy_text": planner_easy_text,
+            "planner_hard_text": planner_hard_text,
+            "planner_fallback": planner_fallback,
+            "planner_fallback_text": planner_fallback_text,
+            "coder": coder_chain,
+            "refiner_easy": refiner_easy,
+            # Pro bị rate limit / breaker open → Flash
+            "refiner_hard": with_model_fallback(
+                ChainFactory.create_refiner_chain(use_pro=True),
+                refiner_easy,
+                primary_model=model_name(True),
+                fallback_model=model_name(False),
+            ),
+            "full": ChainFactory.create_full_chain(
+                router_chain=router_chain,
+                planner_easy=planner_easy,
+                planner_hard=planner_hard,
+                coder_chain=coder_chain,
+                planner_fallback=planner_fallback,
+            ),
+        }
+
+
+# Singleton instance
+chain_registry = ChainRegistry()
+
+
+def _on_prompt_changed(name: str, version: str) -> None:
+    """Prompt trên hub đổi → build lại chains đang dùng bản cũ"""
+    if chain_registry.is_built:
+        chain_registry.rebuild()
+
+
+PromptManager.add_change_listener(_on_prompt_changed)
+
+
 def create_safe_generation_chain():
     """
     Create full generation chain with Input Guard
@@ -173,10 +828,17 @@ def create_safe_generation_chain():
         if not is_safe:
             raise ValueError(f"Input blocked: {reason}")
         
-        # Run full chain
-        full_chain = ChainFactory.create_full_chain()
+        # Run full chain (built once per process)
+        full_chain = chain_registry.get("full")
         result = full_chain.invoke(data)
         
         return result
     
-    return RunnableLambda(validate_and_generate)
+    async def avalidate_and_generate(data: Dict[str, Any]) -> Dict[str, Any]:
+        is_safe, reason = InputGuard.check_input(data.get("user_input", ""))
+        if not is_safe:
+            raise ValueError(f"Input blocked: {reason}")
+        
+        return await chain_registry.get("full").ainvoke(data)
+    
+    return RunnableLambda(validate_and_generate, afunc=avalidate_and_generate)
@@ -0,0 +1,257 @@
+"""
+Chunked Planner - Kế hoạch dài hạn (vài tháng / học kỳ) theo từng tuần
+
+Một StudyPlan hàng chục ngày = một output JSON rất dài: output tokens quyết
+định latency, và output càng dài càng dễ bị cắt / parse lỗi. Thay vào đó:
+
+1. Outline call: subjects, milestones, mục tiêu + giờ học theo môn của từng tuần
+2. Week calls: lịch từng ngày của mỗi tuần, chạy song song (tối đa
+   PLANNER_CHUNK_CONCURRENCY), mỗi tuần được validate riêng
+3. Merge thành một StudyPlan
+
+Wall time ≈ outline + tuần chậm nhất, không tăng theo độ dài kế hoạch.
+Chỉ áp dụng cho input dài hạn (feature long_horizon của local router).
+"""
+
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from langchain_core.runnables import Runnable
+
+from planner.guards.output_guard import (
+    PlanOutline,
+    StudyPlan,
+    WeekAllocation,
+    WeekSchedule,
+    plan_outline_guard,
+    week_schedule_guard,
+)
+from core.langchain.circuit_breaker import atrack_stream, track_stream
+from core.langchain.local_router import extract_features
+from core.langchain.tracing import trace_stage
+
+logger = logging.getLogger(__name__)
+
+# (week number, ngày đầu, ngày cuối, allocation của outline nếu có)
+WeekWindow = Tuple[int, date, date, Optional[WeekAllocation]]
+
+
+def is_long_horizon(user_input: str) -> bool:
+    """Input nói về vài tháng / học kỳ → chunked planning"""
+    return bool(extract_features(user_input)["long_horizon"])
+
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def week_windows(outline: PlanOutline, max_weeks: int) -> List[WeekWindow]:
+    """Các block 7 ngày từ start_date tới end_date (tối đa max_weeks)"""
+    start, end = _parse_date(outline.start_date), _parse_date(outline.end_date)
+    allocations = {week.week: week for week in outline.weeks}
+    count = min(math.ceil(((end - start).days + 1) / 7), max_weeks)
+    
+    windows = []
+    for index in range(count):
+        week_start = start + timedelta(days=7 * index)
+        week_end = min(week_start + timedelta(days=6), end)
+        windows.append((index + 1, week_start, week_end, allocations.get(index + 1)))
+    return windows
+
+
+def week_inputs(inputs: Dict[str, Any], outline_json: str, window: WeekWindow) -> Dict[str, Any]:
+    """Inputs cho planner_week prompt"""
+    number, week_start, week_end, allocation = window
+    return {
+        "user_input": inputs["user_input"],
+        "study_hours_per_day": inputs.get("study_hours_per_day", "3-4"),
+        "available_days": inputs.get("available_days", "Tất cả các ngày"),
+        "outline": outline_json,
+        "week_number": number,
+        "week_start": week_start.isoformat(),
+        "week_end": week_end.isoformat(),
+        "week_focus": allocation.focus if allocation else "Theo outline",
+        "week_hours": json.dumps(allocation.hours if allocation else {}, ensure_ascii=False),
+    }
+
+
+def outline_for_prompt(outline: PlanOutline) -> str:
+    """Outline gửi cho mỗi week call (bỏ phân bổ các tuần khác và tips)"""
+    return json.dumps(
+        outline.model_dump(include={"title", "start_date", "end_date", "subjects", "milestones"}),
+        ensure_ascii=False,
+    )
+
+
+def merge_weeks(outline: PlanOutline, windows: List[WeekWindow], weeks: List[WeekSchedule]) -> StudyPlan:
+    """
+    Ghép outline + lịch từng tuần thành StudyPlan
+    
+    Ngày nằm ngoài tuần của nó hoặc trùng ngày đã có bị bỏ.
+    """
+    days = {}
+    for (_, week_start, week_end, _), week in zip(windows, weeks):
+        for day in week.schedule:
+            day_date = _parse_date(day.date)
+            if week_start <= day_date <= week_end and day.date not in days:
+                days[day.date] = day
+    
+    if not days:
+        raise ValueError("Cannot parse LLM output. Original error: chunked plan has no valid days")
+    
+    return StudyPlan(
+        title=outline.title,
+        start_date=outline.start_date,
+        end_date=min(outline.end_date, windows[-1][2].isoformat()),
+        subjects=outline.subjects,
+        schedule=[days[key] for key in sorted(days)],
+        milestones=outline.milestones,
+        tips=outline.tips,
+    )
+
+
+class ChunkedStats:
+    """Số tuần, thời gian tuần chậm nhất vs tổng các tuần (thread-safe)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {
+            "plans": 0,
+            "weeks": 0,
+            "outline_ms": 0.0,
+            "slowest_week_ms": 0.0,
+            "sum_week_ms": 0.0,
+            "total_ms": 0.0,
+        }
+    
+    def record(self, weeks: int, outline_ms: float, week_ms: List[float], total_ms: float) -> None:
+        with self._lock:
+            self._data["plans"] += 1
+            self._data["weeks"] += weeks
+            self._data["outline_ms"] += outline_ms
+            self._data["slowest_week_ms"] += max(week_ms, default=0.0)
+            self._data["sum_week_ms"] += sum(week_ms)
+            self._data["total_ms"] += total_ms
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._data)
+        plans = data["plans"] or 1
+        return {
+            "plans": data["plans"],
+            "avg_weeks": round(data["weeks"] / plans, 1),
+            "avg_outline_ms": round(data["outline_ms"] / plans, 1),
+            "avg_slowest_week_ms": round(data["slowest_week_ms"] / plans, 1),
+            # Thời gian nếu các tuần chạy tuần tự / thời gian thực tế
+            "parallel_speedup": (
+                round(data["sum_week_ms"] / data["slowest_week_ms"], 2) if data["slowest_week_ms"] else 0.0
+            ),
+            "avg_total_ms": round(data["total_ms"] / plans, 1),
+        }
+
+
+chunked_stats = ChunkedStats()
+
+
+class ChunkedPlanner:
+    """
+    Usage:
+        planner = ChunkedPlanner(outline_chain, week_chain)
+        plan = await planner.ainvoke(build_planner_inputs(data))   # StudyPlan
+    
+    outline_chain / week_chain là text chains (prompt | llm | StrOutputParser).
+    """
+    
+    def __init__(
+        self,
+        outline_chain: Runnable,
+        week_chain: Runnable,
+        model: Optional[str] = None,
+        concurrency: Optional[int] = None,
+    ):
+        self.outline_chain = outline_chain
+        self.week_chain = week_chain
+        self.model = model
+        self.concurrency = concurrency
+    
+    def _limits(self) -> Tuple[int, int]:
+        concurrency = self.concurrency or settings.PLANNER_CHUNK_CONCURRENCY
+        return max(concurrency, 1), settings.PLANNER_CHUNK_MAX_WEEKS
+    
+    def invoke(self, inputs: Dict[str, Any], config=None) -> StudyPlan:
+        started_at = time.perf_counter()
+        concurrency, max_weeks = self._limits()
+        
+        with trace_stage("planner_outline", model=self.model, prompt="planner_outline"):
+            outline = plan_outline_guard.parse_stream(
+                track_stream(self.outline_chain.stream(inputs, config), self.model)
+            )
+        outline_ms = (time.perf_counter() - started_at) * 1000
+        windows = week_windows(outline, max_weeks)
+        outline_json = outline_for_prompt(outline)
+        
+        def run_week(window: WeekWindow) -> Tuple[WeekSchedule, float]:
+            start = time.perf_counter()
+            with trace_stage("planner_week", model=self.model, prompt="planner_week"):
+                chunks = self.week_chain.stream(week_inputs(inputs, outline_json, window), config)
+                week = week_schedule_guard.parse_stream(track_stream(chunks, self.model))
+            return week, (time.perf_counter() - start) * 1000
+        
+        # Mỗi thread chạy trong bản copy context (trace / deadline của request)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="chunked-planner") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, run_week, window) for window in windows]
+            results = [future.result() for future in futures]
+        
+        return self._finish(outline, windows, results, outline_ms, started_at)
+    
+    async def ainvoke(self, inputs: Dict[str, Any], config=None) -> StudyPlan:
+        started_at = time.perf_counter()
+        concurrency, max_weeks = self._limits()
+        
+        with trace_stage("planner_outline", model=self.model, prompt="planner_outline"):
+            outline = await plan_outline_guard.aparse_stream(
+                atrack_stream(self.outline_chain.astream(inputs, config), self.model)
+            )
+        outline_ms = (time.perf_counter() - started_at) * 1000
+        windows = week_windows(outline, max_weeks)
+        outline_json = outline_for_prompt(outline)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_week(window: WeekWindow) -> Tuple[WeekSchedule, float]:
+            async with semaphore:
+                start = time.perf_counter()
+                with trace_stage("planner_week", model=self.model, prompt="planner_week"):
+                    chunks = self.week_chain.astream(week_inputs(inputs, outline_json, window), config)
+                    week = await week_schedule_guard.aparse_stream(atrack_stream(chunks, self.model))
+                return week, (time.perf_counter() - start) * 1000
+        
+        # Một tuần lỗi → cancel các tuần còn lại
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [group.create_task(run_week(window)) for window in windows]
+        except ExceptionGroup as group_error:
+            # Raise lỗi gốc (429 / timeout / ValueError) để retry, fallback, breaker
+            # và error mapping của view xử lý như call không chunk
+            raise group_error.exceptions[0]
+        results = [task.result() for task in tasks]
+        
+        return self._finish(outline, windows, results, outline_ms, started_at)
+    
+    def _finish(self, outline, windows, results, outline_ms: float, started_at: float) -> StudyPlan:
+        plan = merge_weeks(outline, windows, [week for week, _ in results])
+        total_ms = (time.perf_counter() - started_at) * 1000
+        chunked_stats.record(len(windows), outline_ms, [ms for _, ms in results], total_ms)
+        logger.info(
+            f"Chunked plan: {len(windows)} weeks, {len(plan.schedule)} days in {total_ms:.0f}ms "
+            f"(outline {outline_ms:.0f}ms)"
+        )
+        return plan
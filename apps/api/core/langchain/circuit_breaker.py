@@ -0,0 +1,420 @@
+"""
+Circuit Breaker - Theo dõi sức khỏe từng Gemini model, fallback Pro → Flash
+
+Mỗi model có một breaker với sliding window các calls gần đây. Failure =
+lỗi tạm thời (429 / 5xx / timeout) hoặc call chậm hơn slow_call_seconds
+(CIRCUIT_BREAKER_SLOW_CALL_RATIO × stage timeout của model). Lỗi output
+(parse, safety) không tính: model vẫn trả lời. Chains có parse / repair sau
+LLM call chỉ tính riêng LLM stream (track_stream), không tính parse / repair.
+
+States:
+- closed: bình thường
+- open: tỉ lệ failure vượt ngưỡng → từ chối ngay (CircuitOpen), không đợi timeout
+- half_open: hết open_seconds → cho một probe call; thành công → closed, lỗi → open
+
+Retries: lỗi tạm thời được thử lại với full-jitter backoff, không sớm hơn
+Retry-After của Gemini và không quá deadline của request.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+from django.conf import settings
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from core.langchain.resilience import mark_served_model, remaining
+from core.metrics import CIRCUIT_TRANSITIONS, LLM_RETRIES, MODEL_FALLBACKS
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_STATES = ("closed", "half_open", "open")
+
+# HTTP status của lỗi có thể hết khi thử lại
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Stage timeout làm mốc cho ngưỡng call chậm của từng model
+MODEL_STAGES = {
+    "gemini-2.5-pro": "planner_pro",
+    "gemini-2.5-flash": "planner_flash",
+}
+
+
+class CircuitOpen(Exception):
+    """Model đang bị breaker chặn"""
+    
+    def __init__(self, model: str, retry_after: int):
+        super().__init__(f"{model} circuit open")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def _error_chain(error: BaseException):
+    """error + chuỗi __cause__ (langchain_google_genai raise lại lỗi của SDK bằng `from e`)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    for item in _error_chain(error):
+        for attr in ("code", "status_code"):
+            value = getattr(item, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        response = getattr(item, "response", None)
+        value = getattr(response, "status_code", None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def retry_after_of(error: BaseException) -> float:
+    """Header Retry-After (giây) của response lỗi, 0 nếu không có"""
+    for item in _error_chain(error):
+        headers = getattr(getattr(item, "response", None), "headers", None)
+        if not headers:
+            continue
+        try:
+            return max(float(headers.get("Retry-After") or 0), 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+    return 0.0
+
+
+def is_transient(error: BaseException) -> bool:
+    """Quá tải / lỗi server / timeout: thử lại có thể thành công"""
+    if isinstance(error, CircuitOpen):
+        return False
+    for item in _error_chain(error):
+        if isinstance(item, (TimeoutError, httpx.TimeoutException, httpx.NetworkError)):
+            return True
+    return status_code_of(error) in TRANSIENT_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Usage:
+        with breaker.track():        # raise CircuitOpen nếu đang open
+            result = llm_call()
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque(maxlen=window)  # True = failure
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._stats = {
+            "calls": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "rejected": 0,
+            "opened": 0,
+        }
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+    
+    def is_open(self) -> bool:
+        """Đang chặn calls (chưa tới lúc probe)"""
+        return self.state == "open"
+    
+    def before_call(self) -> None:
+        """Raises CircuitOpen nếu call không được phép chạy"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return
+            # half_open: một probe tại một thời điểm (probe treo quá open_seconds → cho probe mới)
+            if state == "half_open" and (
+                self._probe_started_at is None or now - self._probe_started_at > self.open_seconds
+            ):
+                self._probe_started_at = now
+                return
+            self._stats["rejected"] += 1
+            retry_after = max(1, int(self._opened_at + self.open_seconds - now) + 1)
+        raise CircuitOpen(self.name, retry_after)
+    
+    def record(self, error: Optional[BaseException], elapsed: float) -> None:
+        """
+        Ghi kết quả một call
+        
+        Cancel (client ngắt / hết deadline / thua hedge) chỉ tính là failure
+        khi đã chậm quá slow_call_seconds.
+        """
+        slow = elapsed >= self.slow_call_seconds
+        cancelled = isinstance(error, (asyncio.CancelledError, GeneratorExit))
+        if cancelled and not slow:
+            with self._lock:
+                self._probe_started_at = None
+            return
+        failed = slow or (error is not None and is_transient(error))
+        
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += failed
+            self._stats["slow_calls"] += slow
+            state = self._current_state()
+            
+            if state == "half_open":
+                self._probe_started_at = None
+                self._outcomes.clear()
+                self._transition("open" if failed else "closed")
+                return
+            
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (
+                state == "closed"
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._transition("open")
+    
+    @contextmanager
+    def track(self):
+        """before_call() + record() quanh một call (dùng được quanh code async)"""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.record(e, time.monotonic() - start)
+            raise
+        self.record(None, time.monotonic() - start)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "state": self._current_state(),
+                "window_failure_rate": round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0,
+                **self._stats,
+            }
+    
+    # ============================================
+    # Internals (gọi khi đang giữ self._lock)
+    # ============================================
+    
+    def _current_state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition("half_open")
+        return self._state
+    
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self._state} → {state}")
+        CIRCUIT_TRANSITIONS.inc(model=self.name, from_state=self._state, to_state=state)
+        if state == "open":
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        self._state = state
+
+
+def slow_call_seconds(model: str) -> float:
+    """Ngưỡng call chậm của model (model lạ: stage timeout dài nhất)"""
+    stage = MODEL_STAGES.get(model)
+    timeout = settings.STAGE_TIMEOUTS[stage] if stage else max(settings.STAGE_TIMEOUTS.values())
+    return settings.CIRCUIT_BREAKER_SLOW_CALL_RATIO * timeout
+
+
+class CircuitBreakerRegistry:
+    """Một breaker cho mỗi model (tạo khi dùng lần đầu)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+    
+    def get(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(
+                    model,
+                    window=settings.CIRCUIT_BREAKER_WINDOW,
+                    min_calls=settings.CIRCUIT_BREAKER_MIN_CALLS,
+                    failure_rate=settings.CIRCUIT_BREAKER_FAILURE_RATE,
+                    slow_call_seconds=slow_call_seconds(model),
+                    open_seconds=settings.CIRCUIT_BREAKER_OPEN_SECONDS,
+                )
+            return breaker
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model: breaker.stats() for model, breaker in breakers.items()}
+
+
+# Singleton instance
+circuit_breakers = CircuitBreakerRegistry()
+
+
+# ============================================
+# Runnable wrappers
+# ============================================
+
+def retry_delay(error: BaseException, attempt: int) -> Optional[float]:
+    """
+    Giây đợi trước lần thử tiếp theo, None nếu không thử lại
+    
+    Full jitter: uniform(0, min(max, base * 2^attempt)), nhưng không sớm hơn
+    Retry-After và không vượt quá deadline của request.
+    """
+    if attempt >= settings.LLM_MAX_RETRIES or not is_transient(error):
+        return None
+    ceiling = min(settings.LLM_RETRY_MAX_SECONDS, settings.LLM_RETRY_BASE_SECONDS * (2 ** attempt))
+    delay = max(random.uniform(0, ceiling), retry_after_of(error))
+    left = remaining()
+    if left is not None and delay >= left:
+        return None
+    return delay
+
+
+@contextmanager
+def track_call(model: Optional[str]):
+    """breaker.track() của model (model None / CIRCUIT_BREAKER_ENABLED tắt: không làm gì)"""
+    if model is None or not settings.CIRCUIT_BREAKER_ENABLED:
+        yield
+        return
+    with circuit_breakers.get(model).track():
+        yield
+
+
+def track_stream(chunks: Iterator, model: Optional[str]) -> Iterator:
+    """
+    Chỉ LLM stream tính vào breaker của model
+    
+    Parse / repair của consumer chạy ngoài generator: lỗi output làm consumer
+    close() stream → tính như cancel, thời gian repair không cộng vào call.
+    """
+    with track_call(model):
+        yield from chunks
+
+
+async def atrack_stream(chunks: AsyncIterator, model: Optional[str]) -> AsyncIterator:
+    """Async version of track_stream"""
+    try:
+        with track_call(model):
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        close = getattr(chunks, "aclose", None)
+        if close is not None:
+            await close()
+
+
+def with_circuit_breaker(runnable: Runnable, model: str, track_calls: bool = True) -> Runnable:
+    """
+    Bọc một LLM call: breaker của model + retry lỗi tạm thời
+    (CIRCUIT_BREAKER_ENABLED tắt: chỉ retry)
+    
+    track_calls=False: chỉ retry, runnable tự tính LLM calls của nó vào breaker
+    (track_call / track_stream) để parse / repair không bị tính là model chậm / lỗi.
+    """
+    def invoke(inputs, config):
+        attempt = 0
+        while True:
+            try:
+                if not (track_calls and settings.CIRCUIT_BREAKER_ENABLED):
+                    return runnable.invoke(inputs, config)
+                with circuit_breakers.get(model).track():
+                    return runnable.invoke(inputs, config)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                _log_retry(model, e, attempt, delay)
+                time.sleep(delay)
+                attempt += 1
+    
+    async def ainvoke(inputs, config):
+        attempt = 0
+        while True:
+            try:
+                if not (track_calls and settings.CIRCUIT_BREAKER_ENABLED):
+                    return await runnable.ainvoke(inputs, config)
+                with circuit_breakers.get(model).track():
+                    return await runnable.ainvoke(inputs, config)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                _log_retry(model, e, attempt, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"breaker_{model}")
+
+
+def _log_retry(model: str, error: Exception, attempt: int, delay: float) -> None:
+    logger.warning(f"{model} call failed ({error}), retry {attempt + 1} in {delay:.1f}s")
+    LLM_RETRIES.inc(model=model)
+
+
+def should_fall_back(error: BaseException) -> bool:
+    return isinstance(error, CircuitOpen) or is_transient(error)
+
+
+def with_model_fallback(
+    primary: Runnable,
+    fallback: Runnable,
+    primary_model: str,
+    fallback_model: str,
+) -> Runnable:
+    """
+    primary lỗi tạm thời (sau retries) hoặc breaker đang open → chạy fallback
+    (không làm gì khi MODEL_FALLBACK_ENABLED tắt)
+    
+    Model thực sự trả kết quả được ghi vào track_served_model().
+    """
+    def on_fallback(error: BaseException) -> None:
+        reason = "circuit_open" if isinstance(error, CircuitOpen) else "error"
+        logger.warning(f"Falling back from {primary_model} to {fallback_model} ({reason}: {error})")
+        MODEL_FALLBACKS.inc(from_model=primary_model, to_model=fallback_model, reason=reason)
+        mark_served_model(fallback_model)
+    
+    def invoke(inputs, config):
+        try:
+            return primary.invoke(inputs, config)
+        except Exception as e:
+            if not (settings.MODEL_FALLBACK_ENABLED and should_fall_back(e)):
+                raise
+            on_fallback(e)
+        return fallback.invoke(inputs, config)
+    
+    async def ainvoke(inputs, config):
+        try:
+            return await primary.ainvoke(inputs, config)
+        except Exception as e:
+            if not (settings.MODEL_FALLBACK_ENABLED and should_fall_back(e)):
+                raise
+            on_fallback(e)
+        return await fallback.ainvoke(inputs, config)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"fallback_{primary_model}")
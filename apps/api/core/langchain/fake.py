@@ -0,0 +1,258 @@
+"""
+Fake Chat Model - Thay Gemini khi chạy offline (benchmark, dev không có API key)
+
+Trả về output đúng cấu trúc theo loại prompt (router / planner / coder /
+repair), usage_metadata ước lượng ~4 ký tự / token để so sánh token giữa các
+mode, và có thể giả lập latency + output text bị hỏng.
+
+Structured output: with_structured_output(schema) bind response schema
+giống Gemini, model trả JSON đúng schema (constrained decoding) nên
+malformed_rate chỉ áp dụng cho text mode.
+
+Usage:
+    llm = FakeChatModel(model="gemini-2.5-flash", latency=0.5, malformed_rate=0.1)
+    structured = llm.with_structured_output(StudyPlan, include_raw=True)
+"""
+
+import json
+import time
+import random
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import PrivateAttr, ValidationError
+
+CHARS_PER_TOKEN = 4
+
+WEEKDAYS = ("Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật")
+SUBJECT_COLORS = ("#3b82f6", "#10b981", "#f59e0b", "#ef4444")
+
+# Marker trong system prompt (core/langsmith/prompts.py) → loại output
+PROMPT_KINDS = (
+    ("classifier", "RouterDecision"),
+    ("Frontend Developer", "html"),
+    ("repair invalid fields", "repair"),
+    ("Extract the planning constraints", "PlanConstraints"),
+    ("Produce only the OUTLINE", "PlanOutline"),
+    ("ONE week of a longer study plan", "WeekSchedule"),
+)
+
+# Số tuần của kế hoạch dài hạn giả lập
+OUTLINE_WEEKS = 12
+
+
+def _prompt_date(text: str) -> date:
+    """current_date của planner prompt (YYYY-MM-DD đầu tiên), mặc định hôm nay"""
+    for token in text.split():
+        try:
+            return datetime.strptime(token.strip(".,:;()"), "%Y-%m-%d").date()
+        except ValueError:
+            continue
+    return date.today()
+
+
+def fake_router_decision(user_input: str) -> Dict[str, Any]:
+    hard = len(user_input) > 400 or user_input.count("\n") >= 5
+    return {
+        "complexity": "hard" if hard else "easy",
+        "confidence": 0.8,
+        "reason": "Phân loại giả lập (fake model)",
+    }
+
+
+SUBJECTS = ("Toán", "Tiếng Anh")
+
+
+def fake_schedule(start: date, days: int = 7) -> List[Dict[str, Any]]:
+    schedule = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        subject = SUBJECTS[offset % len(SUBJECTS)]
+        schedule.append({
+            "date": day.isoformat(),
+            "day_of_week": WEEKDAYS[day.weekday()],
+            "sessions": [
+                {"start_time": "08:00", "end_time": "09:30", "subject": subject,
+                 "task": f"Học {subject} - phần {offset + 1}", "type": "study"},
+                {"start_time": "09:30", "end_time": "09:45", "subject": subject,
+                 "task": "Nghỉ giải lao", "type": "break"},
+                {"start_time": "09:45", "end_time": "10:45", "subject": subject,
+                 "task": "Làm bài tập", "type": "practice"},
+            ],
+        })
+    return schedule
+
+
+def fake_plan_outline(start: date, weeks: int = OUTLINE_WEEKS) -> Dict[str, Any]:
+    days = 7 * weeks
+    end = start + timedelta(days=days - 1)
+    return {
+        "title": "Kế hoạch học tập",
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "subjects": [
+            {"name": name, "priority": "high" if i == 0 else "medium",
+             "total_hours": min(2.5 * days / len(SUBJECTS), 100), "color": SUBJECT_COLORS[i]}
+            for i, name in enumerate(SUBJECTS)
+        ],
+        "milestones": [{"date": end.isoformat(), "title": "Tổng ôn", "description": "Làm đề tổng hợp"}],
+        "tips": ["Học theo block 90 phút, nghỉ 15 phút"],
+        "weeks": [
+            {"week": week, "focus": f"Chương {week}", "hours": {name: 8.75 for name in SUBJECTS}}
+            for week in range(1, weeks + 1)
+        ],
+    }
+
+
+def fake_plan_constraints(start: date, weeks: int = OUTLINE_WEEKS) -> Dict[str, Any]:
+    end = start + timedelta(days=7 * weeks - 1)
+    return {
+        "title": "Kế hoạch học tập",
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "subjects": [
+            {"name": name, "priority": "high" if i == 0 else "medium",
+             "total_hours": 40, "color": SUBJECT_COLORS[i]}
+            for i, name in enumerate(SUBJECTS)
+        ],
+        "deadlines": {SUBJECTS[0]: end.isoformat()},
+        "study_days": [0, 1, 2, 3, 4, 5],
+        "daily_hours": 3,
+        "tips": ["Học theo block 90 phút, nghỉ 15 phút"],
+    }
+
+
+def fake_study_plan(start: date, days: int = 7) -> Dict[str, Any]:
+    end = start + timedelta(days=days - 1)
+    return {
+        "title": "Kế hoạch học tập",
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "subjects": [
+            {"name": name, "priority": "high" if i == 0 else "medium",
+             "total_hours": 2.5 * days / len(SUBJECTS), "color": SUBJECT_COLORS[i]}
+            for i, name in enumerate(SUBJECTS)
+        ],
+        "schedule": fake_schedule(start, days),
+        "milestones": [{"date": end.isoformat(), "title": "Tổng ôn", "description": "Làm đề tổng hợp"}],
+        "tips": ["Học theo block 90 phút, nghỉ 15 phút"],
+    }
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model giả lập Gemini (không gọi network)
+    
+    Attributes:
+        model: tên model giả lập (dùng cho metrics / tracing)
+        latency: giây mỗi call
+        malformed_rate: tỉ lệ output text bị hỏng (bọc prose / JSON cụt)
+        seed: seed cho malformed_rate (None: ngẫu nhiên)
+    """
+    
+    model: str = "fake"
+    temperature: float = 0.0
+    latency: float = 0.0
+    malformed_rate: float = 0.0
+    seed: Optional[int] = None
+    
+    _rng: Optional[random.Random] = PrivateAttr(default=None)
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+    
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model}
+    
+    def _get_ls_params(self, stop=None, **kwargs):
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.model
+        return params
+    
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs) -> Runnable:
+        """Giống Gemini response schema: output luôn là JSON của schema"""
+        def parse(message: AIMessage):
+            try:
+                parsed = schema.model_validate_json(message.content)
+            except ValidationError as e:
+                if include_raw:
+                    return {"raw": message, "parsed": None, "parsing_error": e}
+                raise
+            if include_raw:
+                return {"raw": message, "parsed": parsed, "parsing_error": None}
+            return parsed
+        
+        return self.bind(response_schema=schema.__name__) | RunnableLambda(parse)
+    
+    # ============================================
+    # Generation
+    # ============================================
+    
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages, kwargs.get("response_schema"))
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages, kwargs.get("response_schema"))
+    
+    def _result(self, messages: List[BaseMessage], response_schema: Optional[str]) -> ChatResult:
+        prompt = "\n".join(str(m.content) for m in messages)
+        text = self._respond(messages, response_schema)
+        message = AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": len(prompt) // CHARS_PER_TOKEN,
+                "output_tokens": len(text) // CHARS_PER_TOKEN,
+                "total_tokens": (len(prompt) + len(text)) // CHARS_PER_TOKEN,
+            },
+            response_metadata={"model_name": self.model},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _respond(self, messages: List[BaseMessage], response_schema: Optional[str]) -> str:
+        system = str(messages[0].content) if messages else ""
+        user = str(messages[-1].content) if messages else ""
+        kind = response_schema or next(
+            (kind for marker, kind in PROMPT_KINDS if marker in system), "StudyPlan"
+        )
+        
+        if kind == "RouterDecision":
+            return json.dumps(fake_router_decision(user), ensure_ascii=False)
+        if kind == "html":
+            return "<!DOCTYPE html><html><body><h1>Kế hoạch học tập</h1></body></html>"
+        if kind == "repair":
+            return "{}"
+        
+        prompt = "\n".join(str(m.content) for m in messages)
+        if kind == "PlanConstraints":
+            output = fake_plan_constraints(_prompt_date(prompt))
+        elif kind == "PlanOutline":
+            output = fake_plan_outline(_prompt_date(prompt))
+        elif kind == "WeekSchedule":
+            # Ngày đầu tiên trong week prompt là week_start
+            output = {"schedule": fake_schedule(_prompt_date(prompt))}
+        else:
+            output = fake_study_plan(_prompt_date(prompt))
+        text = json.dumps(output, ensure_ascii=False, indent=2)
+        if response_schema is None and self._random() < self.malformed_rate:
+            return self._malformed(text)
+        return text
+    
+    def _random(self) -> float:
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng.random()
+    
+    def _malformed(self, text: str) -> str:
+        """Lỗi thường gặp của text mode: prose quanh JSON (parse lại được) hoặc JSON cụt"""
+        if self._random() < 0.5:
+            return f"Đây là kế hoạch của bạn:\n```json\n{text}\n```\nChúc bạn học tốt!"
+        return text[: len(text) // 2]
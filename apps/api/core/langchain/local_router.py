@@ -0,0 +1,202 @@
+"""
+Local Complexity Router - Phân loại EASY/HARD không cần gọi LLM
+
+Các rule trong ROUTER_PROMPT (số môn, số task, deadline chồng nhau,
+constraints đặc biệt) được tính thành features rồi đưa qua logistic score.
+Chỉ khi confidence thấp hơn threshold mới fallback về Router LLM.
+"""
+
+import re
+import math
+import time
+import logging
+import threading
+import unicodedata
+from typing import Dict, Any, Tuple
+
+from django.conf import settings
+
+from planner.guards.output_guard import RouterDecision
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Feature extraction
+# ============================================
+
+BULLET_PATTERN = re.compile(r"^\s*(?:[-*•+]|\d+[.)])\s+", re.MULTILINE)
+DATE_PATTERN = re.compile(r"\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b|\b\d{4}-\d{2}-\d{2}\b")
+SUBJECT_COUNT_PATTERN = re.compile(r"\b(\d+)\s*(?:môn|subjects?|courses?)\b")
+LONG_HORIZON_PATTERN = re.compile(r"\b(?:\d+|vài|mấy)\s*tháng\b|học kỳ|semester|\b\d+\s*months?\b")
+SHORT_HORIZON_PATTERN = re.compile(r"\b(?:\d+|vài|mấy|một|hai|ba)\s*(?:ngày|tuần)\b|tuần sau|ngày mai|\b\d+\s*(?:days?|weeks?)\b|next (?:week|\w+day)")
+
+# Constraints đặc biệt: lịch làm việc, sức khỏe, deadline chồng nhau
+CONSTRAINT_KEYWORDS = [
+    "thực tập", "part-time", "đi làm", "làm thêm", "công ty", "9-6",
+    "mệt", "sức khỏe", "ốm", "bệnh", "nghỉ ngơi",
+    "đồ án", "project", "deadline", "chứng chỉ", "phỏng vấn",
+    "ưu tiên", "priority",
+]
+
+# Input mơ hồ cần LLM diễn giải
+VAGUE_KEYWORDS = [
+    "không biết", "quá nhiều", "overwhelmed", "bắt đầu từ đâu",
+    "rối", "loạn", "chưa biết",
+]
+
+EXAM_KEYWORDS = ["thi cuối kỳ", "thi đại học", "thi giữa kỳ", "final", "midterm", "kiểm tra", "thi"]
+
+
+def normalize_text(text: str) -> str:
+    """NFC (dấu tiếng Việt) + lowercase"""
+    return unicodedata.normalize("NFC", text).lower()
+
+
+def extract_features(text: str) -> Dict[str, float]:
+    """
+    Tính features từ input của sinh viên
+    
+    Returns:
+        Dict feature_name -> value (đã scale về khoảng ~0-3)
+    """
+    normalized = normalize_text(text)
+    lines = [line for line in normalized.splitlines() if line.strip()]
+    
+    bullets = len(BULLET_PATTERN.findall(normalized))
+    
+    # Danh sách môn viết inline: "(Toán, Lý, Hóa)" hoặc "5 môn: A, B, C"
+    inline_items = 0
+    for line in lines:
+        commas = line.count(",")
+        if commas >= 2:
+            inline_items = max(inline_items, commas + 1)
+    
+    declared_subjects = max(
+        (int(n) for n in SUBJECT_COUNT_PATTERN.findall(normalized)),
+        default=0,
+    )
+    
+    tasks = max(bullets, inline_items, declared_subjects)
+    
+    return {
+        "tasks": min(tasks, 12) / 4,
+        "dates": min(len(DATE_PATTERN.findall(normalized)), 6) / 2,
+        "constraints": min(sum(kw in normalized for kw in CONSTRAINT_KEYWORDS), 6) / 2,
+        "vague": float(any(kw in normalized for kw in VAGUE_KEYWORDS)),
+        "long_horizon": float(bool(LONG_HORIZON_PATTERN.search(normalized))),
+        "short_horizon": float(bool(SHORT_HORIZON_PATTERN.search(normalized))),
+        "exams": min(sum(kw in normalized for kw in EXAM_KEYWORDS), 3) / 3,
+        "length": min(len(normalized), 1500) / 500,
+        "lines": min(len(lines), 15) / 5,
+    }
+
+
+# ============================================
+# Local Router
+# ============================================
+
+class LocalComplexityRouter:
+    """
+    Logistic classifier trên features của input
+    
+    Weights được calibrate bằng tests/sample_inputs.json
+    (xem `python manage.py bench_router`).
+    """
+    
+    # Positive weight → HARD
+    WEIGHTS = {
+        "tasks": 1.6,
+        "dates": 0.8,
+        "constraints": 1.2,
+        "vague": 3.6,
+        "long_horizon": 1.8,
+        "short_horizon": -1.4,
+        "exams": 0.4,
+        "length": 1.0,
+        "lines": 0.3,
+    }
+    BIAS = -3.6
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "local_decisions": 0,
+            "llm_fallbacks": 0,
+            "fallback_agreements": 0,
+            "local_latency_ms": 0.0,
+            "llm_latency_ms": 0.0,
+        }
+    
+    def score(self, text: str) -> float:
+        """Xác suất input là HARD (0-1)"""
+        features = extract_features(text)
+        z = self.BIAS + sum(self.WEIGHTS[name] * value for name, value in features.items())
+        return 1 / (1 + math.exp(-z))
+    
+    def classify(self, text: str) -> RouterDecision:
+        """Phân loại input (luôn trả về decision, kể cả khi confidence thấp)"""
+        p_hard = self.score(text)
+        complexity = "hard" if p_hard >= 0.5 else "easy"
+        confidence = p_hard if complexity == "hard" else 1 - p_hard
+        
+        return RouterDecision(
+            complexity=complexity,
+            confidence=round(confidence, 3),
+            reason=f"Phân loại local theo đặc trưng input (p_hard={p_hard:.2f})",
+        )
+    
+    def route(self, text: str) -> Tuple[RouterDecision, bool]:
+        """
+        Phân loại và cho biết có đủ tự tin để bỏ qua Router LLM không
+        
+        Returns:
+            (decision, confident)
+        """
+        start = time.perf_counter()
+        decision = self.classify(text)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        confident = decision.confidence >= settings.LOCAL_ROUTER_CONFIDENCE_THRESHOLD
+        with self._lock:
+            self._stats["local_latency_ms"] += elapsed_ms
+            if confident:
+                self._stats["local_decisions"] += 1
+            else:
+                self._stats["llm_fallbacks"] += 1
+        
+        return decision, confident
+    
+    def record_fallback(self, local_decision: RouterDecision, llm_result: Dict[str, Any], llm_latency_ms: float) -> None:
+        """Ghi nhận kết quả Router LLM cho một lần fallback (để đo độ đồng thuận)"""
+        with self._lock:
+            self._stats["llm_latency_ms"] += llm_latency_ms
+            if llm_result.get("complexity") == local_decision.complexity:
+                self._stats["fallback_agreements"] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._stats)
+        
+        total = data["local_decisions"] + data["llm_fallbacks"]
+        avg_llm_ms = data["llm_latency_ms"] / data["llm_fallbacks"] if data["llm_fallbacks"] else 0.0
+        
+        return {
+            "local_decisions": data["local_decisions"],
+            "llm_fallbacks": data["llm_fallbacks"],
+            "coverage": round(data["local_decisions"] / total, 3) if total else 0.0,
+            "fallback_agreement_rate": (
+                round(data["fallback_agreements"] / data["llm_fallbacks"], 3)
+                if data["llm_fallbacks"] else 0.0
+            ),
+            "avg_local_latency_ms": round(data["local_latency_ms"] / total, 3) if total else 0.0,
+            "avg_llm_router_latency_ms": round(avg_llm_ms, 1),
+            # Router LLM latency bỏ được, chia đều trên mọi request
+            "avg_latency_removed_ms": (
+                round(avg_llm_ms * data["local_decisions"] / total, 1) if total else 0.0
+            ),
+        }
+
+
+# Singleton instance
+local_router = LocalComplexityRouter()
@@ -0,0 +1,192 @@
+"""
+Regenerate - Tạo lại plan đã lưu bằng refiner prompt (REFINE_PROMPT)
+
+So với một POST /generate/ mới:
+- Input gốc + router decision lấy từ plan đã lưu → không gọi Router
+- Plan trước được rút gọn (bỏ task / notes, các tuần sau chỉ còn tổng giờ
+  theo môn) để refiner biết cần đổi gì mà không gửi lại cả JSON
+- Báo số tokens / latency tiết kiệm so với generate lại từ đầu (Router +
+  Planner), dựa trên trung bình đã đo (trace_stats); chưa có số đo thì không báo
+"""
+
+import threading
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from core.langchain.tracing import trace_stats
+
+# Số ngày đầu được giữ chi tiết từng session, sau đó tóm tắt theo tuần
+COMPACT_DAILY_DAYS = 14
+
+# Ước lượng kích thước plan trong prompt (~4 ký tự / token)
+CHARS_PER_TOKEN = 4
+
+
+def _minutes(clock: str) -> int:
+    return int(clock[:2]) * 60 + int(clock[3:5])
+
+
+def _hours(minutes: int) -> str:
+    return f"{minutes / 60:g}h"
+
+
+def compact_plan(plan: Dict[str, Any], daily_days: int = COMPACT_DAILY_DAYS) -> str:
+    """
+    Plan JSON (đã validate bằng StudyPlan) → mô tả ngắn cho refiner prompt
+    
+    vd.
+        2026-01-05 Thứ 2 | 2.5h | 08:00-09:30 Toán study, 09:45-10:45 Toán practice | 1 break
+        Week 3 (2026-01-19 → 2026-01-25) | 5 days | Toán 6h, Tiếng Anh 4h
+    """
+    lines = [
+        f"Title: {plan.get('title', '')}",
+        f"Dates: {plan.get('start_date', '')} → {plan.get('end_date', '')}",
+        "Subjects: " + ", ".join(
+            f"{s.get('name')} ({s.get('priority')}, {s.get('total_hours')}h)" for s in plan.get("subjects", [])
+        ),
+        "Schedule:",
+    ]
+    
+    schedule = plan.get("schedule", [])
+    # Parse hết ngày trước: ngày không hợp lệ → ValueError trước khi build prompt
+    dates = [date.fromisoformat(day["date"]) for day in schedule]
+    for day in schedule[:daily_days]:
+        sessions = day.get("sessions", [])
+        study = [s for s in sessions if s.get("type") != "break"]
+        minutes = sum(_minutes(s["end_time"]) - _minutes(s["start_time"]) for s in study)
+        line = f"{day.get('date')} {day.get('day_of_week', '')} | {_hours(minutes)} | " + ", ".join(
+            f"{s['start_time']}-{s['end_time']} {s.get('subject')} {s.get('type')}" for s in study
+        )
+        breaks = len(sessions) - len(study)
+        lines.append(f"{line} | {breaks} break" + ("s" if breaks != 1 else ""))
+    
+    # Các tuần còn lại: số ngày học + tổng giờ theo môn
+    weeks: Dict[int, Dict[str, Any]] = {}
+    start = date.fromisoformat(plan["start_date"]) if plan.get("start_date") else None
+    for day, day_date in zip(schedule[daily_days:], dates[daily_days:]):
+        week = (day_date - start).days // 7 + 1 if start else 0
+        entry = weeks.setdefault(week, {"first": day_date, "last": day_date, "days": 0, "minutes": defaultdict(int)})
+        entry["last"] = day_date
+        entry["days"] += 1
+        for s in day.get("sessions", []):
+            if s.get("type") != "break":
+                entry["minutes"][s.get("subject")] += _minutes(s["end_time"]) - _minutes(s["start_time"])
+    for week, entry in weeks.items():
+        lines.append(
+            f"Week {week} ({entry['first']} → {entry['last']}) | {entry['days']} days | "
+            + ", ".join(f"{name} {_hours(minutes)}" for name, minutes in entry["minutes"].items())
+        )
+    
+    milestones = plan.get("milestones", [])
+    if milestones:
+        lines.append("Milestones: " + ", ".join(f"{m.get('date')} {m.get('title')}" for m in milestones))
+    return "\n".join(lines)
+
+
+def refiner_inputs(
+    context: Dict[str, Any],
+    previous_plan: Dict[str, Any],
+    attempt: int,
+    feedback: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Inputs cho refiner prompt
+    
+    Args:
+        context: build_planner_inputs(...) của request gốc
+    """
+    original_input = (
+        f"{context['user_input']}\n\n"
+        f"- Current date: {context['current_date']}\n"
+        f"- Preferred study hours per day: {context['study_hours_per_day']}\n"
+        f"- Available days: {context['available_days']}"
+    )
+    if feedback:
+        original_input += f"\n- Student feedback on the previous plan: {feedback}"
+    return {
+        "original_input": original_input,
+        "previous_plan": compact_plan(previous_plan),
+        "attempt_number": attempt,
+    }
+
+
+def full_regeneration_baseline(planner_stage: str) -> Optional[Dict[str, Any]]:
+    """
+    Chi phí LLM trung bình của một lần generate lại từ đầu (Router + Planner)
+    
+    Từ số đo trong trace_stats; None khi planner_stage chưa có số đo (không
+    ước lượng từ chính refiner call đang được so sánh).
+    """
+    stages = trace_stats.by_stage.snapshot()
+    planner = stages.get(planner_stage)
+    if not planner or not planner["count"]:
+        return None
+    
+    router = stages.get("router")
+    # Router LLM chỉ chạy cho phần request local router không tự tin
+    planner_count = sum(stages.get(name, {}).get("count", 0) for name in ("planner_flash", "planner_pro"))
+    router_share = min(router["count"] / planner_count, 1.0) if router and planner_count else 0.0
+    return {
+        "source": "observed",
+        "tokens": round(planner["avg_total_tokens"] + router_share * (router or {}).get("avg_total_tokens", 0)),
+        "latency_ms": round(
+            planner["avg_latency_ms"] + router_share * (router or {}).get("avg_latency_ms", 0), 1
+        ),
+    }
+
+
+def stage_entry(breakdown: Dict[str, Any], name: str) -> Optional[Dict[str, Any]]:
+    """Stage `name` trong trace.breakdown() (None nếu chưa chạy)"""
+    return next((stage for stage in breakdown["stages"] if stage["name"] == name), None)
+
+
+def savings_report(baseline: Dict[str, Any], stages: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    So sánh các LLM stages của regenerate (refiner, router nếu phải gọi) với baseline
+    """
+    stages = [stage for stage in stages if stage is not None]
+    tokens = sum(stage["prompt_tokens"] + stage["completion_tokens"] for stage in stages)
+    latency_ms = round(sum(stage["duration_ms"] for stage in stages), 1)
+    report = {
+        "baseline": baseline["source"],
+        "full_regeneration": {"tokens": baseline["tokens"], "latency_ms": baseline["latency_ms"]},
+        "regenerate": {"tokens": tokens, "latency_ms": latency_ms},
+        "tokens_saved": baseline["tokens"] - tokens,
+        "latency_ms_saved": round(baseline["latency_ms"] - latency_ms, 1),
+    }
+    regenerate_stats.record(report)
+    return report
+
+
+class RegenerateStats:
+    """Số lần regenerate, tokens / latency tiết kiệm trung bình (thread-safe)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {"count": 0, "router_skipped": 0, "tokens_saved": 0, "latency_ms_saved": 0.0}
+    
+    def record(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data["count"] += 1
+            self._data["tokens_saved"] += report["tokens_saved"]
+            self._data["latency_ms_saved"] += report["latency_ms_saved"]
+    
+    def record_router_skipped(self) -> None:
+        with self._lock:
+            self._data["router_skipped"] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._data)
+        count = data["count"] or 1
+        return {
+            "count": data["count"],
+            "router_skipped": data["router_skipped"],
+            "avg_tokens_saved": round(data["tokens_saved"] / count, 1),
+            "avg_latency_ms_saved": round(data["latency_ms_saved"] / count, 1),
+        }
+
+
+# Singleton instance
+regenerate_stats = RegenerateStats()
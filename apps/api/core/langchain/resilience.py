@@ -0,0 +1,329 @@
+"""
+Resilience - Deadlines, per-stage timeouts và hedged LLM requests
+
+Deadline: view set `request_deadline` từ header `X-Request-Timeout` (giây)
+hoặc REQUEST_DEFAULT_BUDGET_SECONDS. Mỗi stage (router, planner, coder) chạy
+với timeout = min(STAGE_TIMEOUTS[stage], thời gian còn lại của request);
+hết giờ → StageTimeout (504), LLM call đang chạy bị cancel.
+
+Client ngắt kết nối: Django (ASGI) cancel coroutine của view →
+CancelledError lan xuống ainvoke / astream → HTTP request tới Gemini bị đóng.
+
+Hedging (LLM_HEDGING_ENABLED, chỉ đường async): call chạy lâu hơn percentile
+latency gần đây của stage → bắn thêm một request (Pro planner: fallback sang
+Flash), lấy kết quả xong trước, cancel request còn lại.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Optional
+
+from django.conf import settings
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from core.metrics import HEDGED_REQUESTS, STAGE_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Thời điểm (time.monotonic) request phải xong, None = chỉ áp dụng timeout từng stage
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+# Model thực sự trả kết quả (vd. Flash thắng hedge của Pro planner)
+_served_model: ContextVar[Optional[Dict[str, str]]] = ContextVar("served_model", default=None)
+
+
+class StageTimeout(Exception):
+    """Stage chạy quá timeout của nó hoặc quá deadline của request"""
+    
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+# ============================================
+# Deadlines
+# ============================================
+
+def parse_budget(value: Optional[str]) -> Optional[float]:
+    """Giá trị header X-Request-Timeout (giây) → budget, None nếu không hợp lệ"""
+    try:
+        budget = float(value)
+    except (TypeError, ValueError):
+        return None
+    if budget <= 0:
+        return None
+    return min(budget, settings.REQUEST_MAX_BUDGET_SECONDS)
+
+
+def start_deadline(budget: Optional[float] = None) -> float:
+    """Set deadline cho request hiện tại (mặc định REQUEST_DEFAULT_BUDGET_SECONDS)"""
+    if budget is None:
+        budget = settings.REQUEST_DEFAULT_BUDGET_SECONDS
+    deadline = time.monotonic() + budget
+    request_deadline.set(deadline)
+    return deadline
+
+
+def remaining() -> Optional[float]:
+    """Số giây còn lại tới deadline của request (None: không có deadline)"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def stage_timeout(stage: str) -> Optional[float]:
+    """min(timeout của stage, thời gian còn lại); None nếu không giới hạn"""
+    limits = [t for t in (settings.STAGE_TIMEOUTS.get(stage), remaining()) if t is not None]
+    return max(min(limits), 0.0) if limits else None
+
+
+def _timed_out(stage: str, timeout: float) -> StageTimeout:
+    logger.warning(f"Stage {stage} timed out after {timeout:.1f}s")
+    STAGE_TIMEOUTS.inc(stage=stage)
+    stage_stats.count(stage, "timeouts")
+    return StageTimeout(stage, timeout)
+
+
+@asynccontextmanager
+async def stage_deadline(stage: str):
+    """`async with` giới hạn thời gian của một stage (cancel code bên trong khi hết giờ)"""
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        yield
+        return
+    if timeout <= 0:
+        raise _timed_out(stage, 0.0)
+    
+    scope = asyncio.timeout(timeout)
+    try:
+        async with scope:
+            yield
+    except TimeoutError:
+        if not scope.expired():
+            raise  # TimeoutError của code bên trong, không phải của stage
+        raise _timed_out(stage, timeout) from None
+
+
+async def astream_with_deadline(chunks: AsyncIterator[Any], stage: str) -> AsyncIterator[Any]:
+    """
+    Đọc stream với timeout của stage
+    
+    Không bọc `yield` trong asyncio.timeout (sẽ cancel cả consumer), mà
+    đợi từng chunk với thời gian còn lại.
+    """
+    timeout = stage_timeout(stage)
+    until = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            if until is None:
+                chunk = await anext(chunks)
+            else:
+                chunk = await asyncio.wait_for(anext(chunks), until - time.monotonic())
+        except StopAsyncIteration:
+            return
+        except TimeoutError:
+            raise _timed_out(stage, timeout) from None
+        yield chunk
+
+
+def with_deadline(runnable: Runnable, stage: str) -> Runnable:
+    """
+    Bọc runnable với timeout của stage
+    
+    Async: cancel call khi hết giờ. Sync: không cancel được thread, chỉ từ
+    chối bắt đầu khi đã hết deadline (HTTP call bị giới hạn bởi
+    LLM_REQUEST_TIMEOUT_SECONDS).
+    """
+    def invoke(inputs, config):
+        timeout = stage_timeout(stage)
+        if timeout is not None and timeout <= 0:
+            raise _timed_out(stage, 0.0)
+        return runnable.invoke(inputs, config)
+    
+    async def ainvoke(inputs, config):
+        async with stage_deadline(stage):
+            return await runnable.ainvoke(inputs, config)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"deadline_{stage}")
+
+
+# ============================================
+# Served model
+# ============================================
+
+@contextmanager
+def track_served_model():
+    """
+    Usage:
+        with track_served_model() as served:
+            plan = await planner.ainvoke(...)
+        model_used = served.get("model", model_name(use_pro))
+    """
+    holder: Dict[str, str] = {}
+    previous = _served_model.get()
+    _served_model.set(holder)
+    try:
+        yield holder
+    finally:
+        _served_model.set(previous)
+
+
+def mark_served_model(model: str) -> None:
+    holder = _served_model.get()
+    if holder is not None:
+        holder["model"] = model
+
+
+# ============================================
+# Hedging
+# ============================================
+
+class StageStats:
+    """
+    Latency gần đây (sliding window) + counters theo stage (thread-safe)
+    
+    Percentile latency quyết định lúc bắn hedge request.
+    """
+    
+    COUNTERS = ("calls", "hedged", "hedge_wins", "timeouts")
+    
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+    
+    def record_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+    
+    def count(self, stage: str, key: str) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(stage, dict.fromkeys(self.COUNTERS, 0))
+            counters[key] += 1
+    
+    def percentile(self, stage: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = set(self._samples) | set(self._counters)
+            counters = {
+                stage: dict(self._counters.get(stage) or dict.fromkeys(self.COUNTERS, 0))
+                for stage in stages
+            }
+        
+        result = {}
+        for stage in sorted(stages):
+            p50 = self.percentile(stage, 50)
+            p95 = self.percentile(stage, 95)
+            result[stage] = {
+                **counters[stage],
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return result
+
+
+def hedge_delay(stage: str) -> Optional[float]:
+    """Đợi bao lâu trước khi hedge (None: chưa đủ samples để biết percentile)"""
+    latency = stage_stats.percentile(
+        stage, settings.LLM_HEDGE_PERCENTILE, settings.LLM_HEDGE_MIN_SAMPLES
+    )
+    if latency is None:
+        return None
+    return max(latency, settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+
+
+async def run_hedged(
+    stage: str,
+    primary: Runnable,
+    hedge: Runnable,
+    inputs: Any,
+    config: Optional[Dict[str, Any]] = None,
+    hedge_model: Optional[str] = None,
+) -> Any:
+    """
+    Chạy primary; quá hedge_delay(stage) mà chưa xong → chạy thêm hedge,
+    trả về kết quả thành công đầu tiên và cancel cái còn lại
+    
+    Args:
+        hedge_model: model của hedge khi khác primary (ghi vào track_served_model)
+    """
+    started_at = time.perf_counter()
+    stage_stats.count(stage, "calls")
+    first = asyncio.ensure_future(primary.ainvoke(inputs, config))
+    tasks = {first: "primary"}
+    
+    try:
+        delay = hedge_delay(stage)
+        if delay is not None:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if not done:
+                logger.info(f"Hedging {stage}: no result after {delay:.1f}s")
+                stage_stats.count(stage, "hedged")
+                tasks[asyncio.ensure_future(hedge.ainvoke(inputs, config))] = "hedge"
+        
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                winner = tasks[task]
+                stage_stats.record_latency(stage, time.perf_counter() - started_at)
+                if len(tasks) > 1:
+                    HEDGED_REQUESTS.inc(stage=stage, winner=winner)
+                if winner == "hedge":
+                    stage_stats.count(stage, "hedge_wins")
+                    if hedge_model:
+                        mark_served_model(hedge_model)
+                return task.result()
+        
+        # Tất cả đều lỗi → lỗi của primary
+        raise first.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def with_hedging(
+    runnable: Runnable,
+    stage: str,
+    fallback: Optional[Runnable] = None,
+    fallback_model: Optional[str] = None,
+) -> Runnable:
+    """
+    Bọc runnable với hedging (không làm gì khi LLM_HEDGING_ENABLED tắt)
+    
+    Args:
+        fallback: hedge bằng runnable rẻ/nhanh hơn khi LLM_HEDGE_FALLBACK_TO_FLASH bật
+            (vd. Flash planner cho Pro planner); None → hedge bằng chính runnable
+        fallback_model: model của fallback
+    """
+    def invoke(inputs, config):
+        return runnable.invoke(inputs, config)
+    
+    async def ainvoke(inputs, config):
+        if not settings.LLM_HEDGING_ENABLED:
+            return await runnable.ainvoke(inputs, config)
+        if fallback is not None and settings.LLM_HEDGE_FALLBACK_TO_FLASH:
+            return await run_hedged(stage, runnable, fallback, inputs, config, fallback_model)
+        return await run_hedged(stage, runnable, runnable, inputs, config)
+    
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"hedged_{stage}")
+
+
+# Singleton instance
+stage_stats = StageStats(window=settings.LLM_HEDGE_WINDOW)
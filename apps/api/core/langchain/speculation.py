@@ -0,0 +1,223 @@
+"""
+Speculative Router + Planner execution
+
+Chạy Flash planner song song với Router thay vì đợi Router xong:
+- Router → "easy" (hoặc "hard" nhưng confidence thấp): giữ kết quả Flash
+- Router → "hard" đủ tự tin: bỏ kết quả Flash, chạy Pro planner
+"""
+
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.conf import settings
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+
+from core.langchain.usage import summarize_usage
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+# Tốc độ sinh output của Flash, để ước tính tokens khi request bị cancel giữa chừng
+ESTIMATED_OUTPUT_TOKENS_PER_SECOND = 150
+
+
+class SpeculationStats:
+    """
+    Counters cho speculative mode (thread-safe)
+    
+    - hits: Router xác nhận Flash → tiết kiệm thời gian chờ Router
+    - misses: Router chọn Pro → kết quả Flash bị bỏ (wasted tokens)
+    - estimated_wasted_*: Flash bị cancel giữa lúc gọi Gemini nên không có
+      usage_metadata → ước tính từ kích thước prompt và thời gian đã chạy
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {
+            "attempts": 0,
+            "hits": 0,
+            "misses": 0,
+            "cancelled_before_start": 0,
+            "wasted_prompt_tokens": 0,
+            "wasted_completion_tokens": 0,
+            "estimated_wasted_prompt_tokens": 0,
+            "estimated_wasted_completion_tokens": 0,
+            "latency_saved_ms": 0.0,
+        }
+    
+    def add(self, **deltas) -> None:
+        with self._lock:
+            for key, value in deltas.items():
+                self._data[key] += value
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._data)
+        decided = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / decided, 3) if decided else 0.0
+        data["avg_latency_saved_ms"] = (
+            round(data["latency_saved_ms"] / data["hits"], 1) if data["hits"] else 0.0
+        )
+        return data
+
+
+speculation_stats = SpeculationStats()
+
+
+class SpeculativeUsageHandler(UsageMetadataCallbackHandler):
+    """Usage của Flash planner, kèm kích thước prompt và lúc bắt đầu gọi LLM"""
+    
+    def __init__(self):
+        super().__init__()
+        self.prompt_chars = 0
+        self.llm_started_at: Optional[float] = None
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], **kwargs: Any) -> None:
+        with self._lock:
+            self.prompt_chars += sum(len(str(m.content)) for batch in messages for m in batch)
+            if self.llm_started_at is None:
+                self.llm_started_at = time.perf_counter()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ROUTER_SPECULATION_MAX_WORKERS,
+                thread_name_prefix="speculative-planner",
+            )
+        return _executor
+
+
+def keep_speculative_result(router_result: Dict[str, Any]) -> bool:
+    """
+    Giữ kết quả Flash khi Router chọn "easy", hoặc chọn "hard" nhưng
+    confidence dưới ROUTER_SPECULATION_CONFIDENCE_THRESHOLD
+    """
+    if router_result.get("complexity", "easy") != "hard":
+        return True
+    return router_result.get("confidence", 0) < settings.ROUTER_SPECULATION_CONFIDENCE_THRESHOLD
+
+
+def run_speculative(
+    router_chain: Runnable,
+    planner_easy: Runnable,
+    planner_hard: Runnable,
+    user_input: str,
+    planner_inputs: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any], bool]:
+    """
+    Chạy Router và Flash planner song song
+    
+    Returns:
+        (router_result, plan, used_pro)
+    """
+    flash_usage = SpeculativeUsageHandler()
+    flash_started_at = time.perf_counter()
+    
+    # copy_context: giữ tracing context (LangSmith) trong worker thread
+    flash_future: Future = _get_executor().submit(
+        contextvars.copy_context().run,
+        planner_easy.invoke,
+        planner_inputs,
+        {"callbacks": [flash_usage]},
+    )
+    speculation_stats.add(attempts=1)
+    
+    try:
+        router_result = router_chain.invoke({"user_input": user_input})
+    except Exception:
+        flash_future.cancel()
+        raise
+    
+    router_done_at = time.perf_counter()
+    
+    if keep_speculative_result(router_result):
+        plan = flash_future.result()
+        # Phần thời gian Router chạy chồng lên Flash planner
+        saved_ms = (router_done_at - flash_started_at) * 1000
+        speculation_stats.add(hits=1, latency_saved_ms=saved_ms)
+        return router_result, plan, False
+    
+    # Router chọn Pro: hủy Flash nếu chưa chạy, nếu đang chạy thì bỏ kết quả
+    if flash_future.cancel():
+        speculation_stats.add(misses=1, cancelled_before_start=1)
+    else:
+        speculation_stats.add(misses=1)
+        flash_future.add_done_callback(lambda _: _record_wasted(flash_usage))
+    
+    plan = planner_hard.invoke(planner_inputs)
+    return router_result, plan, True
+
+
+async def arun_speculative(
+    router_chain: Runnable,
+    planner_easy: Runnable,
+    planner_hard: Runnable,
+    user_input: str,
+    planner_inputs: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any], bool]:
+    """
+    Async version of run_speculative
+    
+    Flash planner chạy như một asyncio task; khi Router chọn Pro, task bị
+    cancel (request tới Gemini bị hủy thay vì chạy tiếp ở background).
+    """
+    flash_usage = SpeculativeUsageHandler()
+    flash_started_at = time.perf_counter()
+    flash_task = asyncio.create_task(
+        planner_easy.ainvoke(planner_inputs, {"callbacks": [flash_usage]})
+    )
+    speculation_stats.add(attempts=1)
+    
+    try:
+        router_result = await router_chain.ainvoke({"user_input": user_input})
+    except BaseException:
+        flash_task.cancel()
+        raise
+    
+    router_done_at = time.perf_counter()
+    
+    if keep_speculative_result(router_result):
+        plan = await flash_task
+        saved_ms = (router_done_at - flash_started_at) * 1000
+        speculation_stats.add(hits=1, latency_saved_ms=saved_ms)
+        return router_result, plan, False
+    
+    flash_task.cancel()
+    cancelled_at = time.perf_counter()
+    speculation_stats.add(misses=1)
+    # Ghi khi task thực sự dừng (callbacks của LLM có thể còn đang chạy)
+    flash_task.add_done_callback(lambda _: _record_wasted(flash_usage, cancelled_at))
+    
+    plan = await planner_hard.ainvoke(planner_inputs)
+    return router_result, plan, True
+
+
+def _record_wasted(usage_handler: SpeculativeUsageHandler, cancelled_at: Optional[float] = None) -> None:
+    usage = summarize_usage(usage_handler)
+    if usage["prompt_tokens"] or usage["completion_tokens"] or usage_handler.llm_started_at is None:
+        speculation_stats.add(
+            wasted_prompt_tokens=usage["prompt_tokens"],
+            wasted_completion_tokens=usage["completion_tokens"],
+        )
+        return
+    
+    # Cancel giữa lúc gọi Gemini: không có usage_metadata
+    elapsed = max(0.0, (cancelled_at or time.perf_counter()) - usage_handler.llm_started_at)
+    speculation_stats.add(
+        estimated_wasted_prompt_tokens=usage_handler.prompt_chars // CHARS_PER_TOKEN,
+        estimated_wasted_completion_tokens=int(elapsed * ESTIMATED_OUTPUT_TOKENS_PER_SECOND),
+    )
@@ -0,0 +1,248 @@
+"""
+Streaming Generation - Server-Sent Events
+
+Router → Planner (stream tokens) → Output Guard → Render, phát event theo
+từng stage để client hiển thị tiến độ thay vì đợi toàn bộ response.
+
+Events (theo thứ tự):
+- input_guard: input đã qua Input Guard
+- router_decision: EASY/HARD + model sẽ dùng
+- planner_progress: text planner vừa sinh thêm (delta) + tổng số ký tự
+- plan_day: một DailySchedule đã validate (trước khi plan hoàn chỉnh)
+- plan: plan đã validate bằng Output Guard
+- html: HTML đã render
+- done: model_used + timings (ttfb_ms, ttfc_ms, total_ms, từng stage)
+  + skipped_modes
+- error: code + message, stream kết thúc ngay sau event này
+  (output sai cấu trúc → dừng planner ngay, không đợi hết response;
+  quá tải → code OVERLOADED / QUEUE_TIMEOUT + retry_after;
+  quá deadline → code DEADLINE_EXCEEDED;
+  breaker của model đang open → code MODEL_UNAVAILABLE + retry_after)
+
+Speculative planner và hedging không áp dụng cho streaming: tokens chỉ
+được stream sau khi đã chọn model. Breaker của Pro đang open → request
+HARD được stream bằng Flash (planner_fallback_text).
+
+Streaming luôn dùng planner_*_text (stream raw JSON text). Các chế độ
+LLM_STRUCTURED_OUTPUT (không có text để stream), PLANNER_CHUNKED_ENABLED và
+PLANNER_LOCAL_SCHEDULER không áp dụng; chế độ nào đang bật được liệt kê
+trong skipped_modes của event done, và kết quả khi đó không được ghi vào
+response cache (key của cache tính theo các chế độ này).
+"""
+
+import json
+import time
+import logging
+import threading
+from contextlib import aclosing, nullcontext
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+from django.conf import settings
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+from planner.guards.output_guard import study_plan_guard
+from core.langchain.chains import (
+    ainvoke_llm_router,
+    arender_plan,
+    build_planner_inputs,
+    chain_registry,
+    log_router_decision,
+    model_name,
+    route_locally,
+)
+from core.langchain.usage import summarize_usage
+from core.langchain.admission import admission_slot, lane_for, with_admission
+from core.langchain.resilience import astream_with_deadline, with_deadline
+from core.langchain.circuit_breaker import circuit_breakers
+
+logger = logging.getLogger(__name__)
+
+StreamEvent = Tuple[str, Dict[str, Any]]
+
+SCHEDULE_DAY_PATH = ("schedule", "*")
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Một SSE frame: `event: <name>` + `data: <json>`"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class StreamTimer:
+    """
+    Đo thời gian của một stream (ms, tính từ lúc nhận request)
+    
+    - ttfb: event đầu tiên
+    - ttfc: nội dung plan đầu tiên (planner token hoặc plan từ cache)
+    """
+    
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at or time.perf_counter()
+        self.ttfb_ms: Optional[float] = None
+        self.ttfc_ms: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+    
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+    
+    def mark_first_byte(self) -> None:
+        if self.ttfb_ms is None:
+            self.ttfb_ms = self.elapsed_ms()
+    
+    def mark_first_content(self) -> None:
+        if self.ttfc_ms is None:
+            self.ttfc_ms = self.elapsed_ms()
+    
+    def record_stage(self, name: str, since: float) -> None:
+        self.stages[f"{name}_ms"] = round((time.perf_counter() - since) * 1000, 1)
+    
+    def summary(self) -> Dict[str, float]:
+        return {
+            "ttfb_ms": round(self.ttfb_ms or 0.0, 1),
+            "ttfc_ms": round(self.ttfc_ms or 0.0, 1),
+            "total_ms": round(self.elapsed_ms(), 1),
+            **self.stages,
+        }
+
+
+class StreamStats:
+    """Aggregate TTFB / TTFC / total latency của các streams (thread-safe)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {
+            "streams": 0,
+            "completed": 0,
+            "errors": 0,
+            "ttfb_ms": 0.0,
+            "ttfc_ms": 0.0,
+            "total_ms": 0.0,
+        }
+    
+    def record(self, timings: Dict[str, float], completed: bool) -> None:
+        with self._lock:
+            self._data["streams"] += 1
+            self._data["completed" if completed else "errors"] += 1
+            for key in ("ttfb_ms", "ttfc_ms", "total_ms"):
+                self._data[key] += timings.get(key, 0.0)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._data)
+        count = data["streams"] or 1
+        return {
+            "streams": data["streams"],
+            "completed": data["completed"],
+            "errors": data["errors"],
+            "avg_ttfb_ms": round(data["ttfb_ms"] / count, 1),
+            "avg_ttfc_ms": round(data["ttfc_ms"] / count, 1),
+            "avg_total_ms": round(data["total_ms"] / count, 1),
+        }
+
+
+stream_stats = StreamStats()
+
+
+async def stream_generation(data: Dict[str, Any], timer: StreamTimer) -> AsyncIterator[StreamEvent]:
+    """
+    Router → streaming Planner → Output Guard → Render
+    
+    Input đã qua InputGuard.check_input (view kiểm tra trước khi mở stream).
+    Lỗi được raise cho caller (ValueError: safety/parse, Exception: API).
+    
+    Yields:
+        (event_name, data)
+    """
+    user_input = data["user_input"]
+    yield "input_guard", {"status": "passed"}
+    
+    # 1. Router
+    stage_start = time.perf_counter()
+    local_decision, confident = route_locally(user_input)
+    if confident:
+        router_result = {**local_decision.model_dump(), "source": "local"}
+    else:
+        router_result = await ainvoke_llm_router(
+            with_deadline(chain_registry.get("router"), "router"), user_input, local_decision
+        )
+    timer.record_stage("router", stage_start)
+    log_router_decision(router_result)
+    
+    use_pro = router_result.get("complexity", "easy") == "hard"
+    planner_name = "planner_hard_text" if use_pro else "planner_easy_text"
+    if use_pro and settings.MODEL_FALLBACK_ENABLED and circuit_breakers.get(model_name(True)).is_open():
+        logger.warning(f"{model_name(True)} circuit open, streaming with {model_name(False)}")
+        use_pro, planner_name = False, "planner_fallback_text"
+    yield "router_decision", {**router_result, "model_used": model_name(use_pro)}
+    
+    # 2. Planner: stream raw text, validate từng ngày ngay khi ngày đó đóng
+    stage_start = time.perf_counter()
+    planner = chain_registry.get(planner_name)
+    breaker = (
+        circuit_breakers.get(model_name(use_pro)).track()
+        if settings.CIRCUIT_BREAKER_ENABLED else nullcontext()
+    )
+    usage_handler = UsageMetadataCallbackHandler()
+    parser = study_plan_guard.stream_parser()
+    chars = 0
+    
+    # aclosing(): output hỏng hoặc client ngắt kết nối → dừng stream, hủy LLM call
+    async with admission_slot(lane_for(use_pro)):
+        with breaker:
+            chunks = planner.astream(build_planner_inputs(data), config={"callbacks": [usage_handler]})
+            stage = "planner_pro" if use_pro else "planner_flash"
+            async with aclosing(chunks), aclosing(astream_with_deadline(chunks, stage)) as timed_chunks:
+                async for chunk in timed_chunks:
+                    if not chunk:
+                        continue
+                    timer.mark_first_content()
+                    chars += len(chunk)
+                    yield "planner_progress", {"delta": chunk, "chars": chars}
+                    
+                    for item in study_plan_guard.feed(parser, chunk):
+                        if item.path == SCHEDULE_DAY_PATH:
+                            yield "plan_day", {"index": item.index, "day": item.value.model_dump()}
+    
+    plan = (await study_plan_guard.afinish(parser)).model_dump()
+    timer.record_stage("planner", stage_start)
+    yield "plan", {"plan": plan, "usage": summarize_usage(usage_handler)}
+    
+    # 3. Render
+    stage_start = time.perf_counter()
+    html, render = await arender_plan(
+        plan, data.get("render_mode"),
+        with_deadline(with_admission(chain_registry.get("coder"), "flash"), "coder"),
+    )
+    timer.record_stage("render", stage_start)
+    yield "html", {"html": html, "render": render}
+    
+    yield "done", {
+        "model_used": model_name(use_pro),
+        "skipped_modes": skipped_modes(),
+        "timings": timer.summary(),
+    }
+
+
+def skipped_modes() -> List[str]:
+    """Các chế độ planner đang bật nhưng streaming không áp dụng"""
+    modes = {
+        "structured_output": settings.LLM_STRUCTURED_OUTPUT,
+        "chunked": settings.PLANNER_CHUNKED_ENABLED,
+        "local_scheduler": settings.PLANNER_LOCAL_SCHEDULER,
+    }
+    return [name for name, enabled in modes.items() if enabled]
+
+
+async def cached_events(payload: Dict[str, Any], timer: StreamTimer) -> AsyncIterator[StreamEvent]:
+    """Events cho response đã có sẵn (cache hit): plan + html ngay lập tức"""
+    yield "input_guard", {"status": "passed"}
+    yield "router_decision", {
+        **(payload.get("router_decision") or {}),
+        "model_used": payload.get("model_used"),
+    }
+    timer.mark_first_content()
+    yield "plan", {"plan": payload.get("plan", {})}
+    yield "html", {"html": payload.get("html"), "render": payload.get("render")}
+    yield "done", {
+        "model_used": payload.get("model_used"), "cached": True, "skipped_modes": [], "timings": timer.summary(),
+    }
@@ -0,0 +1,255 @@
+"""
+Request Tracing - wall time + tokens theo từng stage của một request
+
+Stages: input_guard, router, planner_flash / planner_pro, planner_outline /
+planner_week (chunked), scheduler, output_parse, output_repair, coder /
+html_render, firestore_save.
+
+Trace của request nằm trong một ContextVar nên không cần truyền qua chains:
+view gọi start_trace(), code ở mỗi stage bọc `with trace_stage(...)`, tokens
+được TraceCallbackHandler (gắn vào mọi LLM trong InputGuard.get_safe_llm)
+cộng vào stage đang mở. Không có trace → trace_stage không làm gì.
+
+Stages có thể lồng nhau (output_parse / output_repair nằm trong planner),
+nên tổng các stage có thể lớn hơn total.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+from uuid import UUID
+
+from django.conf import settings
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from core.metrics import LLM_LATENCY, LLM_REQUESTS
+from core.langchain.usage import UsageStats
+from core.langsmith.versioning import PromptManager
+
+
+class RequestTrace:
+    """Các stages của một request (thread-safe: speculative chạy stages song song)"""
+    
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        # name -> {count, duration_ms, model, prompt, prompt_tokens, completion_tokens}
+        self._stages: Dict[str, Dict[str, Any]] = {}
+    
+    def stage(self, name: str, model: Optional[str] = None, prompt: Optional[str] = None) -> Dict[str, Any]:
+        # Revision đã resolve (commit hash trên hub), không phải "latest"
+        revision = f"{prompt}@{PromptManager.get_resolved_version(prompt)}" if prompt else None
+        with self._lock:
+            entry = self._stages.setdefault(name, {
+                "count": 0,
+                "duration_ms": 0.0,
+                "model": None,
+                "prompt": None,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            })
+            entry["model"] = model or entry["model"]
+            if revision:
+                entry["prompt"] = revision
+            return entry
+    
+    def finish_stage(self, entry: Dict[str, Any], duration_ms: float) -> None:
+        with self._lock:
+            entry["count"] += 1
+            entry["duration_ms"] += duration_ms
+    
+    def add_usage(self, entry: Dict[str, Any], model: Optional[str], usage: Dict[str, Any]) -> None:
+        with self._lock:
+            entry["model"] = entry["model"] or model
+            entry["prompt_tokens"] += usage.get("input_tokens", 0)
+            entry["completion_tokens"] += usage.get("output_tokens", 0)
+    
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+    
+    def breakdown(self) -> Dict[str, Any]:
+        """Dạng trả về trong field `timings`"""
+        with self._lock:
+            stages = [{"name": name, **entry} for name, entry in self._stages.items()]
+        
+        for stage in stages:
+            stage["duration_ms"] = round(stage["duration_ms"], 1)
+            stage["cost_usd"] = estimate_cost(
+                stage["model"], stage["prompt_tokens"], stage["completion_tokens"]
+            )
+        
+        return {
+            "total_ms": round(self.total_ms(), 1),
+            "prompt_tokens": sum(s["prompt_tokens"] for s in stages),
+            "completion_tokens": sum(s["completion_tokens"] for s in stages),
+            "cost_usd": round(sum(s["cost_usd"] for s in stages), 6),
+            "stages": stages,
+        }
+    
+    def server_timing(self) -> str:
+        """Giá trị header Server-Timing, vd. `router;dur=3.1;desc="local", total;dur=912.4`"""
+        with self._lock:
+            items = list(self._stages.items())
+        
+        parts = []
+        for name, entry in items:
+            part = f"{name};dur={entry['duration_ms']:.1f}"
+            if entry["model"]:
+                part += f';desc="{entry["model"]}"'
+            parts.append(part)
+        parts.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(parts)
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+_current_stage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_stage", default=None)
+
+
+def start_trace() -> RequestTrace:
+    """Bắt đầu trace cho request / job hiện tại"""
+    trace = RequestTrace()
+    current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def trace_stage(name: str, model: Optional[str] = None, prompt: Optional[str] = None):
+    """
+    Đo một stage của trace hiện tại (nếu có)
+    
+    Args:
+        name: tên stage (cộng dồn nếu chạy nhiều lần)
+        model: model của stage (None: lấy từ usage metadata)
+        prompt: tên prompt trong PROMPT_VERSIONS, để aggregate theo revision
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    
+    entry = trace.stage(name, model, prompt)
+    # set lại giá trị cũ thay vì reset(token): an toàn cả khi bọc quanh `yield`
+    # của async generator (có thể được đóng từ context khác)
+    previous = _current_stage.get()
+    _current_stage.set(entry)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.finish_stage(entry, (time.perf_counter() - start) * 1000)
+        _current_stage.set(previous)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    """Chi phí ước tính (USD) theo LLM_TOKEN_PRICES (USD / 1M tokens)"""
+    prices = settings.LLM_TOKEN_PRICES.get(model or "")
+    if not prices:
+        return 0.0
+    cost = (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+    return round(cost, 6)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Cộng usage_metadata của mỗi LLM call vào stage đang mở của trace,
+    và ghi latency / outcome theo model vào metrics (core/metrics.py)
+    """
+    
+    def __init__(self):
+        # run_id -> (model, perf_counter lúc bắt đầu)
+        self._started: Dict[UUID, tuple] = {}
+    
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[Any], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, kwargs)
+    
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, kwargs)
+    
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._observe(run_id, "error")
+    
+    def on_llm_end(self, response: LLMResult, *, run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._observe(run_id, "ok")
+        
+        trace = current_trace.get()
+        if trace is None:
+            return
+        
+        entry = _current_stage.get() or trace.stage("llm")
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                model = (message.response_metadata or {}).get("model_name")
+                trace.add_usage(entry, model, usage)
+    
+    def _start(self, run_id: UUID, kwargs: Dict[str, Any]) -> None:
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        model = str(params.get("model") or metadata.get("ls_model_name") or "unknown")
+        self._started[run_id] = (model.removeprefix("models/"), time.perf_counter())
+    
+    def _observe(self, run_id: Optional[UUID], outcome: str) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        model, start = started
+        LLM_LATENCY.observe(time.perf_counter() - start, model=model)
+        LLM_REQUESTS.inc(model=model, outcome=outcome)
+
+
+class TraceStats:
+    """
+    Aggregate traces đã xong theo stage, model và prompt version (thread-safe)
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_stage = UsageStats()
+        self.by_model = UsageStats()
+        self.by_prompt_version = UsageStats()
+        self._requests = {"count": 0, "total_ms": 0.0, "total_tokens": 0, "cost_usd": 0.0}
+    
+    def record(self, trace: RequestTrace) -> None:
+        breakdown = trace.breakdown()
+        
+        for stage in breakdown["stages"]:
+            usage = {
+                "prompt_tokens": stage["prompt_tokens"],
+                "completion_tokens": stage["completion_tokens"],
+            }
+            self.by_stage.record(stage["name"], stage["duration_ms"], usage)
+            if stage["model"]:
+                self.by_model.record(stage["model"], stage["duration_ms"], usage)
+            if stage["prompt"]:
+                self.by_prompt_version.record(stage["prompt"], stage["duration_ms"], usage)
+        
+        with self._lock:
+            self._requests["count"] += 1
+            self._requests["total_ms"] += breakdown["total_ms"]
+            self._requests["total_tokens"] += breakdown["prompt_tokens"] + breakdown["completion_tokens"]
+            self._requests["cost_usd"] += breakdown["cost_usd"]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = dict(self._requests)
+        count = requests["count"] or 1
+        return {
+            "requests": requests["count"],
+            "avg_total_ms": round(requests["total_ms"] / count, 1),
+            "avg_tokens_per_request": round(requests["total_tokens"] / count, 1),
+            "avg_cost_usd_per_request": round(requests["cost_usd"] / count, 6),
+            "by_stage": self.by_stage.snapshot(),
+            "by_model": self.by_model.snapshot(),
+            "by_prompt_version": self.by_prompt_version.snapshot(),
+        }
+
+
+# Singleton instances
+trace_callback_handler = TraceCallbackHandler()
+trace_stats = TraceStats()
@@ -0,0 +1,73 @@
+"""
+Token usage & latency helpers cho các chains
+"""
+
+import threading
+from typing import Dict, Any
+
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+
+def summarize_usage(handler: UsageMetadataCallbackHandler) -> Dict[str, int]:
+    """
+    Cộng dồn token usage (mọi model) mà handler đã ghi nhận
+    
+    Returns:
+        {prompt_tokens, completion_tokens, total_tokens}
+    """
+    prompt_tokens = 0
+    completion_tokens = 0
+    
+    for usage in handler.usage_metadata.values():
+        prompt_tokens += usage.get("input_tokens", 0)
+        completion_tokens += usage.get("output_tokens", 0)
+    
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class UsageStats:
+    """
+    Aggregate latency + tokens theo key (thread-safe)
+    
+    Usage:
+        render_stats.record("llm", latency_ms=812.5, usage=summarize_usage(handler))
+        render_stats.snapshot()
+        # {"llm": {"count": 1, "avg_latency_ms": 812.5, "avg_total_tokens": 2400, ...}}
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, float]] = {}
+    
+    def record(self, key: str, latency_ms: float, usage: Dict[str, int] = None) -> None:
+        usage = usage or {}
+        with self._lock:
+            entry = self._data.setdefault(key, {
+                "count": 0,
+                "latency_ms": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            })
+            entry["count"] += 1
+            entry["latency_ms"] += latency_ms
+            entry["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            entry["completion_tokens"] += usage.get("completion_tokens", 0)
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {}
+            for key, entry in self._data.items():
+                count = entry["count"] or 1
+                total_tokens = entry["prompt_tokens"] + entry["completion_tokens"]
+                result[key] = {
+                    "count": entry["count"],
+                    "avg_latency_ms": round(entry["latency_ms"] / count, 1),
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "completion_tokens": entry["completion_tokens"],
+                    "avg_total_tokens": round(total_tokens / count, 1),
+                }
+            return result
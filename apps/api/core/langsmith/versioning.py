@@ -4,10 +4,16 @@ Quản lý prompt versions trên LangSmith Hub
 """
 
 import os
+import re
+import time
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, List, Tuple
 
 from django.conf import settings
+from langchain_core.load import dumps, loads
 from langchain_core.prompts import ChatPromptTemplate
 
 logger = logging.getLogger(__name__)
@@ -49,37 +55,258 @@ class PromptManager:
         "coder": "html-generator",
         "judge": "quality-judge",
         "refiner": "plan-refiner",
+        "repair": "output-repair",
+    }
+    
+    # Prompt cache: (name, version) -> (prompt, fetched_at)
+    _cache: Dict[Tuple[str, str], Tuple[ChatPromptTemplate, float]] = {}
+    _cache_lock = threading.Lock()
+    _refreshing: set = set()
+    _change_listeners: List[Callable[[str, str], None]] = []
+    _stats: Dict[str, int] = {
+        "hits": 0,
+        "stale_hits": 0,
+        "misses": 0,
+        "snapshot_loads": 0,
+        "local_fallbacks": 0,
+        "refreshes": 0,
+        "refresh_failures": 0,
+        "prefetch_pulls": 0,
     }
     
     @classmethod
     def get_prompt(cls, name: str, version: str = "latest") -> ChatPromptTemplate:
         """
-        Pull prompt từ LangSmith Hub
+        Lấy prompt từ cache, không bao giờ chờ network
+        
+        Flow:
+        1. Cache còn hạn (TTL) → trả về ngay
+        2. Cache hết hạn → trả về bản cũ, refresh ở background
+        3. Chưa có trong cache → snapshot trên disk (last-known-good),
+           nếu không có thì dùng LOCAL_PROMPTS; refresh ở background
         
         Args:
-            name: router | planner | coder | judge | refiner
+            name: router | planner | coder | judge | refiner | repair
             version: specific version hoặc "latest"
-            
+        
         Returns:
             ChatPromptTemplate instance
         """
         # If hub not available, use local prompts
         if not HUB_AVAILABLE:
             return cls._get_local_prompt(name)
-            
+        
+        key = (name, version)
+        
+        with cls._cache_lock:
+            entry = cls._cache.get(key)
+            if entry is not None:
+                prompt, fetched_at = entry
+                if time.monotonic() - fetched_at < cls._ttl():
+                    cls._stats["hits"] += 1
+                    return prompt
+                cls._stats["stale_hits"] += 1
+            else:
+                cls._stats["misses"] += 1
+        
+        if entry is not None:
+            cls._schedule_refresh(name, version)
+            return prompt
+        
+        # Cold miss: last-known-good snapshot, then bundled local prompt
+        prompt = cls._load_snapshot(name, version)
+        if prompt is not None:
+            cls._bump("snapshot_loads")
+        else:
+            prompt = cls._get_local_prompt(name)
+            cls._bump("local_fallbacks")
+        
+        with cls._cache_lock:
+            # fetched_at = -inf: luôn stale cho tới khi refresh thành công
+            cls._cache.setdefault(key, (prompt, float("-inf")))
+        
+        cls._schedule_refresh(name, version)
+        return prompt
+    
+    @classmethod
+    def prefetch(cls, names: List[str]) -> None:
+        """
+        Pull đồng bộ các prompts vào cache (dùng lúc startup, không phải request path)
+        """
+        if not HUB_AVAILABLE:
+            return
+        
+        for name in names:
+            version = cls.get_configured_version(name)
+            cls._bump("prefetch_pulls")
+            cls._refresh(name, version)
+    
+    @classmethod
+    def add_change_listener(cls, callback: Callable[[str, str], None]) -> None:
+        """
+        Đăng ký callback(name, version) khi refresh trả về prompt khác bản đang cache
+        """
+        cls._change_listeners.append(callback)
+    
+    @classmethod
+    def cache_stats(cls) -> Dict[str, Any]:
+        """
+        Counters của prompt cache
+        
+        hub pulls chỉ xảy ra trong refresh (background) hoặc prefetch (startup),
+        nên refreshes + refresh_failures - prefetch_pulls = số pulls ở background.
+        """
+        with cls._cache_lock:
+            return {
+                **cls._stats,
+                "entries": len(cls._cache),
+                "refreshing": len(cls._refreshing),
+                "ttl_seconds": cls._ttl(),
+            }
+    
+    @classmethod
+    def clear_cache(cls) -> None:
+        """Xóa cache in-process (snapshot trên disk được giữ lại)"""
+        with cls._cache_lock:
+            cls._cache.clear()
+    
+    @classmethod
+    def _pull(cls, name: str, version: str) -> ChatPromptTemplate:
         prompt_suffix = cls.PROMPT_NAMES.get(name, name)
         prompt_path = f"{cls.PROMPT_REPO}/{prompt_suffix}"
         
         if version != "latest":
             prompt_path = f"{prompt_path}:{version}"
         
+        logger.info(f"Pulling prompt from hub: {prompt_path}")
+        return hub.pull(prompt_path)
+    
+    @classmethod
+    def _schedule_refresh(cls, name: str, version: str) -> None:
+        key = (name, version)
+        with cls._cache_lock:
+            if key in cls._refreshing:
+                return
+            cls._refreshing.add(key)
+        
+        thread = threading.Thread(
+            target=cls._refresh,
+            args=(name, version),
+            name=f"prompt-refresh-{name}",
+            daemon=True,
+        )
+        thread.start()
+    
+    @classmethod
+    def _refresh(cls, name: str, version: str) -> None:
+        key = (name, version)
         try:
-            logger.info(f"Pulling prompt from hub: {prompt_path}")
-            return hub.pull(prompt_path)
+            prompt = cls._pull(name, version)
         except Exception as e:
-            logger.warning(f"Failed to pull from hub ({prompt_path}): {e}")
-            # Fallback to local prompts
-            return cls._get_local_prompt(name)
+            logger.warning(f"Failed to refresh prompt {name}:{version} from hub: {e}")
+            with cls._cache_lock:
+                cls._stats["refresh_failures"] += 1
+                cls._refreshing.discard(key)
+                # Giữ bản cũ, thử lại sau một TTL
+                entry = cls._cache.get(key)
+                if entry is not None:
+                    cls._cache[key] = (entry[0], time.monotonic())
+            return
+        
+        with cls._cache_lock:
+            previous = cls._cache.get(key)
+            cls._cache[key] = (prompt, time.monotonic())
+            cls._stats["refreshes"] += 1
+            cls._refreshing.discard(key)
+        
+        cls._save_snapshot(name, version, prompt)
+        
+        if previous is None:
+            return
+        
+        # So nội dung, không so serialize cả object: bản local / snapshot không có
+        # metadata của hub, và prompt không serializable vẫn so được bằng repr
+        if _content_hash(previous[0]) != _content_hash(prompt):
+            logger.info(f"Prompt {name}:{version} changed on hub")
+            for callback in list(cls._change_listeners):
+                try:
+                    callback(name, version)
+                except Exception as e:
+                    logger.warning(f"Prompt change listener failed: {e}")
+    
+    @classmethod
+    def _ttl(cls) -> float:
+        return float(getattr(settings, "PROMPT_CACHE_TTL_SECONDS", 300))
+    
+    @classmethod
+    def _snapshot_path(cls, name: str, version: str) -> Optional[Path]:
+        snapshot_dir = getattr(settings, "PROMPT_SNAPSHOT_DIR", "")
+        if not snapshot_dir:
+            return None
+        safe_version = re.sub(r"[^A-Za-z0-9._-]", "_", version)
+        return Path(snapshot_dir) / f"{name}@{safe_version}.json"
+    
+    @classmethod
+    def _load_snapshot(cls, name: str, version: str) -> Optional[ChatPromptTemplate]:
+        path = cls._snapshot_path(name, version)
+        if path is None or not path.exists():
+            return None
+        
+        try:
+            # Snapshot do chính process này ghi ra → chỉ cho phép langchain_core objects
+            return loads(path.read_text(encoding="utf-8"), allowed_objects="core")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable prompt snapshot {path}: {e}")
+            return None
+    
+    @classmethod
+    def _save_snapshot(cls, name: str, version: str, prompt: ChatPromptTemplate) -> Optional[str]:
+        serialized = _safe_dumps(prompt)
+        path = cls._snapshot_path(name, version)
+        if serialized is None or path is None:
+            return serialized
+        
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(serialized, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write prompt snapshot {path}: {e}")
+        
+        return serialized
+    
+    @classmethod
+    def _bump(cls, counter: str) -> None:
+        with cls._cache_lock:
+            cls._stats[counter] += 1
+    
+    @classmethod
+    def get_configured_version(cls, name: str) -> str:
+        """
+        Version đang được cấu hình cho prompt (settings.PROMPT_VERSIONS)
+        """
+        versions = getattr(settings, "PROMPT_VERSIONS", {}) or {}
+        return versions.get(name, "latest")
+    
+    @classmethod
+    def get_resolved_version(cls, name: str) -> str:
+        """
+        Revision thực của prompt đang dùng cho `name`
+        
+        "latest" (hay một tag) trên hub trỏ tới nội dung khác nhau theo thời gian:
+        trả về commit hash của bản đã pull (metadata lc_hub_commit_hash), không có
+        thì "<version>@<content hash>" (snapshot, LOCAL_PROMPTS).
+        Không tính vào cache_stats.
+        """
+        version = cls.get_configured_version(name)
+        if not HUB_AVAILABLE:
+            return prompt_revision(cls._get_local_prompt(name), version)
+        
+        with cls._cache_lock:
+            entry = cls._cache.get((name, version))
+        prompt = entry[0] if entry is not None else cls.get_prompt(name, version)
+        return prompt_revision(prompt, version)
     
     @classmethod
     def push_prompt(
@@ -96,7 +323,7 @@ class PromptManager:
         """
         if not HUB_AVAILABLE:
             raise RuntimeError("LangSmith hub not available - cannot push prompts")
-            
+        
         prompt_suffix = cls.PROMPT_NAMES.get(name, name)
         prompt_path = f"{cls.PROMPT_REPO}/{prompt_suffix}"
         
@@ -124,3 +351,48 @@ class PromptManager:
             return LOCAL_PROMPTS[name]
         
         raise ValueError(f"Unknown prompt name: {name}")
+
+
+def _safe_dumps(prompt: ChatPromptTemplate) -> Optional[str]:
+    """Serialize prompt cho snapshot; None nếu prompt không serializable"""
+    try:
+        return dumps(prompt)
+    except Exception as e:
+        logger.warning(f"Prompt is not serializable: {e}")
+        return None
+
+
+# id(prompt) -> (prompt, hash): giữ reference để id không bị tái sử dụng
+_content_hashes: Dict[int, Tuple[ChatPromptTemplate, str]] = {}
+_content_hashes_lock = threading.Lock()
+
+
+def _content_hash(prompt: ChatPromptTemplate) -> str:
+    """Hash nội dung prompt (messages / templates, bỏ metadata của hub)"""
+    with _content_hashes_lock:
+        cached = _content_hashes.get(id(prompt))
+        if cached is not None and cached[0] is prompt:
+            return cached[1]
+    
+    content = getattr(prompt, "messages", prompt)
+    try:
+        text = dumps(content)
+    except Exception:
+        text = repr(content)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    
+    with _content_hashes_lock:
+        # Mỗi refresh tạo object mới → bỏ các bản cũ thay vì giữ mãi
+        if len(_content_hashes) >= 256:
+            _content_hashes.clear()
+        _content_hashes[id(prompt)] = (prompt, digest)
+    return digest
+
+
+def prompt_revision(prompt: ChatPromptTemplate, version: str) -> str:
+    """Commit hash trên hub của prompt đã pull, không có thì <version>@<content hash>"""
+    metadata = getattr(prompt, "metadata", None) or {}
+    commit = metadata.get("lc_hub_commit_hash")
+    if commit:
+        return str(commit)[:12]
+    return f"{version}@{_content_hash(prompt)}"
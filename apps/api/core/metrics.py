@@ -0,0 +1,375 @@
+"""
+Prometheus Metrics - counters + histograms, exposition text format
+
+Hot path rẻ: mỗi thread ghi vào shard riêng (dict của thread đó), không
+lock khi inc/observe. Lúc scrape mới cộng các shards lại. Shard của thread
+đã kết thúc (thread mỗi request, executor tạm) được gộp vào một dict chung
+khi có shard mới hoặc lúc scrape, nên số shards chỉ theo số threads đang chạy.
+
+Nhiều worker processes (gunicorn/uvicorn --workers): đặt METRICS_MULTIPROC_DIR,
+mỗi process định kỳ ghi snapshot ra `<dir>/<pid>-<start>.json`; /metrics gộp
+mọi file trong thư mục (counters / histograms cộng dồn, kể cả process đã chết).
+
+Gauges lấy từ stats() của các component lúc scrape (register_collector),
+chỉ phản ánh process đang trả lời /metrics.
+
+Usage:
+    REQUESTS = counter("planner_things_total", "Things", ["kind"])
+    REQUESTS.inc(kind="a")
+    LATENCY = histogram("planner_thing_duration_seconds", "Latency", ["kind"])
+    with LATENCY.time(kind="a"):
+        ...
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import weakref
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Giây: từ check regex (ms) tới Gemini Pro (hàng chục giây)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# (name, help, type) → gauge samples: [(labels dict, value)]
+GaugeSample = Tuple[Dict[str, str], float]
+
+
+class _Metric:
+    kind = ""
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, Tuple[str, ...]]:
+        return self.name, tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def inc(self, amount: float = 1, **labels) -> None:
+        shard = self.registry.shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, registry, name, help, labelnames, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels) -> None:
+        shard = self.registry.shard()
+        key = self._key(labels)
+        # [count per bucket..., count +Inf, sum]
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    """Metrics đã khai báo + shards theo thread + collectors cho gauges"""
+    
+    def __init__(self, multiproc_dir: str = "", flush_interval: float = 5.0):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, List[GaugeSample]]]]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards: List[Tuple[weakref.ref, dict]] = []  # (thread, shard)
+        self._retired: dict = {}  # shards của threads đã kết thúc, đã cộng lại
+        self._flusher: Optional[threading.Thread] = None
+        self._snapshot_path = ""
+    
+    # ============================================
+    # Declaration
+    # ============================================
+    
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+    
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, List[GaugeSample]]]]) -> None:
+        """collector() → [(gauge name, help, [(labels, value), ...]), ...] lúc scrape"""
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+            return self._metrics[metric.name]
+    
+    # ============================================
+    # Hot path
+    # ============================================
+    
+    def shard(self) -> dict:
+        """Shard của thread hiện tại (tạo lần đầu, có lock; sau đó không lock)"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            thread = weakref.ref(threading.current_thread())
+            with self._lock:
+                self._compact()
+                self._shards.append((thread, shard))
+            self._start_flusher()
+        return shard
+    
+    def _compact(self) -> None:
+        """Gộp shards của threads đã kết thúc vào _retired (gọi khi đang giữ self._lock)"""
+        live = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                live.append((thread_ref, shard))
+                continue
+            for key, value in shard.items():
+                _merge(self._retired, key, list(value) if isinstance(value, list) else value)
+        self._shards = live
+    
+    # ============================================
+    # Scrape
+    # ============================================
+    
+    def snapshot(self) -> Dict[Tuple[str, Tuple[str, ...]], Any]:
+        """Cộng mọi shards của process này"""
+        with self._lock:
+            self._compact()
+            merged: Dict[Tuple[str, Tuple[str, ...]], Any] = {
+                key: list(value) if isinstance(value, list) else value
+                for key, value in self._retired.items()
+            }
+            shards = [shard for _, shard in self._shards]
+        
+        for shard in shards:
+            for key, value in shard.copy().items():
+                _merge(merged, key, list(value) if isinstance(value, list) else value)
+        return merged
+    
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        values = self._collect_values()
+        lines: List[str] = []
+        
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            samples = sorted(
+                (labels, value) for (name, labels), value in values.items() if name == metric.name
+            )
+            for labels, value in samples:
+                label_map = dict(zip(metric.labelnames, labels))
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_labels(label_map)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _number(bound)
+                    lines.append(f"{metric.name}_bucket{_labels({**label_map, 'le': le})} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(label_map)} {_number(value[-1])}")
+                lines.append(f"{metric.name}_count{_labels(label_map)} {cumulative}")
+        
+        for collector in collectors:
+            try:
+                gauges = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, help, samples in gauges:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        
+        return "\n".join(lines) + "\n"
+    
+    # ============================================
+    # Multiprocess
+    # ============================================
+    
+    def flush(self) -> None:
+        """Ghi snapshot của process này vào METRICS_MULTIPROC_DIR (ghi atomic)"""
+        if not self.multiproc_dir:
+            return
+        if not self._snapshot_path:
+            Path(self.multiproc_dir).mkdir(parents=True, exist_ok=True)
+            self._snapshot_path = os.path.join(self.multiproc_dir, f"{os.getpid()}-{int(time.time())}.json")
+        
+        rows = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        tmp_path = f"{self._snapshot_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, self._snapshot_path)
+    
+    def _collect_values(self) -> Dict[Tuple[str, Tuple[str, ...]], Any]:
+        if not self.multiproc_dir:
+            return self.snapshot()
+        
+        self.flush()
+        merged: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        for path in Path(self.multiproc_dir).glob("*.json"):
+            try:
+                rows = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping metrics snapshot {path.name}: {e}")
+                continue
+            for name, labels, value in rows:
+                _merge(merged, (name, tuple(labels)), value)
+        return merged
+    
+    def _start_flusher(self) -> None:
+        if not self.multiproc_dir or self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Metrics flush failed: {e}")
+
+
+def _merge(merged: dict, key, value) -> None:
+    current = merged.get(key)
+    if current is None:
+        merged[key] = value
+    elif isinstance(current, list):
+        for i, item in enumerate(value):
+            current[i] += item
+    else:
+        merged[key] = current + value
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Singleton instance
+registry = MetricsRegistry(
+    multiproc_dir=settings.METRICS_MULTIPROC_DIR,
+    flush_interval=settings.METRICS_FLUSH_INTERVAL_SECONDS,
+)
+counter = registry.counter
+histogram = registry.histogram
+register_collector = registry.register_collector
+
+
+# ============================================
+# Metrics dùng chung
+# ============================================
+
+HTTP_REQUESTS = counter(
+    "planner_http_requests_total", "HTTP requests by endpoint and status", ["endpoint", "method", "status"]
+)
+HTTP_LATENCY = histogram(
+    "planner_http_request_duration_seconds", "HTTP request latency (until response headers)", ["endpoint", "method"]
+)
+LLM_REQUESTS = counter(
+    "planner_llm_requests_total", "LLM calls by model and outcome", ["model", "outcome"]
+)
+LLM_LATENCY = histogram(
+    "planner_llm_request_duration_seconds", "LLM call latency by model", ["model"]
+)
+ROUTER_DECISIONS = counter(
+    "planner_router_decisions_total", "Router decisions by complexity and source", ["complexity", "source"]
+)
+GUARD_BLOCKS = counter(
+    "planner_input_guard_blocks_total", "Inputs blocked by the input guard, by pattern family", ["family"]
+)
+PARSE_FAILURES = counter(
+    "planner_output_parse_failures_total", "Planner outputs that failed parsing/validation", ["stage"]
+)
+REPAIRS = counter(
+    "planner_output_repairs_total", "Output repair attempts by outcome", ["outcome"]
+)
+FIRESTORE_LATENCY = histogram(
+    "planner_firestore_operation_duration_seconds", "Firestore operation latency", ["operation"]
+)
+FIRESTORE_FALLBACKS = counter(
+    "planner_firestore_fallbacks_total", "Firestore operations served from the in-memory store", ["operation", "reason"]
+)
+STAGE_TIMEOUTS = counter(
+    "planner_stage_timeouts_total", "Stages cut off by their timeout or the request deadline", ["stage"]
+)
+HEDGED_REQUESTS = counter(
+    "planner_hedged_requests_total", "Hedged LLM calls by stage and which request won", ["stage", "winner"]
+)
+CLIENT_DISCONNECTS = counter(
+    "planner_client_disconnects_total", "Generations cancelled because the client went away", ["endpoint"]
+)
+CIRCUIT_TRANSITIONS = counter(
+    "planner_circuit_breaker_transitions_total", "Circuit breaker state changes per model",
+    ["model", "from_state", "to_state"],
+)
+MODEL_FALLBACKS = counter(
+    "planner_model_fallbacks_total", "Requests served by a fallback model", ["from_model", "to_model", "reason"]
+)
+LLM_RETRIES = counter(
+    "planner_llm_retries_total", "Retries of transient LLM errors", ["model"]
+)
+ADMISSION_SHED = counter(
+    "planner_admission_shed_total", "Requests shed by admission control (429 queue_full, 503 deadline)",
+    ["lane", "reason"],
+)
+ADMISSION_WAIT = histogram(
+    "planner_admission_wait_seconds", "Time queued before an admission slot was granted", ["lane"]
+)
+STRUCTURED_OUTPUT = counter(
+    "planner_structured_output_total", "Structured-output calls by chain and outcome", ["chain", "outcome"]
+)
@@ -0,0 +1,46 @@
+"""
+HTTP Metrics Middleware - số request + latency theo endpoint (core/metrics.py)
+
+Endpoint là route pattern (vd. `api/v1/plans/<str:plan_id>/`), không phải
+path thật, để số label series không tăng theo plan id.
+"""
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from core.metrics import HTTP_LATENCY, HTTP_REQUESTS
+
+
+class MetricsMiddleware:
+    """Chạy được cả sync (WSGI) lẫn async (ASGI), không ép view đổi mode"""
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+    
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+    
+    @staticmethod
+    def _observe(request, response, start: float) -> None:
+        # Streaming responses (SSE / NDJSON): đo tới lúc gửi headers
+        match = getattr(request, "resolver_match", None)
+        endpoint = match.route if match is not None else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
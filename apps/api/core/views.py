@@ -0,0 +1,64 @@
+"""
+Async DRF views
+
+DRF APIView chỉ hỗ trợ handler sync. AsyncAPIView override dispatch để
+handler là `async def`: Django (ASGI) chạy view trực tiếp trên event loop,
+không chiếm một worker thread cho cả LLM round trip.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from core.metrics import registry
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView với handlers async (`async def post(self, request)`)
+    
+    Authentication / permissions / throttling vẫn là code sync (có thể
+    chạm session DB) nên chạy qua sync_to_async.
+    
+    Usage:
+        class MyView(AsyncAPIView):
+            async def get(self, request):
+                data = await repo.get(...)
+                return Response(data)
+    """
+    
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+    
+    async def options(self, request, *args, **kwargs):
+        # Django yêu cầu mọi handler cùng sync hoặc cùng async
+        return super().options(request, *args, **kwargs)
+
+
+def metrics_view(request):
+    """GET /metrics - Prometheus text exposition format"""
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
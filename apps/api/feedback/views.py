@@ -3,14 +3,15 @@ Feedback API Views - Track user actions for F1 Score calculation
 """
 
 import logging
-from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
+from core.views import AsyncAPIView
+
 logger = logging.getLogger(__name__)
 
 
-class FeedbackView(APIView):
+class FeedbackView(AsyncAPIView):
     """
     POST /api/v1/feedback/
     Track user actions (save, regenerate, share)
@@ -21,7 +22,7 @@ class FeedbackView(APIView):
     - share = strong positive signal
     """
     
-    def post(self, request):
+    async def post(self, request):
         plan_id = request.data.get("plan_id")
         action = request.data.get("action")  # save | regenerate | share
         
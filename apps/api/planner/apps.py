@@ -1,5 +1,78 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import setting_changed
+
+logger = logging.getLogger(__name__)
+
+# Settings that invalidate the prebuilt chains when they change
+CHAIN_SETTINGS = {
+    "PROMPT_VERSIONS",
+    "GOOGLE_API_KEY",
+    "LLM_BACKEND",
+    "LANGSMITH_HUB_REPO",
+    "PLANNER_FORMAT_INSTRUCTIONS",
+    "LLM_STRUCTURED_OUTPUT",
+    "PLANNER_CHUNKED_ENABLED",
+    "PLANNER_LOCAL_SCHEDULER",
+}
+
+
+def _on_setting_changed(setting, **kwargs):
+    if setting in CHAIN_SETTINGS:
+        from core.langchain.chains import chain_registry
+        chain_registry.clear()
+
+
+def _component_gauges():
+    """Gauges cho /metrics từ stats() của các components (đọc lúc scrape)"""
+    from core.langchain.admission import admission_controller
+    from core.langchain.circuit_breaker import CIRCUIT_STATES, circuit_breakers
+    from planner.services import job_queue, response_cache, single_flight
+    from planner.workers import job_worker_pool
+
+    lanes = admission_controller.stats()
+    jobs = job_queue.stats()
+    cache = response_cache.stats()
+    return [
+        ("planner_admission_limit", "Concurrent slots per admission lane",
+         [({"lane": lane}, data["limit"]) for lane, data in lanes.items()]),
+        ("planner_admission_in_flight", "Requests holding an admission slot",
+         [({"lane": lane}, data["in_flight"]) for lane, data in lanes.items()]),
+        ("planner_admission_queue_depth", "Requests waiting for an admission slot",
+         [({"lane": lane}, data["queue_depth"]) for lane, data in lanes.items()]),
+        ("planner_response_cache_hits", "Response cache hits in this process by tier",
+         [({"tier": "memory"}, cache["hits"]), ({"tier": "disk"}, cache["disk_hits"])]),
+        ("planner_response_cache_misses", "Response cache misses in this process",
+         [({}, cache["misses"])]),
+        ("planner_response_cache_bytes", "Bytes held by the response cache memory tier",
+         [({}, cache["bytes_used"])]),
+        ("planner_single_flight_in_flight", "Distinct generate executions in flight",
+         [({}, single_flight.stats()["in_flight"])]),
+        ("planner_jobs", "Generation jobs by status",
+         [({"status": status}, count) for status, count in jobs["by_status"].items()]),
+        ("planner_job_workers_busy", "Job workers running a job in this process",
+         [({}, job_worker_pool.stats()["busy"])]),
+        ("planner_circuit_breaker_state", "Circuit breaker state per model (0 closed, 1 half_open, 2 open)",
+         [({"model": model}, CIRCUIT_STATES.index(data["state"]))
+          for model, data in circuit_breakers.stats().items()]),
+    ]
 
 
 class PlannerConfig(AppConfig):
     name = 'planner'
+
+    def ready(self):
+        setting_changed.connect(_on_setting_changed)
+
+        from core.metrics import register_collector
+        register_collector(_component_gauges)
+
+        if settings.LLM_WARM_CHAINS_ON_STARTUP:
+            from core.langchain.chains import chain_registry
+            try:
+                chain_registry.warm()
+            except Exception as e:
+                # Không chặn startup - request đầu tiên sẽ build lại
+                logger.warning(f"Failed to warm chain registry: {e}")
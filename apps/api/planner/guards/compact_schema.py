@@ -0,0 +1,147 @@
+"""
+Compact Schema - Format instructions ngắn gọn cho Pydantic models
+
+PydanticOutputParser.get_format_instructions() đưa nguyên JSON Schema (kèm
+title, $defs, ví dụ foo/bar) vào mọi planner prompt: ~4KB cố định mỗi call.
+Ở đây sinh mô tả dạng TypeScript từ cùng JSON Schema, giữ các ràng buộc
+(enum, pattern, độ dài, min/max), kết quả được cache theo model.
+
+Ví dụ:
+    type StudySession = {
+      start_time: string; // Start time in HH:MM format
+      type: "study" | "review" | "practice" | "break";
+      notes?: string | null; // Optional tips, max 500 chars
+    };
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel
+
+
+# Pattern quen thuộc → gợi ý ngắn (description đã chứa gợi ý thì không lặp lại)
+PATTERN_HINTS = {
+    r"^\d{4}-\d{2}-\d{2}$": "YYYY-MM-DD",
+    r"^\d{2}:\d{2}$": "HH:MM",
+    r"^#[0-9A-Fa-f]{6}$": "#RRGGBB",
+}
+
+ENUM_PATTERN = re.compile(r"^\^\(([\w|]+)\)\$$")
+
+HEADER = (
+    "Return ONLY one JSON object of type {name} (no markdown fences, no text before or after).\n"
+    "Fields marked ? may be omitted. Use double quotes and no trailing commas."
+)
+
+
+def _ref_name(ref: str) -> str:
+    return ref.rsplit("/", 1)[-1]
+
+
+def _string_type(schema: Dict[str, Any]) -> Tuple[str, List[str]]:
+    hints = []
+    pattern = schema.get("pattern")
+    if pattern:
+        enum = ENUM_PATTERN.match(pattern)
+        if enum:
+            return " | ".join(f'"{value}"' for value in enum.group(1).split("|")), hints
+        hints.append(PATTERN_HINTS.get(pattern, f"matches {pattern}"))
+    if "enum" in schema:
+        return " | ".join(f'"{value}"' for value in schema["enum"]), hints
+    if schema.get("maxLength") is not None:
+        hints.append(f"max {schema['maxLength']} chars")
+    elif schema.get("minLength"):
+        hints.append("non-empty")
+    return "string", hints
+
+
+def _number_hints(schema: Dict[str, Any]) -> List[str]:
+    bounds = (
+        ("exclusiveMinimum", ">"),
+        ("minimum", ">="),
+        ("exclusiveMaximum", "<"),
+        ("maximum", "<="),
+    )
+    return [f"{op} {schema[key]:g}" for key, op in bounds if key in schema]
+
+
+def _ts_type(schema: Dict[str, Any], refs: List[str]) -> Tuple[str, List[str]]:
+    """JSON Schema → (kiểu TypeScript, các ràng buộc cho comment)"""
+    if "$ref" in schema:
+        name = _ref_name(schema["$ref"])
+        if name not in refs:
+            refs.append(name)
+        return name, []
+    
+    if "anyOf" in schema:
+        types, hints = [], []
+        for option in schema["anyOf"]:
+            ts, option_hints = _ts_type(option, refs)
+            types.append(ts)
+            hints += option_hints
+        return " | ".join(types), hints
+    
+    kind = schema.get("type")
+    if kind == "string":
+        return _string_type(schema)
+    if kind in ("number", "integer"):
+        return "number", _number_hints(schema)
+    if kind == "boolean":
+        return "boolean", []
+    if kind == "null":
+        return "null", []
+    if kind == "object" and isinstance(schema.get("additionalProperties"), dict):
+        value, hints = _ts_type(schema["additionalProperties"], refs)
+        return f"Record<string, {value}>", hints
+    if kind == "array":
+        item, hints = _ts_type(schema.get("items", {}), refs)
+        if " | " in item:
+            item = f"({item})"
+        if schema.get("minItems") == 1:
+            hints.append("non-empty")
+        elif schema.get("minItems"):
+            hints.append(f"min {schema['minItems']} items")
+        if schema.get("maxItems") is not None:
+            hints.append(f"max {schema['maxItems']} items")
+        return f"{item}[]", hints
+    return "object", []
+
+
+def _object_block(name: str, schema: Dict[str, Any], refs: List[str]) -> str:
+    required = set(schema.get("required", ()))
+    lines = [f"type {name} = {{"]
+    for field, prop in schema.get("properties", {}).items():
+        ts, hints = _ts_type(prop, refs)
+        description = prop.get("description")
+        notes = [description] if description else []
+        notes += [hint for hint in hints if not description or hint not in description]
+        
+        line = f"  {field}{'' if field in required else '?'}: {ts};"
+        if notes:
+            line += " // " + ", ".join(notes)
+        lines.append(line)
+    lines.append("};")
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=None)
+def compact_format_instructions(model_class: type[BaseModel]) -> str:
+    """
+    Format instructions dạng TypeScript cho model_class (cache theo model)
+    
+    Root model trước, nested models theo thứ tự được tham chiếu.
+    """
+    schema = model_class.model_json_schema()
+    defs = schema.get("$defs", {})
+    
+    refs: List[str] = []
+    blocks = [_object_block(model_class.__name__, schema, refs)]
+    emitted = 0
+    while emitted < len(refs):
+        name = refs[emitted]
+        blocks.append(_object_block(name, defs.get(name, {}), refs))
+        emitted += 1
+    
+    return HEADER.format(name=model_class.__name__) + "\n\n" + "\n\n".join(blocks)
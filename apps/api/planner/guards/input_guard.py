@@ -11,8 +11,14 @@ import logging
 from typing import Tuple, List, Dict, Any
 
 from django.conf import settings
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from core.metrics import GUARD_BLOCKS
+from core.langchain.cassette import CassetteChatModel
+from core.langchain.fake import FakeChatModel
+from core.langchain.tracing import trace_callback_handler, trace_stage
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,34 +46,35 @@ class InputGuard:
     #   - BLOCK_NONE / OFF: Không filter (default cho Gemini 2.5/3)
     # ============================================
     
-    # Blacklist patterns - Injection attacks
-    DANGEROUS_PATTERNS = [
-        # SQL Injection
-        r"(?i)(SELECT|INSERT|UPDATE|DELETE|DROP|UNION|ALTER)\s+",
-        r"(?i)(--)|(;)|(\/\*)",
-        
-        # Prompt Injection
-        r"(?i)ignore\s+(previous|all|above)\s+instructions?",
-        r"(?i)disregard\s+(previous|all|above)",
-        r"(?i)forget\s+(everything|all|previous)",
-        r"(?i)you\s+are\s+now\s+a",
-        r"(?i)new\s+instructions?:",
-        r"(?i)system\s*prompt:",
-        r"(?i)act\s+as\s+(if|a)",
-        r"(?i)pretend\s+(to\s+be|you're)",
-        r"(?i)roleplay\s+as",
-        
-        # Code injection
-        r"(?i)<script[^>]*>",
-        r"(?i)javascript:",
-        r"(?i)on\w+\s*=",
-        r"(?i)eval\s*\(",
-        
-        # Path traversal
-        r"\.\./",
-        r"(?i)\/etc\/passwd",
-        r"(?i)\/bin\/",
-    ]
+    # Blacklist patterns - Injection attacks, theo family (label của metrics)
+    DANGEROUS_PATTERNS = {
+        "sql_injection": [
+            r"(?i)(SELECT|INSERT|UPDATE|DELETE|DROP|UNION|ALTER)\s+",
+            r"(?i)(--)|(;)|(\/\*)",
+        ],
+        "prompt_injection": [
+            r"(?i)ignore\s+(previous|all|above)\s+instructions?",
+            r"(?i)disregard\s+(previous|all|above)",
+            r"(?i)forget\s+(everything|all|previous)",
+            r"(?i)you\s+are\s+now\s+a",
+            r"(?i)new\s+instructions?:",
+            r"(?i)system\s*prompt:",
+            r"(?i)act\s+as\s+(if|a)",
+            r"(?i)pretend\s+(to\s+be|you're)",
+            r"(?i)roleplay\s+as",
+        ],
+        "code_injection": [
+            r"(?i)<script[^>]*>",
+            r"(?i)javascript:",
+            r"(?i)on\w+\s*=",
+            r"(?i)eval\s*\(",
+        ],
+        "path_traversal": [
+            r"\.\./",
+            r"(?i)\/etc\/passwd",
+            r"(?i)\/bin\/",
+        ],
+    }
     
     # Suspicious keywords (log but don't block)
     SUSPICIOUS_KEYWORDS = [
@@ -87,18 +94,27 @@ class InputGuard:
         Returns:
             (is_safe, reason)
         """
+        with trace_stage("input_guard"):
+            return cls._check_input(text)
+    
+    @classmethod
+    def _check_input(cls, text: str) -> Tuple[bool, str]:
         if not text or not text.strip():
+            GUARD_BLOCKS.inc(family="empty")
             return False, "Input cannot be empty"
         
         # 1. Check length (prevent token bombing)
         if len(text) > cls.MAX_INPUT_LENGTH:
+            GUARD_BLOCKS.inc(family="too_long")
             return False, f"Input too long (max {cls.MAX_INPUT_LENGTH} characters)"
         
         # 2. Check dangerous patterns
-        for pattern in cls.DANGEROUS_PATTERNS:
-            if re.search(pattern, text):
-                logger.warning(f"Dangerous pattern detected: {pattern[:50]}...")
-                return False, "Blocked: Suspicious pattern detected"
+        for family, patterns in cls.DANGEROUS_PATTERNS.items():
+            for pattern in patterns:
+                if re.search(pattern, text):
+                    logger.warning(f"Dangerous pattern detected ({family}): {pattern[:50]}...")
+                    GUARD_BLOCKS.inc(family=family)
+                    return False, "Blocked: Suspicious pattern detected"
         
         # 3. Log suspicious keywords (but allow)
         for keyword in cls.SUSPICIOUS_KEYWORDS:
@@ -130,19 +146,39 @@ class InputGuard:
         cls, 
         model: str = "gemini-2.5-flash",
         temperature: float = 0.7,
-    ) -> ChatGoogleGenerativeAI:
+    ) -> BaseChatModel:
         """
         Tạo LangChain LLM instance với Safety Settings
+        
+        settings.LLM_BACKEND: "gemini" | "record" / "replay" (cassettes,
+        core/langchain/cassette.py) | "fake" (core/langchain/fake.py)
         """
-        return ChatGoogleGenerativeAI(
+        backend = settings.LLM_BACKEND
+        if backend == "replay":
+            return CassetteChatModel(model=model, mode="replay", callbacks=[trace_callback_handler])
+        if backend == "fake":
+            return FakeChatModel(model=model, temperature=temperature, callbacks=[trace_callback_handler])
+        
+        if backend not in ("gemini", "record"):
+            raise ValueError(f"Unknown LLM_BACKEND: {backend!r}")
+        
+        recording = backend == "record"
+        llm = ChatGoogleGenerativeAI(
             model=model,
             temperature=temperature,
             google_api_key=settings.GOOGLE_API_KEY,
             safety_settings=cls.get_safety_settings(),
+            timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+            max_retries=1,  # 1 = không retry trong SDK; retry + breaker ở core/langchain/circuit_breaker.py
+            # tokens theo stage (core/langchain/tracing.py); khi record thì callbacks ở cassette model
+            callbacks=None if recording else [trace_callback_handler],
         )
+        if recording:
+            return CassetteChatModel(model=model, mode="record", inner=llm, callbacks=[trace_callback_handler])
+        return llm
     
     @classmethod
-    def get_safe_llm_pro(cls, temperature: float = 0.7) -> ChatGoogleGenerativeAI:
+    def get_safe_llm_pro(cls, temperature: float = 0.7) -> BaseChatModel:
         """
         Tạo Gemini 2.5 Pro instance cho Hard tasks
         """
@@ -152,7 +188,7 @@ class InputGuard:
         )
     
     @classmethod
-    def get_safe_llm_flash(cls, temperature: float = 0.7) -> ChatGoogleGenerativeAI:
+    def get_safe_llm_flash(cls, temperature: float = 0.7) -> BaseChatModel:
         """
         Tạo Gemini 2.5 Flash instance cho Easy tasks
         """
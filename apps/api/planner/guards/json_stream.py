@@ -0,0 +1,303 @@
+"""
+Incremental JSON Parser - Parse + validate output LLM trong lúc stream
+
+Đọc từng chunk text, kiểm tra cú pháp JSON ngay khi nhận và validate các
+object con (vd. mỗi DailySchedule trong `schedule`) ngay khi object đóng.
+Cú pháp sai hoặc object không hợp lệ → raise StreamValidationError để
+caller dừng LLM call, không đợi hết response.
+
+Text trước root object (```json, lời dẫn) và sau khi root object đóng
+(``` đóng fence) được bỏ qua. Một `{` trong lời dẫn không được theo sau bởi
+key hay `}` (vd. "Plan {tuần 1}:") không phải JSON → bỏ qua, tìm `{` tiếp theo.
+"""
+
+import re
+import json
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+# Path của một object con: key của object cha, "*" cho phần tử array
+# vd. ("schedule", "*") = mỗi phần tử của plan["schedule"]
+ItemPath = Tuple[str, ...]
+
+_WHITESPACE = " \t\r\n"
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_LITERALS = ("true", "false", "null")
+
+# Trạng thái của container trên stack
+_KEY_OR_END = "key_or_end"
+_KEY = "key"
+_COLON = "colon"
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"
+_COMMA_OR_END = "comma_or_end"
+
+
+class StreamValidationError(ValueError):
+    """Output không hợp lệ, phát hiện trong lúc stream"""
+    
+    def __init__(self, message: str, position: int = 0):
+        super().__init__(message)
+        self.position = position
+
+
+class CompletedItem(NamedTuple):
+    path: ItemPath
+    index: int
+    value: BaseModel
+
+
+class InvalidItem(NamedTuple):
+    location: str
+    position: int
+    error: ValidationError
+
+
+class IncrementalJSONParser:
+    """
+    Parser JSON tăng dần cho một root object
+    
+    Usage:
+        parser = IncrementalJSONParser({("schedule", "*"): DailySchedule})
+        for chunk in llm_stream:
+            for item in parser.feed(chunk):   # raise StreamValidationError
+                ...                           # item.value: DailySchedule
+        data = parser.close()                 # dict của root object
+    
+    Syntax lỗi luôn abort ngay. Object con sai field (ValidationError) được
+    ghi vào `invalid_items` cho tới khi vượt `max_invalid_items`.
+    """
+    
+    def __init__(
+        self,
+        item_models: Optional[Dict[ItemPath, type]] = None,
+        max_invalid_items: int = 0,
+    ):
+        self.item_models = item_models or {}
+        # Số object con sai field được bỏ qua (để repair sau) trước khi abort
+        self.max_invalid_items = max_invalid_items
+        self.invalid_items: List[InvalidItem] = []
+        self.items_completed = 0
+        # Lỗi được caller cho qua (suspend): chỉ buffer text, close() raise lỗi này
+        self.suspended_error: Optional[StreamValidationError] = None
+        self._text = ""
+        self._pos = 0
+        self._root_start = -1
+        self._root_end = -1
+        # Frame: [kind ("{" | "["), state, key, start, count]
+        self._stack: List[list] = []
+        # Token đang đọc dở: "string" | "key" | "scalar" | None
+        self._token: Optional[str] = None
+        self._token_start = 0
+    
+    @property
+    def done(self) -> bool:
+        return self._root_end != -1
+    
+    @property
+    def text(self) -> str:
+        return self._text
+    
+    def feed(self, chunk: str) -> List[CompletedItem]:
+        """Thêm text, trả về các object con vừa hoàn chỉnh và hợp lệ"""
+        self._text += chunk
+        if self.done or self.suspended_error is not None:
+            return []
+        
+        completed: List[CompletedItem] = []
+        text = self._text
+        length = len(text)
+        pos = self._pos
+        
+        while pos < length:
+            if self._token is not None:
+                pos = self._continue_token(text, pos)
+                if self._token is not None:
+                    break  # token chưa kết thúc, đợi chunk tiếp
+                continue
+            
+            char = text[pos]
+            
+            if not self._stack:
+                # Trước root object: bỏ qua mọi thứ tới `{`
+                if char == "{":
+                    self._root_start = pos
+                    self._stack.append(["{", _KEY_OR_END, None, pos, 0])
+                pos += 1
+                continue
+            
+            if char in _WHITESPACE:
+                pos += 1
+                continue
+            
+            frame = self._stack[-1]
+            kind, state = frame[0], frame[1]
+            
+            if state in (_VALUE, _VALUE_OR_END):
+                if char == "]" and state == _VALUE_OR_END:
+                    pos = self._close(pos, completed)
+                elif char == "{":
+                    self._stack.append(["{", _KEY_OR_END, None, pos, 0])
+                    pos += 1
+                elif char == "[":
+                    self._stack.append(["[", _VALUE_OR_END, None, pos, 0])
+                    pos += 1
+                elif char == '"':
+                    self._start_token("string", pos)
+                    pos += 1
+                elif char in "-0123456789tfn":
+                    self._start_token("scalar", pos)
+                else:
+                    self._fail(f"Unexpected {char!r}, expected a value", pos)
+            
+            elif state in (_KEY_OR_END, _KEY):
+                if state == _KEY_OR_END and len(self._stack) == 1 and char not in '"}':
+                    # `{` của lời dẫn, không phải root object
+                    self._stack.pop()
+                    self._root_start = -1
+                elif char == '"':
+                    self._start_token("key", pos)
+                    pos += 1
+                elif char == "}" and state == _KEY_OR_END:
+                    pos = self._close(pos, completed)
+                else:
+                    self._fail(f"Unexpected {char!r}, expected a key", pos)
+            
+            elif state == _COLON:
+                if char != ":":
+                    self._fail(f"Unexpected {char!r}, expected ':'", pos)
+                frame[1] = _VALUE
+                pos += 1
+            
+            else:  # _COMMA_OR_END
+                if char == ",":
+                    frame[1] = _KEY if kind == "{" else _VALUE
+                    pos += 1
+                elif (char == "}" and kind == "{") or (char == "]" and kind == "["):
+                    pos = self._close(pos, completed)
+                else:
+                    self._fail(f"Unexpected {char!r}, expected ',' or end of {kind}", pos)
+            
+            if self.done:
+                break
+        
+        self._pos = pos
+        return completed
+    
+    def close(self) -> Dict[str, Any]:
+        """Stream đã hết: trả về root object (raise nếu JSON chưa đóng)"""
+        if self.suspended_error is not None:
+            raise self.suspended_error
+        if not self.done:
+            if self._root_start == -1:
+                self._fail("No JSON object found in output", len(self._text))
+            self._fail("Incomplete JSON output (stream ended early)", len(self._text))
+        
+        return json.loads(self._text[self._root_start:self._root_end + 1], strict=False)
+    
+    # ============================================
+    # Tokens (string / key / scalar)
+    # ============================================
+    
+    def _start_token(self, token: str, pos: int) -> None:
+        self._token = token
+        self._token_start = pos
+    
+    def _continue_token(self, text: str, pos: int) -> int:
+        """Đọc tiếp token dở; trả về vị trí tiếp theo"""
+        if self._token == "scalar":
+            match = _SCALAR_END.search(text, pos)
+            if match is None:
+                return len(text)
+            end = match.start()
+            raw = text[self._token_start:end]
+            if raw not in _LITERALS and not _NUMBER.fullmatch(raw):
+                self._fail(f"Invalid literal {raw!r}", self._token_start)
+            self._token = None
+            self._value_done()
+            return end
+        
+        # string / key: tìm `"` đóng, bỏ qua ký tự sau `\`
+        while True:
+            match = _STRING_SPECIAL.search(text, pos)
+            if match is None:
+                return len(text)
+            if match.group() == "\\":
+                if match.start() + 1 >= len(text):
+                    return match.start()  # escape bị cắt giữa 2 chunks
+                pos = match.start() + 2
+                continue
+            end = match.start()
+            break
+        
+        token, self._token = self._token, None
+        if token == "key":
+            frame = self._stack[-1]
+            frame[2] = json.loads(text[self._token_start:end + 1], strict=False)
+            frame[1] = _COLON
+        else:
+            self._value_done()
+        return end + 1
+    
+    # ============================================
+    # Containers
+    # ============================================
+    
+    def _value_done(self) -> None:
+        frame = self._stack[-1]
+        frame[1] = _COMMA_OR_END
+        frame[4] += 1
+    
+    def _close(self, pos: int, completed: List[CompletedItem]) -> int:
+        frame = self._stack.pop()
+        
+        if not self._stack:
+            self._root_end = pos
+            return pos + 1
+        
+        path = self._current_path()
+        model = self.item_models.get(path)
+        # Object con bên trong đã lỗi → object này chắc chắn lỗi, không tính lại
+        contains_invalid = bool(self.invalid_items) and self.invalid_items[-1].position >= frame[3]
+        if model is not None and frame[0] == "{" and not contains_invalid:
+            index = self._stack[-1][4]
+            raw = self._text[frame[3]:pos + 1]
+            try:
+                value = model.model_validate(json.loads(raw, strict=False))
+            except ValidationError as e:
+                if len(self.invalid_items) >= self.max_invalid_items:
+                    self._fail(f"Invalid {self._location()}: {e}", frame[3])
+                # Cú pháp đúng, chỉ sai field → để OutputGuard repair khi stream xong
+                self.invalid_items.append(InvalidItem(self._location(), frame[3], e))
+            except ValueError as e:
+                self._fail(f"Invalid {self._location()}: {e}", frame[3])
+            else:
+                completed.append(CompletedItem(path, index, value))
+                self.items_completed += 1
+        
+        self._value_done()
+        return pos + 1
+    
+    def _current_path(self) -> ItemPath:
+        """Path của vị trí hiện tại (đang là value của container trên đỉnh stack)"""
+        return tuple(
+            frame[2] if frame[0] == "{" else "*"
+            for frame in self._stack
+        )
+    
+    def _location(self) -> str:
+        """Vị trí cụ thể để báo lỗi, vd. schedule[3].sessions[1]"""
+        location = ""
+        for frame in self._stack:
+            if frame[0] == "{":
+                location += f".{frame[2]}" if location else str(frame[2])
+            else:
+                location += f"[{frame[4]}]"
+        return location
+    
+    @staticmethod
+    def _fail(message: str, position: int) -> None:
+        raise StreamValidationError(message, position)
@@ -3,13 +3,31 @@ Output Guard - Đảm bảo output từ LLM là JSON hợp lệ
 Sử dụng LangChain AutoFixParser nếu lỗi
 """
 
+import re
+import json
+import asyncio
 import logging
-from typing import Optional, List
+import threading
+from typing import Optional, List, Dict, Any, Iterable, AsyncIterator, Callable, Tuple
 
-from pydantic import BaseModel, Field, field_validator
-from langchain_core.output_parsers import PydanticOutputParser
+from django.conf import settings
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.utils.json import parse_json_markdown
 
 from .input_guard import InputGuard
+from .compact_schema import compact_format_instructions
+from core.langchain.usage import summarize_usage
+from core.langchain.tracing import trace_stage
+from core.metrics import PARSE_FAILURES, REPAIRS
+from core.langsmith.versioning import PromptManager
+from .json_stream import (
+    CompletedItem,
+    IncrementalJSONParser,
+    ItemPath,
+    StreamValidationError,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +95,78 @@ class StudyPlan(BaseModel):
         return v
 
 
+class WeekAllocation(BaseModel):
+    """Mục tiêu + giờ học theo môn của một tuần (chunked planning)"""
+    week: int = Field(..., ge=1, description="Week number, starting at 1")
+    focus: str = Field(..., min_length=1, max_length=300, description="Main goals of the week")
+    hours: Dict[str, float] = Field(default_factory=dict, description="Study hours per subject name")
+
+
+class PlanOutline(BaseModel):
+    """Khung kế hoạch dài hạn: môn học, mốc, phân bổ theo tuần (chưa có lịch từng ngày)"""
+    title: str = Field(..., min_length=1, max_length=200, description="Plan title")
+    start_date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="Start date")
+    end_date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="End date")
+    subjects: List[Subject] = Field(..., min_length=1, description="List of subjects")
+    milestones: List[Milestone] = Field(default_factory=list, description="Milestones")
+    tips: List[str] = Field(default_factory=list, max_length=10, description="Study tips")
+    weeks: List[WeekAllocation] = Field(..., min_length=1, description="One entry per week of the plan")
+    
+    @field_validator('end_date')
+    @classmethod
+    def end_after_start_date(cls, v, info):
+        start_date = info.data.get('start_date')
+        if start_date and v < start_date:
+            raise ValueError('end_date must be after start_date')
+        return v
+
+
+class WeekSchedule(BaseModel):
+    """Lịch từng ngày của một tuần (chunked planning)"""
+    schedule: List[DailySchedule] = Field(..., min_length=1, description="Daily schedules of the week")
+
+
+class PlanConstraints(BaseModel):
+    """Ràng buộc trích từ input cho local scheduler (LLM không tự xếp lịch)"""
+    title: str = Field(..., min_length=1, max_length=200, description="Plan title")
+    start_date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="Start date")
+    end_date: str = Field(..., pattern=r"^\d{4}-\d{2}-\d{2}$", description="End date")
+    subjects: List[Subject] = Field(..., min_length=1, description="List of subjects")
+    deadlines: Dict[str, str] = Field(
+        default_factory=dict, description="Exam or deadline date (YYYY-MM-DD) per subject name"
+    )
+    milestones: List[Milestone] = Field(default_factory=list, description="Milestones")
+    study_days: List[int] = Field(
+        default_factory=lambda: list(range(7)), description="Available weekdays, 0 = Monday ... 6 = Sunday"
+    )
+    daily_hours: float = Field(3.0, gt=0, le=12, description="Study hours per day")
+    day_start: str = Field("08:00", pattern=r"^\d{2}:\d{2}$", description="Start time of the first session, HH:MM")
+    tips: List[str] = Field(default_factory=list, max_length=10, description="Study tips")
+    
+    @field_validator('end_date')
+    @classmethod
+    def end_after_start_date(cls, v, info):
+        start_date = info.data.get('start_date')
+        if start_date and v < start_date:
+            raise ValueError('end_date must be after start_date')
+        return v
+    
+    @field_validator('deadlines')
+    @classmethod
+    def deadlines_are_dates(cls, v):
+        for name, value in v.items():
+            if not re.match(r"^\d{4}-\d{2}-\d{2}$", value):
+                raise ValueError(f'deadline of {name} must be in YYYY-MM-DD format')
+        return v
+    
+    @field_validator('study_days')
+    @classmethod
+    def valid_weekdays(cls, v):
+        if not v or any(day < 0 or day > 6 for day in v):
+            raise ValueError('study_days must be weekdays between 0 and 6')
+        return sorted(set(v))
+
+
 class RouterDecision(BaseModel):
     """Kết quả phân loại từ Router"""
     complexity: str = Field(..., pattern=r"^(easy|hard)$", description="Task complexity")
@@ -88,19 +178,99 @@ class RouterDecision(BaseModel):
 # Output Guard với AutoFix
 # ============================================
 
+# ============================================
+# Repair helpers
+# ============================================
+
+Loc = Tuple[Any, ...]
+
+
+def format_loc(loc: Loc) -> str:
+    """('schedule', 2, 'sessions', 1) → 'schedule[2].sessions[1]'"""
+    text = ""
+    for part in loc:
+        if isinstance(part, int):
+            text += f"[{part}]"
+        else:
+            text += f".{part}" if text else str(part)
+    return text
+
+
+def get_at(data: Any, loc: Loc) -> Any:
+    for part in loc:
+        try:
+            data = data[part]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return data
+
+
+def set_at(data: Any, loc: Loc, value: Any) -> None:
+    parent = get_at(data, loc[:-1])
+    if isinstance(parent, dict) or (isinstance(parent, list) and isinstance(loc[-1], int)):
+        parent[loc[-1]] = value
+    else:
+        raise KeyError(format_loc(loc))
+
+
+def repair_targets(error: ValidationError) -> List[Loc]:
+    """
+    Fragments cần gửi đi repair: object nhỏ nhất chứa mỗi field lỗi
+    
+    vd. lỗi ở schedule[2].sessions[1].end_time → gửi cả session (cần
+    start_time để sửa end_time); lỗi field top-level → chỉ field đó.
+    """
+    targets: List[Loc] = []
+    for item in error.errors():
+        loc = tuple(item["loc"])
+        target = loc[:-1] if len(loc) > 1 else loc
+        if target and target not in targets:
+            targets.append(target)
+    
+    # Bỏ target nằm trong target khác
+    return [
+        t for t in targets
+        if not any(other != t and t[:len(other)] == other for other in targets)
+    ]
+
+
 class OutputGuard:
     """
     Đảm bảo output từ LLM là JSON hợp lệ
-    Sử dụng retry với LLM nếu lỗi parse
+    Field sai (ValidationError) → gửi riêng fragment lỗi cho Flash sửa,
+    tối đa max_retries lần, trong OUTPUT_REPAIR_MAX_TOKENS
     """
     
-    def __init__(self, model_class: type = StudyPlan, max_retries: int = 2):
+    def __init__(
+        self,
+        model_class: type = StudyPlan,
+        max_retries: int = 2,
+        item_models: Optional[Dict[ItemPath, type]] = None,
+    ):
         self.model_class = model_class
         self.max_retries = max_retries
         self._llm = None  # Lazy initialization
         
         # Parser chính
         self.parser = PydanticOutputParser(pydantic_object=model_class)
+        
+        # Object con được validate ngay khi stream xong object đó
+        self.item_models = item_models or {}
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "stream_parses": 0,
+            "stream_aborts": 0,
+            "stream_fallback_parses": 0,
+            "items_validated": 0,
+            "chars_at_abort": 0,
+            "repairs_attempted": 0,
+            "repairs_succeeded": 0,
+            "repairs_failed": 0,
+            "repair_calls": 0,
+            "repair_budget_exceeded": 0,
+            "repair_tokens": 0,
+            "est_regeneration_tokens": 0,
+        }
     
     @property
     def llm(self):
@@ -118,10 +288,10 @@ class OutputGuard:
         2. Nếu lỗi → Thử extract JSON từ output
         3. Nếu vẫn lỗi → Raise exception
         """
-        import json
         import re
         
         first_error = None
+        invalid = None  # (data, ValidationError) của JSON decode được nhưng sai field
         
         # Thử parse trực tiếp
         try:
@@ -138,6 +308,8 @@ class OutputGuard:
             try:
                 data = json.loads(match.strip())
                 return self.model_class(**data)
+            except ValidationError as e:
+                invalid = invalid or (data, e)
             except Exception:
                 continue
         
@@ -150,21 +322,314 @@ class OutputGuard:
                 json_str = output[start:end + 1]
                 data = json.loads(json_str)
                 return self.model_class(**data)
+        except ValidationError as e:
+            invalid = invalid or (data, e)
         except Exception as extract_error:
             logger.warning(f"JSON extraction failed: {extract_error}")
         
+        # JSON đúng nhưng sai field → repair
+        if invalid is not None and self.repair_enabled:
+            return self.repair(*invalid, output_chars=len(output))
+        
+        PARSE_FAILURES.inc(stage="parse")
         raise ValueError(
             f"Cannot parse LLM output. "
             f"Original error: {first_error}"
         )
     
-    def get_format_instructions(self) -> str:
+    # ============================================
+    # Field-level repair
+    # ============================================
+    
+    @property
+    def repair_enabled(self) -> bool:
+        return self.max_retries > 0 and settings.OUTPUT_REPAIR_ENABLED
+    
+    def repair(self, data: Dict[str, Any], error: ValidationError, output_chars: int = 0) -> BaseModel:
+        with trace_stage("output_repair", model="gemini-2.5-flash", prompt="repair"):
+            return self._repair(data, error, output_chars)
+    
+    def _repair(self, data: Dict[str, Any], error: ValidationError, output_chars: int = 0) -> BaseModel:
+        """
+        Sửa các field lỗi bằng Flash rồi patch vào data
+        
+        Mỗi lần chỉ gửi validation errors + fragments chứa lỗi, không gửi cả
+        plan. Dừng khi hết max_retries hoặc token budget.
+        
+        Args:
+            data: JSON đã decode (bị sửa in place)
+            error: ValidationError của data
+            output_chars: độ dài output gốc (để ước lượng chi phí regenerate)
+        
+        Raises:
+            ValueError: không sửa được
+        """
+        budget = settings.OUTPUT_REPAIR_MAX_TOKENS
+        spent = 0
+        self._bump("repairs_attempted")
+        
+        for attempt in range(1, self.max_retries + 1):
+            targets = repair_targets(error)
+            if not targets:
+                break  # lỗi ở cấp cả object, không có fragment để sửa
+            errors = "\n".join(
+                f"- {format_loc(tuple(item['loc']))}: {item['msg']}"
+                for item in error.errors()
+            )
+            fragments = json.dumps(
+                {format_loc(loc): get_at(data, loc) for loc in targets},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            
+            # ~4 chars/token; completion ≈ kích thước fragments
+            estimated = (len(errors) + 2 * len(fragments)) // 4 + 400
+            if spent + estimated > budget:
+                logger.warning(
+                    f"Repair budget exceeded ({spent} + ~{estimated} > {budget} tokens)"
+                )
+                self._bump("repair_budget_exceeded")
+                break
+            
+            usage_handler = UsageMetadataCallbackHandler()
+            try:
+                patches = self._repair_chain().invoke(
+                    {
+                        "schema_name": self.model_class.__name__,
+                        "errors": errors,
+                        "fragments": fragments,
+                    },
+                    config={"callbacks": [usage_handler]},
+                )
+            except Exception as e:
+                logger.warning(f"Repair call failed: {e}")
+                patches = {}
+            
+            tokens = summarize_usage(usage_handler)["total_tokens"]
+            spent += tokens
+            self._bump("repair_calls")
+            self._bump("repair_tokens", tokens)
+            
+            for loc in targets:
+                key = format_loc(loc)
+                if isinstance(patches, dict) and key in patches:
+                    try:
+                        set_at(data, loc, patches[key])
+                    except KeyError:
+                        logger.warning(f"Cannot apply repair patch at {key}")
+            
+            try:
+                result = self.model_class.model_validate(data)
+            except ValidationError as e:
+                error = e
+                logger.warning(f"Repair attempt {attempt} left {e.error_count()} errors")
+                continue
+            
+            logger.info(f"Repaired {len(targets)} fragments in {attempt} attempt(s), {spent} tokens")
+            self._bump("repairs_succeeded")
+            REPAIRS.inc(outcome="succeeded")
+            self._bump("est_regeneration_tokens", output_chars // 4)
+            return result
+        
+        self._bump("repairs_failed")
+        REPAIRS.inc(outcome="failed")
+        PARSE_FAILURES.inc(stage="repair")
+        raise ValueError(f"Cannot parse LLM output. Original error: {error}")
+    
+    def _repair_chain(self):
+        prompt = PromptManager.get_prompt(
+            "repair", version=PromptManager.get_configured_version("repair")
+        )
+        return prompt | self.llm | StrOutputParser() | parse_json_markdown
+    
+    # ============================================
+    # Streaming parse
+    # ============================================
+    
+    def stream_parser(self) -> IncrementalJSONParser:
+        """Parser tăng dần cho một LLM stream"""
+        max_invalid_items = settings.OUTPUT_REPAIR_MAX_INVALID_ITEMS if self.repair_enabled else 0
+        return IncrementalJSONParser(self.item_models, max_invalid_items=max_invalid_items)
+    
+    def feed(self, parser: IncrementalJSONParser, chunk: str) -> List[CompletedItem]:
+        """
+        Đưa một chunk vào parser
+        
+        Lỗi cú pháp trước khi có object con nào hợp lệ (vd. parser bám nhầm
+        `{` trong lời dẫn) không dừng stream: parser chỉ buffer phần còn lại
+        để finish() thử parse() trên toàn bộ text.
+        
+        Raises:
+            ValueError: output không hợp lệ → caller dừng LLM stream
+        """
+        try:
+            with trace_stage("output_parse"):
+                items = parser.feed(chunk)
+        except StreamValidationError as e:
+            if not parser.items_completed:
+                parser.suspended_error = e
+                return []
+            self._record_abort(parser, e)
+            raise ValueError(f"Cannot parse LLM output. Original error: {e}") from e
+        
+        if items:
+            self._bump("items_validated", len(items))
+        return items
+    
+    def finish(self, parser: IncrementalJSONParser) -> BaseModel:
+        """
+        Stream đã hết: validate toàn bộ object
+        
+        Parser tăng dần không tìm được JSON hoàn chỉnh → thử parse() (các
+        strategy cũ: code block, first `{` / last `}`) trên toàn bộ text
+        trước khi coi là lỗi.
+        """
+        try:
+            data = parser.close()
+        except StreamValidationError as e:
+            try:
+                result = self.parse(parser.text)
+            except ValueError:
+                self._record_abort(parser, e)
+                raise ValueError(f"Cannot parse LLM output. Original error: {e}") from e
+            self._bump("stream_fallback_parses")
+            return result
+        
+        self._bump("stream_parses")
+        try:
+            return self.model_class.model_validate(data)
+        except ValidationError as e:
+            if not self.repair_enabled:
+                PARSE_FAILURES.inc(stage="validate")
+                raise ValueError(f"Cannot parse LLM output. Original error: {e}") from e
+            return self.repair(data, e, output_chars=len(parser.text))
+    
+    def parse_stream(
+        self,
+        chunks: Iterable[str],
+        on_item: Optional[Callable[[CompletedItem], None]] = None,
+    ) -> BaseModel:
+        """
+        Parse output trong lúc LLM đang stream
+        
+        Output sai cấu trúc → dừng đọc stream ngay (close generator → hủy
+        LLM call), không tốn thêm output tokens cho một response hỏng.
+        
+        Args:
+            chunks: text chunks từ chain.stream()
+            on_item: gọi với mỗi object con hợp lệ (vd. một DailySchedule)
+        """
+        parser = self.stream_parser()
+        try:
+            for chunk in chunks:
+                for item in self.feed(parser, chunk):
+                    if on_item is not None:
+                        on_item(item)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        
+        return self.finish(parser)
+    
+    async def aparse_stream(
+        self,
+        chunks: AsyncIterator[str],
+        on_item: Optional[Callable[[CompletedItem], None]] = None,
+    ) -> BaseModel:
+        """Async version of parse_stream (chunks từ chain.astream())"""
+        parser = self.stream_parser()
+        try:
+            async for chunk in chunks:
+                for item in self.feed(parser, chunk):
+                    if on_item is not None:
+                        on_item(item)
+        finally:
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        
+        return await self.afinish(parser)
+    
+    async def afinish(self, parser: IncrementalJSONParser) -> BaseModel:
+        """
+        Async version of finish
+        
+        Repair (gọi Flash, hiếm khi xảy ra) và fallback parse() chạy trong
+        thread riêng để không block event loop.
+        """
+        try:
+            data = parser.close()
+        except StreamValidationError as e:
+            try:
+                result = await asyncio.to_thread(self.parse, parser.text)
+            except ValueError:
+                self._record_abort(parser, e)
+                raise ValueError(f"Cannot parse LLM output. Original error: {e}") from e
+            self._bump("stream_fallback_parses")
+            return result
+        
+        self._bump("stream_parses")
+        try:
+            return self.model_class.model_validate(data)
+        except ValidationError as e:
+            if not self.repair_enabled:
+                PARSE_FAILURES.inc(stage="validate")
+                raise ValueError(f"Cannot parse LLM output. Original error: {e}") from e
+            return await asyncio.to_thread(self.repair, data, e, len(parser.text))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            data = dict(self._stats)
+        repairs = data["repairs_attempted"]
+        succeeded = data["repairs_succeeded"]
+        data["repair_success_rate"] = round(succeeded / repairs, 3) if repairs else 0.0
+        # Tokens repair trung bình vs ước lượng output tokens nếu phải regenerate
+        data["avg_repair_tokens"] = round(data["repair_tokens"] / repairs, 1) if repairs else 0.0
+        data["avg_est_regeneration_tokens"] = (
+            round(data["est_regeneration_tokens"] / succeeded, 1) if succeeded else 0.0
+        )
+        return data
+    
+    def _record_abort(self, parser: IncrementalJSONParser, error: StreamValidationError) -> None:
+        logger.warning(f"Stream parse aborted after {len(parser.text)} chars: {error}")
+        PARSE_FAILURES.inc(stage="stream")
+        with self._stats_lock:
+            self._stats["stream_aborts"] += 1
+            self._stats["chars_at_abort"] += len(parser.text)
+    
+    def _bump(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += amount
+    
+    def get_format_instructions(self, style: Optional[str] = None) -> str:
         """
         Trả về format instructions để inject vào prompt
+        
+        Args:
+            style: 'compact' | 'json_schema' (None → PLANNER_FORMAT_INSTRUCTIONS)
         """
+        style = style or settings.PLANNER_FORMAT_INSTRUCTIONS
+        if style == "compact":
+            return compact_format_instructions(self.model_class)
         return self.parser.get_format_instructions()
 
 
 # Pre-configured guards (lazy initialization - no API key required at import)
-study_plan_guard = OutputGuard(model_class=StudyPlan)
+study_plan_guard = OutputGuard(
+    model_class=StudyPlan,
+    item_models={
+        ("schedule", "*"): DailySchedule,
+        ("schedule", "*", "sessions", "*"): StudySession,
+    },
+)
 router_guard = OutputGuard(model_class=RouterDecision, max_retries=1)
+plan_outline_guard = OutputGuard(model_class=PlanOutline)
+plan_constraints_guard = OutputGuard(model_class=PlanConstraints)
+week_schedule_guard = OutputGuard(
+    model_class=WeekSchedule,
+    item_models={
+        ("schedule", "*"): DailySchedule,
+        ("schedule", "*", "sessions", "*"): StudySession,
+    },
+)
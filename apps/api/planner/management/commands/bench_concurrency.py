@@ -0,0 +1,251 @@
+"""
+Benchmark số generation đồng thời một process giữ được
+
+So sánh:
+- sync: chain.invoke trên thread pool (mô hình WSGI cũ: 1 request = 1 thread)
+- async: POST /api/v1/generate/ qua async views + chain.ainvoke trên một event loop
+
+LLM được thay bằng fake model chỉ sleep (không gọi Gemini), nên kết quả
+đo overhead + khả năng giữ request in-flight của process, không đo Gemini.
+
+Usage:
+    python manage.py bench_concurrency
+    python manage.py bench_concurrency --requests 500 --latency 2 --threads 16
+"""
+
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from planner.guards.input_guard import InputGuard
+from planner.views import GeneratePlanView
+from core.langchain.chains import chain_registry
+
+
+class InFlightCounter:
+    """Đếm số LLM calls đang chạy và đỉnh cao nhất"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+    
+    def __enter__(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+    
+    def __exit__(self, *exc):
+        with self._lock:
+            self.current -= 1
+    
+    def reset(self):
+        with self._lock:
+            self.current = 0
+            self.peak = 0
+
+
+in_flight = InFlightCounter()
+
+
+def _fake_plan() -> str:
+    today = date.today()
+    return json.dumps({
+        "title": "Benchmark plan",
+        "start_date": today.isoformat(),
+        "end_date": (today + timedelta(days=1)).isoformat(),
+        "subjects": [{"name": "Toán", "priority": "high", "total_hours": 2, "color": "#3b82f6"}],
+        "schedule": [{
+            "date": today.isoformat(),
+            "day_of_week": "Thứ 2",
+            "sessions": [{
+                "start_time": "08:00",
+                "end_time": "10:00",
+                "subject": "Toán",
+                "task": "Ôn tập",
+                "type": "study",
+            }],
+        }],
+        "milestones": [],
+        "tips": [],
+    }, ensure_ascii=False)
+
+
+class SleepChatModel(BaseChatModel):
+    """Fake chat model: sleep `latency` giây rồi trả về router JSON / plan JSON"""
+    
+    model: str = "fake"
+    latency: float = 1.0
+    
+    @property
+    def _llm_type(self) -> str:
+        return "sleep-fake"
+    
+    def _answer(self, messages) -> ChatResult:
+        system = str(messages[0].content) if messages else ""
+        if "classifier" in system:
+            text = json.dumps({"complexity": "easy", "confidence": 0.95, "reason": "benchmark"})
+        else:
+            text = _fake_plan()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        with in_flight:
+            time.sleep(self.latency)
+        return self._answer(messages)
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        with in_flight:
+            await asyncio.sleep(self.latency)
+        return self._answer(messages)
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent generations per process: sync thread pool vs async views"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200,
+                            help="Number of generate requests per mode")
+        parser.add_argument("--latency", type=float, default=1.0,
+                            help="Fake LLM latency per call (seconds)")
+        parser.add_argument("--threads", type=int, default=8,
+                            help="Worker threads for the sync baseline (WSGI threads per process)")
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Max in-flight requests for the async run (default: --requests)")
+        parser.add_argument("--mode", choices=["both", "sync", "async"], default="both")
+    
+    def handle(self, *args, **options):
+        latency = options["latency"]
+        original_get_safe_llm = InputGuard.__dict__["get_safe_llm"]
+        original_throttles = GeneratePlanView.throttle_classes
+        
+        InputGuard.get_safe_llm = classmethod(
+            lambda cls, model="gemini-2.5-flash", temperature=0.7: SleepChatModel(model=model, latency=latency)
+        )
+        GeneratePlanView.throttle_classes = []
+        chain_registry.clear()
+        
+        try:
+            with override_settings(
+                RESPONSE_CACHE_ENABLED=False, NEAR_DUPLICATE_ENABLED=False, ADMISSION_ENABLED=False,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            ):
+                results = []
+                if options["mode"] in ("both", "sync"):
+                    results.append(self._run_sync(options["requests"], options["threads"]))
+                if options["mode"] in ("both", "async"):
+                    concurrency = options["concurrency"] or options["requests"]
+                    results.append(asyncio.run(self._run_async(options["requests"], concurrency)))
+        finally:
+            InputGuard.get_safe_llm = original_get_safe_llm
+            GeneratePlanView.throttle_classes = original_throttles
+            chain_registry.clear()
+        
+        self._print_results(results, latency)
+    
+    # ============================================
+    # Runs
+    # ============================================
+    
+    def _run_sync(self, requests: int, threads: int) -> dict:
+        chain = chain_registry.get("full")
+        latencies: List[float] = []
+        errors = 0
+        in_flight.reset()
+        
+        def one(i: int) -> Optional[float]:
+            start = time.perf_counter()
+            try:
+                chain.invoke(_request_data(i))
+            except Exception:
+                return None
+            return (time.perf_counter() - start) * 1000
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for latency_ms in pool.map(one, range(requests)):
+                if latency_ms is None:
+                    errors += 1
+                else:
+                    latencies.append(latency_ms)
+        wall = time.perf_counter() - start
+        
+        return _summary(f"sync ({threads} threads)", requests, errors, latencies, wall)
+    
+    async def _run_async(self, requests: int, concurrency: int) -> dict:
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        errors = 0
+        in_flight.reset()
+        
+        async def one(i: int) -> None:
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                data = _request_data(i)
+                response = await client.post(
+                    "/api/v1/generate/",
+                    {"input": data["user_input"]},
+                    content_type="application/json",
+                )
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+        
+        return _summary(f"async (≤{concurrency} in flight)", requests, errors, latencies, wall)
+    
+    # ============================================
+    # Output
+    # ============================================
+    
+    def _print_results(self, results: List[dict], latency: float) -> None:
+        self.stdout.write(f"\nFake LLM latency: {latency:.2f}s per call\n")
+        self.stdout.write(
+            f"{'mode':<28} {'ok':>5} {'err':>4} {'wall s':>8} {'req/s':>8} "
+            f"{'peak LLM':>9} {'p50 ms':>9} {'p95 ms':>9}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r['mode']:<28} {r['ok']:>5} {r['errors']:>4} {r['wall_s']:>8.2f} "
+                f"{r['throughput']:>8.1f} {r['peak_in_flight']:>9} {r['p50_ms']:>9.0f} {r['p95_ms']:>9.0f}"
+            )
+
+
+def _request_data(i: int) -> dict:
+    return {
+        "user_input": f"Lập lịch ôn thi môn Toán tuần sau, chương {i}",
+        "study_hours_per_day": "2",
+        "available_days": "Tất cả các ngày",
+    }
+
+
+def _summary(mode: str, requests: int, errors: int, latencies: List[float], wall: float) -> dict:
+    ordered = sorted(latencies) or [0.0]
+    return {
+        "mode": mode,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_s": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "peak_in_flight": in_flight.peak,
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
@@ -0,0 +1,125 @@
+"""
+Benchmark toàn bộ pipeline POST /api/v1/generate/ (Input Guard, router,
+planner, Output Guard, coder) trên tests/sample_inputs.json
+
+Chạy với LLM_BACKEND hiện tại: record một lần với Gemini thật để ghi
+cassettes, sau đó replay offline (không API key, kết quả deterministic,
+latency theo LLM_REPLAY_LATENCY).
+
+Usage:
+    LLM_BACKEND=record python manage.py bench_pipeline
+    LLM_BACKEND=replay python manage.py bench_pipeline --repeat 5 --concurrency 4
+    LLM_BACKEND=replay LLM_REPLAY_LATENCY="*=recorded:0.5" python manage.py bench_pipeline
+"""
+
+import json
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from django.test.utils import override_settings
+
+from planner.views import GeneratePlanView
+from core.langchain.cassette import cassette_store, latency_sampler
+from core.langchain.chains import chain_registry
+
+
+DEFAULT_INPUTS = Path(settings.BASE_DIR) / "tests" / "sample_inputs.json"
+
+
+def load_inputs(path: Path) -> List[Dict[str, Any]]:
+    """sample_inputs.json: {"easy_inputs": [...], "hard_inputs": [...], ...} → list các input"""
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return [item for group in data.values() if isinstance(group, list) for item in group]
+
+
+class Command(BaseCommand):
+    help = "Run the full generate pipeline over sample inputs with the configured LLM backend (record / replay)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--inputs", type=Path, default=DEFAULT_INPUTS, help="Sample inputs JSON")
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per input")
+        parser.add_argument("--concurrency", type=int, default=1, help="Requests in flight")
+        parser.add_argument("--render-mode", choices=["template", "llm"], default="llm",
+                            help="llm also runs the coder chain")
+    
+    def handle(self, *args, **options):
+        inputs = load_inputs(options["inputs"])
+        original_throttles = GeneratePlanView.throttle_classes
+        GeneratePlanView.throttle_classes = []
+        cassette_store.reset_stats()
+        latency_sampler.reset()
+        chain_registry.clear()
+        
+        try:
+            # Không cache / gộp request: mỗi lần chạy đi hết pipeline.
+            # AsyncClient gửi Host "testserver"
+            with override_settings(
+                RESPONSE_CACHE_ENABLED=False, NEAR_DUPLICATE_ENABLED=False, SINGLE_FLIGHT_ENABLED=False,
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            ):
+                start = time.perf_counter()
+                results = asyncio.run(self._run(inputs, options))
+                wall = time.perf_counter() - start
+        finally:
+            GeneratePlanView.throttle_classes = original_throttles
+            chain_registry.clear()
+        
+        self._print_results(results, wall)
+    
+    async def _run(self, inputs: List[Dict[str, Any]], options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        
+        async def one(item: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/v1/generate/",
+                    {"input": item["input"], "render_mode": options["render_mode"], "timings": True},
+                    content_type="application/json",
+                )
+                latency_ms = (time.perf_counter() - start) * 1000
+            body = response.json()
+            timings = body.get("timings") or {}
+            return {
+                "id": item.get("id", "?"),
+                "status": response.status_code,
+                "code": body.get("code", ""),
+                "model": body.get("model_used") or "-",
+                "latency_ms": latency_ms,
+                "prompt_tokens": timings.get("prompt_tokens", 0),
+                "completion_tokens": timings.get("completion_tokens", 0),
+                "stages": " ".join(
+                    f"{stage['name']}={stage['duration_ms']:.0f}" for stage in timings.get("stages", [])
+                ),
+            }
+        
+        items = [item for item in inputs for _ in range(options["repeat"])]
+        return await asyncio.gather(*(one(item) for item in items))
+    
+    def _print_results(self, results: List[Dict[str, Any]], wall: float) -> None:
+        self.stdout.write(
+            f"{'id':<10} {'status':>6} {'model':<18} {'ms':>8} {'in_tok':>7} {'out_tok':>7}  stages (ms)"
+        )
+        for r in results:
+            status = r["status"] if r["status"] == 200 else f"{r['status']} {r['code']}"
+            self.stdout.write(
+                f"{r['id']:<10} {status!s:>6} {r['model']:<18} {r['latency_ms']:>8.0f} "
+                f"{r['prompt_tokens']:>7} {r['completion_tokens']:>7}  {r['stages']}"
+            )
+        
+        ok = sorted(r["latency_ms"] for r in results if r["status"] == 200) or [0.0]
+        cassettes = cassette_store.stats()
+        self.stdout.write(
+            f"\nbackend={cassettes['backend']} ok={sum(r['status'] == 200 for r in results)}/{len(results)} "
+            f"wall={wall:.2f}s p50={ok[len(ok) // 2]:.0f}ms p95={ok[min(len(ok) - 1, int(len(ok) * 0.95))]:.0f}ms"
+        )
+        self.stdout.write(
+            f"cassettes: recorded={cassettes['recorded']} hits={cassettes['hits']} misses={cassettes['misses']}"
+            + (f" ({cassettes['dir']})" if "dir" in cassettes else "")
+        )
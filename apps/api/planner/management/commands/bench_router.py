@@ -0,0 +1,130 @@
+"""
+Benchmark Local Complexity Router trên tests/sample_inputs.json
+
+Weights của router được chỉnh trên chính các sample này → accuracy là in-sample,
+chưa đủ để bật LOCAL_ROUTER_ENABLED mặc định.
+
+Usage:
+    python manage.py bench_router
+    python manage.py bench_router --threshold 0.8 --compare-llm
+"""
+
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.langchain.local_router import LocalComplexityRouter
+
+
+SAMPLE_INPUTS = Path(settings.BASE_DIR) / "tests" / "sample_inputs.json"
+
+
+class Command(BaseCommand):
+    help = "Benchmark the local complexity router against expected_complexity (and optionally the router LLM)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", type=float, default=None,
+                            help="Confidence threshold (default: LOCAL_ROUTER_CONFIDENCE_THRESHOLD)")
+        parser.add_argument("--repeat", type=int, default=200,
+                            help="Repetitions per sample for local latency measurement")
+        parser.add_argument("--compare-llm", action="store_true",
+                            help="Also run the router LLM (requires GOOGLE_API_KEY) to measure agreement")
+        parser.add_argument("--samples", default=str(SAMPLE_INPUTS))
+    
+    def handle(self, *args, **options):
+        threshold = options["threshold"]
+        if threshold is None:
+            threshold = settings.LOCAL_ROUTER_CONFIDENCE_THRESHOLD
+        
+        samples = self._load_samples(options["samples"])
+        router = LocalComplexityRouter()
+        llm_router = None
+        if options["compare_llm"]:
+            from core.langchain.chains import chain_registry
+            llm_router = chain_registry.get("router")
+        
+        rows = []
+        for sample in samples:
+            text = sample["input"]
+            
+            start = time.perf_counter()
+            for _ in range(options["repeat"]):
+                decision = router.classify(text)
+            local_ms = (time.perf_counter() - start) * 1000 / options["repeat"]
+            
+            row = {
+                "id": sample["id"],
+                "expected": sample["expected_complexity"],
+                "local": decision.complexity,
+                "confidence": decision.confidence,
+                "confident": decision.confidence >= threshold,
+                "local_ms": local_ms,
+                "llm": None,
+                "llm_ms": None,
+            }
+            
+            if llm_router is not None:
+                start = time.perf_counter()
+                try:
+                    row["llm"] = llm_router.invoke({"user_input": text}).get("complexity")
+                except Exception as e:
+                    self.stderr.write(f"Router LLM failed for {sample['id']}: {e}")
+                row["llm_ms"] = (time.perf_counter() - start) * 1000
+            
+            rows.append(row)
+        
+        self._print_rows(rows)
+        self._print_summary(rows, threshold)
+    
+    def _load_samples(self, path):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return [
+            sample
+            for group in data.values()
+            for sample in group
+            if sample.get("expected_complexity")
+        ]
+    
+    def _print_rows(self, rows):
+        self.stdout.write(f"{'id':<10} {'expected':<8} {'local':<6} {'conf':>6} {'skip_llm':>8} {'llm':<6} {'local_ms':>9}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['id']:<10} {row['expected']:<8} {row['local']:<6} "
+                f"{row['confidence']:>6.3f} {str(row['confident']):>8} "
+                f"{row['llm'] or '-':<6} {row['local_ms']:>9.3f}"
+            )
+    
+    def _print_summary(self, rows, threshold):
+        total = len(rows)
+        confident = [r for r in rows if r["confident"]]
+        correct = sum(r["local"] == r["expected"] for r in rows)
+        confident_correct = sum(r["local"] == r["expected"] for r in confident)
+        avg_confidence = sum(r["confidence"] for r in rows) / total
+        avg_local_ms = sum(r["local_ms"] for r in rows) / total
+        
+        self.stdout.write("")
+        self.stdout.write(f"threshold:                 {threshold}")
+        self.stdout.write(f"accuracy (all, in-sample): {correct}/{total} = {correct / total:.1%}")
+        self.stdout.write(f"coverage (skip router):    {len(confident)}/{total} = {len(confident) / total:.1%}")
+        if confident:
+            self.stdout.write(
+                f"accuracy (confident only): {confident_correct}/{len(confident)} = "
+                f"{confident_correct / len(confident):.1%}"
+            )
+        # Calibration: confidence trung bình nên xấp xỉ accuracy
+        self.stdout.write(f"calibration:               avg confidence {avg_confidence:.3f} vs accuracy {correct / total:.3f}")
+        self.stdout.write(f"avg local latency:         {avg_local_ms:.3f} ms")
+        
+        compared = [r for r in rows if r["llm"]]
+        if compared:
+            agree = sum(r["llm"] == r["local"] for r in compared)
+            llm_correct = sum(r["llm"] == r["expected"] for r in compared)
+            avg_llm_ms = sum(r["llm_ms"] for r in compared) / len(compared)
+            removed_ms = avg_llm_ms * len(confident) / total
+            self.stdout.write(f"agreement with LLM:        {agree}/{len(compared)} = {agree / len(compared):.1%}")
+            self.stdout.write(f"LLM accuracy:              {llm_correct}/{len(compared)} = {llm_correct / len(compared):.1%}")
+            self.stdout.write(f"avg LLM router latency:    {avg_llm_ms:.1f} ms")
+            self.stdout.write(f"avg latency removed/req:   {removed_ms:.1f} ms")
@@ -0,0 +1,142 @@
+"""
+Benchmark local scheduler (planner/services/scheduler.py) trên kế hoạch
+tổng hợp hàng trăm ngày / hàng chục môn
+
+Đo thời gian xếp lịch, kiểm tra các quy tắc (giới hạn giờ / ngày, ôn tập
+mỗi tuần, số tuần thiếu buổi ôn scheduler tự báo, giờ không xếp được) và so kích thước output: constraints do LLM
+trích (output tokens khi PLANNER_LOCAL_SCHEDULER=true) vs StudyPlan đầy đủ
+(output tokens khi LLM tự xếp lịch), ước lượng ~4 ký tự / token.
+
+Usage:
+    python manage.py bench_scheduler
+    python manage.py bench_scheduler --days 365 --subjects 40 --repeat 20
+"""
+
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from planner.guards.output_guard import PlanConstraints
+from planner.services import build_schedule, schedule_plan
+from planner.services.scheduler import MAX_STUDY_MINUTES
+
+
+CHARS_PER_TOKEN = 4
+
+# (days, subjects) mặc định
+SIZES = ((30, 5), (120, 12), (365, 40))
+
+
+def synthetic_constraints(days: int, subjects: int, seed: int = 7) -> PlanConstraints:
+    """Kế hoạch tổng hợp: giờ học vừa đủ ~80% thời gian rảnh, 1/3 môn có deadline sớm"""
+    rng = random.Random(seed)
+    start = date(2026, 1, 5)
+    end = start + timedelta(days=days - 1)
+    study_days = [0, 1, 2, 3, 4, 5]
+    daily_hours = 4.0
+    capacity = days * len(study_days) / 7 * daily_hours * 0.8
+    
+    weights = [rng.uniform(0.5, 1.5) for _ in range(subjects)]
+    deadlines = {}
+    subject_list = []
+    for index, weight in enumerate(weights):
+        name = f"Môn {index + 1:02d}"
+        subject_list.append({
+            "name": name,
+            "priority": rng.choice(("high", "medium", "low")),
+            "total_hours": round(min(capacity * weight / sum(weights), 100), 1),
+            "color": f"#{rng.randrange(0x1000000):06x}",
+        })
+        if index % 3 == 0:
+            deadlines[name] = (start + timedelta(days=rng.randrange(days // 2, days))).isoformat()
+    
+    return PlanConstraints(
+        title="Kế hoạch tổng hợp",
+        start_date=start.isoformat(),
+        end_date=end.isoformat(),
+        subjects=subject_list,
+        deadlines=deadlines,
+        study_days=study_days,
+        daily_hours=daily_hours,
+    )
+
+
+def _minutes(clock: str) -> int:
+    return int(clock[:2]) * 60 + int(clock[3:])
+
+
+class Command(BaseCommand):
+    help = "Benchmark the local scheduler on synthetic plans with hundreds of days and dozens of subjects"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Plan length in days (default: several sizes)")
+        parser.add_argument("--subjects", type=int, default=40, help="Number of subjects with --days")
+        parser.add_argument("--repeat", type=int, default=10, help="Runs per size")
+        parser.add_argument("--seed", type=int, default=7)
+    
+    def handle(self, *args, **options):
+        sizes = ((options["days"], options["subjects"]),) if options["days"] else SIZES
+        
+        self.stdout.write(
+            f"{'days':>5} {'subj':>5} {'sessions':>9} {'avg_ms':>8} {'p95_ms':>8} {'max_min/day':>12} "
+            f"{'weekly_rev':>11} {'missed_rev':>11} {'unsched_h':>10} {'in_tok':>8} {'plan_tok':>9} {'ratio':>7}"
+        )
+        for days, subjects in sizes:
+            constraints = synthetic_constraints(days, subjects, options["seed"])
+            
+            latencies = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                result = build_schedule(constraints)
+                plan = schedule_plan(constraints, result)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            
+            constraints_tokens = len(constraints.model_dump_json()) // CHARS_PER_TOKEN
+            plan_tokens = len(json.dumps(plan.model_dump(), ensure_ascii=False)) // CHARS_PER_TOKEN
+            sessions = sum(len(day.sessions) for day in plan.schedule)
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            self.stdout.write(
+                f"{days:>5} {subjects:>5} {sessions:>9} {sum(latencies) / len(latencies):>8.1f} {p95:>8.1f} "
+                f"{self._max_study_minutes(plan):>12} {self._weekly_review_rate(constraints, plan):>11.1%} "
+                f"{sum(result.missed_reviews.values()):>11} {sum(result.unscheduled_minutes.values()) / 60:>10.1f} {constraints_tokens:>8} "
+                f"{plan_tokens:>9} {plan_tokens / constraints_tokens:>6.0f}x"
+            )
+        
+        self.stdout.write(
+            f"max_min/day must stay <= {MAX_STUDY_MINUTES}; weekly_rev = subject-weeks with a review; "
+            "missed_rev = subject-weeks reported in ScheduleResult.missed_reviews"
+        )
+    
+    @staticmethod
+    def _max_study_minutes(plan) -> int:
+        return max(
+            sum(_minutes(s.end_time) - _minutes(s.start_time) for s in day.sessions if s.type != "break")
+            for day in plan.schedule
+        )
+    
+    @staticmethod
+    def _weekly_review_rate(constraints, plan) -> float:
+        """Tỉ lệ (môn, tuần) có buổi ôn, tính từ tuần sau buổi học đầu tiên tới tuần của deadline"""
+        start = date.fromisoformat(plan.start_date)
+        first_week, last_week, reviewed = {}, {}, defaultdict(set)
+        for day in plan.schedule:
+            week = (date.fromisoformat(day.date) - start).days // 7
+            for session in day.sessions:
+                if session.type == "break":
+                    continue
+                first_week.setdefault(session.subject, week)
+                last_week[session.subject] = week
+                if session.type == "review":
+                    reviewed[session.subject].add(week)
+        
+        expected = hit = 0
+        for subject, first in first_week.items():
+            for week in range(first + 1, last_week[subject] + 1):
+                expected += 1
+                hit += week in reviewed[subject]
+        return hit / expected if expected else 1.0
@@ -0,0 +1,147 @@
+"""
+Benchmark format instructions của planner prompt: compact vs json_schema
+trên tests/sample_inputs.json
+
+Mặc định chỉ so kích thước prompt (ước lượng ~4 ký tự / token, không gọi
+API). --live gọi planner thật với từng dạng để đo prompt tokens (usage
+metadata), latency và tỉ lệ output parse được ngay (không repair).
+
+Usage:
+    python manage.py bench_schema
+    python manage.py bench_schema --live --repeat 3
+    python manage.py bench_schema --live --pro
+"""
+
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.utils.json import parse_json_markdown
+from pydantic import ValidationError
+
+from planner.guards.input_guard import InputGuard
+from planner.guards.output_guard import StudyPlan, study_plan_guard
+from core.langchain.chains import build_planner_inputs
+from core.langsmith.versioning import PromptManager
+
+
+SAMPLE_INPUTS = Path(settings.BASE_DIR) / "tests" / "sample_inputs.json"
+
+STYLES = ("json_schema", "compact")
+
+# Ước lượng offline (Gemini count_tokens cần API key)
+CHARS_PER_TOKEN = 4
+
+
+class Command(BaseCommand):
+    help = "Compare compact vs JSON Schema format instructions: prompt size, and with --live tokens, latency and parse rate"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--live", action="store_true",
+                            help="Call the planner LLM (requires GOOGLE_API_KEY)")
+        parser.add_argument("--pro", action="store_true", help="Use Gemini Pro instead of Flash in --live mode")
+        parser.add_argument("--repeat", type=int, default=1, help="LLM calls per sample and style in --live mode")
+        parser.add_argument("--samples", default=str(SAMPLE_INPUTS))
+    
+    def handle(self, *args, **options):
+        samples = self._load_samples(options["samples"])
+        prompt = PromptManager.get_prompt(
+            "planner", version=PromptManager.get_configured_version("planner")
+        )
+        
+        for style in STYLES:
+            instructions = study_plan_guard.get_format_instructions(style)
+            self.stdout.write(
+                f"{style:<12} instructions: {len(instructions):>6} chars  "
+                f"~{len(instructions) // CHARS_PER_TOKEN} tokens"
+            )
+        self.stdout.write("")
+        
+        prompts = {
+            style: prompt.partial(format_instructions=study_plan_guard.get_format_instructions(style))
+            for style in STYLES
+        }
+        
+        rows = []
+        for sample in samples:
+            inputs = build_planner_inputs({"user_input": sample["input"]})
+            row = {"id": sample["id"]}
+            for style in STYLES:
+                messages = prompts[style].format_messages(**inputs)
+                row[f"{style}_chars"] = sum(len(m.content) for m in messages)
+            rows.append(row)
+        
+        self.stdout.write(f"{'id':<10} {'json_schema':>12} {'compact':>10} {'saved':>8}")
+        for row in rows:
+            saved = 1 - row["compact_chars"] / row["json_schema_chars"]
+            self.stdout.write(
+                f"{row['id']:<10} {row['json_schema_chars']:>12} {row['compact_chars']:>10} {saved:>8.1%}"
+            )
+        total = {style: sum(r[f"{style}_chars"] for r in rows) for style in STYLES}
+        self.stdout.write(
+            f"avg prompt: json_schema ~{total['json_schema'] // len(rows) // CHARS_PER_TOKEN} tokens, "
+            f"compact ~{total['compact'] // len(rows) // CHARS_PER_TOKEN} tokens "
+            f"({1 - total['compact'] / total['json_schema']:.1%} smaller)"
+        )
+        
+        if options["live"]:
+            self._bench_live(samples, prompts, options["pro"], options["repeat"])
+    
+    def _load_samples(self, path):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return [
+            sample
+            for group in data.values()
+            for sample in group
+            if sample.get("input", "").strip()
+        ]
+    
+    def _bench_live(self, samples, prompts, use_pro, repeat):
+        if use_pro:
+            llm = InputGuard.get_safe_llm_pro(temperature=0.7)
+        else:
+            llm = InputGuard.get_safe_llm_flash(temperature=0.7)
+        
+        self.stdout.write("")
+        self.stdout.write(f"{'style':<12} {'calls':>6} {'prompt_tok':>11} {'output_tok':>11} {'avg_ms':>9} {'parsed':>8}")
+        for style in STYLES:
+            chain = prompts[style] | llm
+            result = {"calls": 0, "errors": 0, "prompt_tokens": 0, "output_tokens": 0, "ms": 0.0, "parsed": 0}
+            
+            for sample in samples:
+                inputs = build_planner_inputs({"user_input": sample["input"]})
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    try:
+                        message = chain.invoke(inputs)
+                    except Exception as e:
+                        self.stderr.write(f"{style} / {sample['id']} failed: {e}")
+                        result["errors"] += 1
+                        continue
+                    result["ms"] += (time.perf_counter() - start) * 1000
+                    result["calls"] += 1
+                    usage = message.usage_metadata or {}
+                    result["prompt_tokens"] += usage.get("input_tokens", 0)
+                    result["output_tokens"] += usage.get("output_tokens", 0)
+                    result["parsed"] += self._parses(StrOutputParser().invoke(message))
+            
+            calls = result["calls"] or 1
+            self.stdout.write(
+                f"{style:<12} {result['calls']:>6} {result['prompt_tokens'] / calls:>11.0f} "
+                f"{result['output_tokens'] / calls:>11.0f} {result['ms'] / calls:>9.0f} "
+                f"{result['parsed'] / calls:>8.1%}"
+            )
+            if result["errors"]:
+                self.stdout.write(f"{'':<12} {result['errors']} calls failed")
+    
+    @staticmethod
+    def _parses(text: str) -> bool:
+        """Output hợp lệ ngay, không cần Output Guard repair"""
+        try:
+            StudyPlan.model_validate(parse_json_markdown(text))
+        except (ValueError, ValidationError):
+            return False
+        return True
@@ -0,0 +1,192 @@
+"""
+Benchmark Near-Duplicate Index: lookup latency và recall trên các bản
+perturbed của tests/sample_inputs.json
+
+Match chỉ được tính là dùng lại khi ngày tuyệt đối và số lượng khớp (cùng
+điều kiện với GeneratePlanView). Perturbation number_edit (đổi một số:
+2 tuần → 4 tuần) không bao giờ được dùng lại.
+
+Usage:
+    python manage.py bench_similarity
+    python manage.py bench_similarity --entries 300000 --threshold 0.8
+"""
+
+import re
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from planner.services.similarity_index import NearDuplicateIndex, absolute_dates, numeric_quantities
+
+
+SAMPLE_INPUTS = Path(settings.BASE_DIR) / "tests" / "sample_inputs.json"
+
+# Âm tiết để sinh input giả (filler entries)
+SYLLABLES = (
+    "học ôn thi môn toán lý hóa văn sử địa anh tin bài tập chương đề cương "
+    "tuần ngày tháng sáng chiều tối deadline đồ án kiểm tra giữa kỳ cuối kỳ "
+    "luyện đề đọc sách viết báo cáo thuyết trình nhóm lớp thầy cô giờ tiếng"
+).split()
+
+
+def perturb_typo(text: str, rng: random.Random) -> str:
+    """Đổi 1-2 ký tự"""
+    chars = list(text)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        if chars[i].isalpha():
+            chars[i] = rng.choice("aeiouyđnmtc")
+    return "".join(chars)
+
+
+def perturb_line_order(text: str, rng: random.Random) -> str:
+    """Đổi chỗ hai dòng"""
+    lines = text.split("\n")
+    if len(lines) < 2:
+        return text
+    i, j = rng.sample(range(len(lines)), 2)
+    lines[i], lines[j] = lines[j], lines[i]
+    return "\n".join(lines)
+
+
+def perturb_extra_bullet(text: str, rng: random.Random) -> str:
+    """Thêm một bullet ngắn"""
+    return text + "\n- " + " ".join(rng.choice(SYLLABLES) for _ in range(3))
+
+
+def perturb_number_edit(text: str, rng: random.Random) -> str:
+    """Đổi một số (thời lượng, số giờ...): plan khác, không được dùng lại"""
+    numbers = list(re.finditer(r"(?<![\w.,])\d+", text))
+    if not numbers:
+        return text + f"\n- trong {rng.randint(2, 9)} tuần"
+    match = rng.choice(numbers)
+    value = int(match.group())
+    new_value = value + rng.choice([-1, 1, 2, value or 1]) if value > 1 else value + rng.randint(1, 3)
+    return text[:match.start()] + str(new_value) + text[match.end():]
+
+
+def perturb_whitespace(text: str, rng: random.Random) -> str:
+    return "  " + text.replace(" ", "  ").replace("\n", "\n\n") + " \n"
+
+
+PERTURBATIONS = {
+    "typo": perturb_typo,
+    "line_order": perturb_line_order,
+    "extra_bullet": perturb_extra_bullet,
+    "whitespace": perturb_whitespace,
+    "number_edit": perturb_number_edit,
+}
+
+# Perturbations làm đổi plan: mọi lần dùng lại đều là lỗi
+MUST_NOT_MATCH = {"number_edit"}
+
+
+def reusable(query: str, payload: dict) -> bool:
+    """Cùng điều kiện dùng lại của GeneratePlanView (ngày tuyệt đối + số lượng)"""
+    return (
+        absolute_dates(query) == payload.get("dates", [])
+        and numeric_quantities(query) == payload.get("quantities")
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark near-duplicate lookup latency and recall"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=100000,
+                            help="Number of filler entries in the index")
+        parser.add_argument("--threshold", type=float, default=None,
+                            help="Similarity threshold (default: NEAR_DUPLICATE_THRESHOLD)")
+        parser.add_argument("--variants", type=int, default=20,
+                            help="Perturbed variants per sample and perturbation type")
+        parser.add_argument("--seed", type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        threshold = options["threshold"] or settings.NEAR_DUPLICATE_THRESHOLD
+        entries = options["entries"]
+        
+        index = NearDuplicateIndex(threshold=threshold, max_entries=entries + 1000)
+        samples = self._load_samples()
+        
+        # 1. Filler entries (input giả, độ dài tương tự input thật)
+        start = time.perf_counter()
+        for i in range(entries):
+            text = "\n".join(
+                " ".join(rng.choice(SYLLABLES) for _ in range(rng.randint(6, 14)))
+                for _ in range(rng.randint(2, 6))
+            )
+            index.insert(text, "", {"id": f"filler_{i}"})
+        insert_s = time.perf_counter() - start
+        
+        # 2. Sample inputs thật
+        for sample in samples:
+            index.insert(sample["input"], "", {
+                "id": sample["id"],
+                "dates": absolute_dates(sample["input"]),
+                "quantities": numeric_quantities(sample["input"]),
+            })
+        
+        self.stdout.write(
+            f"index: {len(index)} entries, {index.stats()['buckets']} buckets, "
+            f"insert {insert_s * 1e6 / max(entries, 1):.1f} µs/entry"
+        )
+        
+        # 3. Lookup perturbed variants
+        latencies = []
+        results = {name: [0, 0, 0] for name in PERTURBATIONS}  # found, wrong, total
+        
+        for sample in samples:
+            for name, perturb in PERTURBATIONS.items():
+                for _ in range(options["variants"]):
+                    query = perturb(sample["input"], rng)
+                    
+                    start = time.perf_counter()
+                    match = index.lookup(query)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if match is not None and not reusable(query, match.payload):
+                        match = None
+                    
+                    counts = results[name]
+                    counts[2] += 1
+                    if match is not None and match.payload["id"] == sample["id"]:
+                        counts[0] += 1
+                    elif match is not None:
+                        counts[1] += 1
+        
+        # 4. Negative queries: input mới không có trong index
+        false_positives = 0
+        negatives = 1000
+        for _ in range(negatives):
+            query = " ".join(rng.choice(SYLLABLES) for _ in range(30))
+            if index.lookup(query) is not None:
+                false_positives += 1
+        
+        self.stdout.write(f"threshold: {threshold}")
+        self.stdout.write(f"{'perturbation':<14} {'recall':>8} {'wrong':>6} {'n':>5}")
+        for name, (found, wrong, total) in results.items():
+            if name in MUST_NOT_MATCH:
+                continue
+            self.stdout.write(f"{name:<14} {found / total:>8.1%} {wrong:>6} {total:>5}")
+        
+        for name in sorted(MUST_NOT_MATCH):
+            found, wrong, total = results[name]
+            line = f"{name:<14} reused {found + wrong}/{total} (must be 0)"
+            self.stdout.write(self.style.ERROR(line) if found + wrong else line)
+        
+        latencies.sort()
+        self.stdout.write(
+            f"lookup latency: p50 {statistics.median(latencies):.3f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.3f} ms, "
+            f"max {latencies[-1]:.3f} ms"
+        )
+        self.stdout.write(f"false positives on new inputs: {false_positives}/{negatives}")
+    
+    def _load_samples(self):
+        data = json.loads(SAMPLE_INPUTS.read_text(encoding="utf-8"))
+        return [sample for group in data.values() for sample in group]
@@ -0,0 +1,130 @@
+"""
+Benchmark structured-output mode vs text mode (StrOutputParser + Output Guard)
+cho Router + Planner trên tests/sample_inputs.json
+
+Mặc định dùng FakeChatModel (offline): text mode bị hỏng với tỉ lệ
+--malformed-rate, structured mode luôn đúng schema như constrained decoding
+của Gemini. --live gọi Gemini thật (cần GOOGLE_API_KEY).
+
+Usage:
+    python manage.py bench_structured
+    python manage.py bench_structured --malformed-rate 0.2 --latency 0.2 --repeat 5
+    python manage.py bench_structured --live
+"""
+
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+from planner.guards.input_guard import InputGuard
+from planner.guards.output_guard import study_plan_guard
+from core.langchain.chains import ChainFactory, build_planner_inputs
+from core.langchain.fake import FakeChatModel
+from core.langchain.usage import summarize_usage
+
+
+SAMPLE_INPUTS = Path(settings.BASE_DIR) / "tests" / "sample_inputs.json"
+
+MODES = ("text", "structured")
+
+
+class Command(BaseCommand):
+    help = "Compare structured-output mode with the text parsing path: failures, tokens, latency"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--live", action="store_true", help="Call Gemini (requires GOOGLE_API_KEY)")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per sample and mode")
+        parser.add_argument("--latency", type=float, default=0.05, help="Fake model latency per call (seconds)")
+        parser.add_argument("--malformed-rate", type=float, default=0.1,
+                            help="Share of fake text-mode outputs that are malformed")
+        parser.add_argument("--seed", type=int, default=7)
+        parser.add_argument("--samples", default=str(SAMPLE_INPUTS))
+    
+    def handle(self, *args, **options):
+        samples = self._load_samples(options["samples"])
+        original_get_safe_llm = InputGuard.__dict__["get_safe_llm"]
+        
+        if not options["live"]:
+            latency, malformed_rate, seed = options["latency"], options["malformed_rate"], options["seed"]
+            InputGuard.get_safe_llm = classmethod(
+                lambda cls, model="gemini-2.5-flash", temperature=0.7, **kwargs: FakeChatModel(
+                    model=model, temperature=temperature, latency=latency,
+                    malformed_rate=malformed_rate, seed=seed,
+                )
+            )
+        
+        try:
+            results = [self._run(mode, samples, options["repeat"]) for mode in MODES]
+        finally:
+            InputGuard.get_safe_llm = original_get_safe_llm
+        
+        self.stdout.write(f"backend: {'gemini' if options['live'] else 'fake'}, {len(samples)} samples x {options['repeat']}")
+        self.stdout.write(
+            f"{'mode':<11} {'requests':>8} {'failed':>8} {'repairs':>8} "
+            f"{'prompt_tok':>11} {'output_tok':>11} {'avg_ms':>9} {'p95_ms':>9}"
+        )
+        for result in results:
+            requests = result["requests"] or 1
+            latencies = sorted(result["latencies"]) or [0.0]
+            p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+            self.stdout.write(
+                f"{result['mode']:<11} {result['requests']:>8} {result['failed'] / requests:>8.1%} "
+                f"{result['repairs']:>8} {result['prompt_tokens'] / requests:>11.0f} "
+                f"{result['completion_tokens'] / requests:>11.0f} "
+                f"{sum(latencies) / len(latencies):>9.1f} {p95:>9.1f}"
+            )
+    
+    def _load_samples(self, path):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return [
+            sample
+            for group in data.values()
+            for sample in group
+            if sample.get("input", "").strip()
+        ]
+    
+    def _run(self, mode, samples, repeat):
+        with override_settings(LLM_STRUCTURED_OUTPUT=mode == "structured"):
+            router = ChainFactory.create_router_chain()
+            planners = {
+                False: ChainFactory.create_planner_chain(use_pro=False),
+                True: ChainFactory.create_planner_chain(use_pro=True),
+            }
+        
+        result = {
+            "mode": mode,
+            "requests": 0,
+            "failed": 0,
+            "repairs": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latencies": [],
+        }
+        repairs_before = study_plan_guard.stats()["repairs_attempted"]
+        
+        for sample in samples:
+            for _ in range(repeat):
+                handler = UsageMetadataCallbackHandler()
+                config = {"callbacks": [handler]}
+                start = time.perf_counter()
+                try:
+                    decision = router.invoke({"user_input": sample["input"]}, config)
+                    use_pro = decision.get("complexity") == "hard"
+                    planners[use_pro].invoke(build_planner_inputs({"user_input": sample["input"]}), config)
+                except Exception as e:
+                    self.stderr.write(f"{mode} / {sample['id']} failed: {e}")
+                    result["failed"] += 1
+                result["latencies"].append((time.perf_counter() - start) * 1000)
+                result["requests"] += 1
+                
+                usage = summarize_usage(handler)
+                result["prompt_tokens"] += usage["prompt_tokens"]
+                result["completion_tokens"] += usage["completion_tokens"]
+        
+        result["repairs"] = study_plan_guard.stats()["repairs_attempted"] - repairs_before
+        return result
@@ -0,0 +1,36 @@
+"""
+Chạy generation job workers trong process riêng
+
+Dùng khi JOB_WORKERS_IN_PROCESS=false (web process chỉ enqueue). Nhiều
+process có thể cùng chạy trên một JOB_QUEUE_PATH.
+
+Usage:
+    python manage.py run_job_workers
+    python manage.py run_job_workers --workers 8
+"""
+
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from planner.workers import JobWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Run generation job workers (SQLite job queue) in the foreground"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS,
+                            help="Concurrent jobs in this process")
+    
+    def handle(self, *args, **options):
+        pool = JobWorkerPool(
+            workers=options["workers"],
+            poll_interval=settings.JOB_POLL_INTERVAL_SECONDS,
+        )
+        self.stdout.write(f"Running {options['workers']} job workers on {settings.JOB_QUEUE_PATH} (Ctrl+C to stop)")
+        try:
+            asyncio.run(pool.run_forever())
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
@@ -1,4 +1,58 @@
 # Planner services
 from .html_generator import generate_plan_html
+from .response_cache import (
+    normalize_user_input,
+    make_request_namespace,
+    make_request_key,
+    ResponseCache,
+    response_cache,
+)
+from .similarity_index import (
+    NearDuplicateIndex,
+    NearDuplicateMatch,
+    absolute_dates,
+    adapt_plan_dates,
+    near_duplicate_index,
+    numeric_quantities,
+)
+from .job_queue import (
+    JOB_STATUSES,
+    JobQueue,
+    callback_url_allowed,
+    job_queue,
+)
+from .scheduler import (
+    ScheduleResult,
+    build_schedule,
+    schedule_plan,
+)
+from .single_flight import (
+    LeaderFailed,
+    SingleFlight,
+    single_flight,
+)
 
-__all__ = ["generate_plan_html"]
+__all__ = [
+    "generate_plan_html",
+    "normalize_user_input",
+    "make_request_namespace",
+    "make_request_key",
+    "ResponseCache",
+    "response_cache",
+    "NearDuplicateIndex",
+    "NearDuplicateMatch",
+    "absolute_dates",
+    "adapt_plan_dates",
+    "near_duplicate_index",
+    "numeric_quantities",
+    "JOB_STATUSES",
+    "JobQueue",
+    "callback_url_allowed",
+    "job_queue",
+    "ScheduleResult",
+    "build_schedule",
+    "schedule_plan",
+    "LeaderFailed",
+    "SingleFlight",
+    "single_flight",
+]
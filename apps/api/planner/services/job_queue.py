@@ -0,0 +1,367 @@
+"""
+Generation Job Queue - hàng đợi bền vững trên SQLite
+
+Không cần service ngoài: jobs nằm trong một file SQLite (WAL), nhiều
+worker (thread / process) claim cùng một file an toàn.
+
+- priority: số lớn chạy trước, cùng priority thì FIFO
+- visibility timeout: job "running" quá hạn lease (worker chết) được claim lại
+- retry: lỗi tạm thời → queued lại sau backoff lũy thừa (có jitter)
+- dead letter: hết số lần thử hoặc lỗi không retry được → status "dead"
+
+Status: queued → running → succeeded | queued (retry) | dead
+"""
+
+import json
+import time
+import random
+import socket
+import sqlite3
+import ipaddress
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "succeeded", "dead")
+
+
+def callback_url_allowed(url: str) -> bool:
+    """
+    callback_url có được gọi không (chống SSRF)
+    
+    - http(s) và host nằm trong JOB_CALLBACK_ALLOWED_HOSTS (rỗng = chặn mọi callback)
+    - mọi địa chỉ host resolve ra đều phải là public (không loopback / private /
+      link-local / reserved), kiểm tra cả lúc nhận job lẫn lúc gửi callback
+    
+    Resolve DNS (blocking): gọi qua asyncio.to_thread trong code async.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    if parsed.hostname not in settings.JOB_CALLBACK_ALLOWED_HOSTS:
+        return False
+    
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            logger.warning(f"Rejected callback host {parsed.hostname}: resolves to {address}")
+            return False
+    return bool(infos)
+
+
+class JobQueue:
+    """
+    Usage:
+        job = job_queue.enqueue({"user_input": ...}, priority=5)
+        job = job_queue.claim("worker-1")        # None nếu không có job sẵn sàng
+        job_queue.complete(job["id"], "worker-1", result)
+        job_queue.fail(job["id"], "worker-1", "timeout", retryable=True)
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = 3,
+        visibility_timeout: float = 300.0,
+        retry_base_seconds: float = 5.0,
+        retry_max_seconds: float = 300.0,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._stats = {
+            "enqueued": 0,
+            "claimed": 0,
+            "reclaimed": 0,
+            "succeeded": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+        }
+    
+    # ============================================
+    # Producer
+    # ============================================
+    
+    def enqueue(
+        self,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        callback_url: str = "",
+        max_attempts: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        now = time.time()
+        job_id = str(uuid.uuid4())
+        
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, status, priority, payload, attempts, max_attempts,
+                                  available_at, callback_url, created_at, updated_at)
+                VALUES (?, 'queued', ?, ?, 0, ?, ?, ?, ?, ?)
+                """,
+                (
+                    job_id, priority, json.dumps(payload, ensure_ascii=False),
+                    max_attempts or self.max_attempts, now, callback_url, now, now,
+                ),
+            )
+        
+        self._count("enqueued")
+        return self.get(job_id)
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+    
+    # ============================================
+    # Worker
+    # ============================================
+    
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Lấy job priority cao nhất đã tới giờ chạy (hoặc running nhưng hết lease)
+        """
+        now = time.time()
+        
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE: giữ write lock giữa SELECT và UPDATE (nhiều process)
+            conn.execute("BEGIN IMMEDIATE")
+            self._dead_letter_expired(conn, now)
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE (status = 'queued' AND available_at <= ?)
+                   OR (status = 'running' AND lease_expires_at <= ?)
+                ORDER BY priority DESC, available_at, created_at
+                LIMIT 1
+                """,
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            
+            conn.execute(
+                """
+                UPDATE jobs
+                SET status = 'running', attempts = attempts + 1, worker_id = ?,
+                    lease_expires_at = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (worker_id, now + self.visibility_timeout, now, row["id"]),
+            )
+        
+        if row["status"] == "running":
+            logger.warning(f"Job {row['id']}: lease of {row['worker_id']} expired, reclaimed")
+            self._count("reclaimed")
+        self._count("claimed")
+        return self.get(row["id"])
+    
+    def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        """Heartbeat: gia hạn visibility timeout; False nếu job không còn thuộc worker"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+                """,
+                (now + self.visibility_timeout, now, job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+    
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE jobs
+                SET status = 'succeeded', result = ?, error = NULL,
+                    lease_expires_at = NULL, finished_at = ?, updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+                """,
+                (json.dumps(result, ensure_ascii=False), now, now, job_id, worker_id),
+            )
+        
+        if cursor.rowcount != 1:
+            logger.warning(f"Job {job_id}: {worker_id} lost its lease, result dropped")
+            return False
+        self._count("succeeded")
+        return True
+    
+    def fail(
+        self,
+        job_id: str,
+        worker_id: str,
+        error: str,
+        retryable: bool = True,
+        retry_after: float = 0.0,
+    ) -> Optional[str]:
+        """
+        Ghi lỗi của lần chạy: queued lại sau backoff hoặc dead letter
+        
+        Returns:
+            status mới ("queued" | "dead"), None nếu worker đã mất lease
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] != "running" or job["worker_id"] != worker_id:
+            return None
+        
+        now = time.time()
+        if retryable and job["attempts"] < job["max_attempts"]:
+            status = "queued"
+            available_at = now + max(self._backoff(job["attempts"]), retry_after)
+        else:
+            status = "dead"
+            available_at = job["available_at"]
+        
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs
+                SET status = ?, error = ?, available_at = ?, lease_expires_at = NULL,
+                    finished_at = ?, updated_at = ?
+                WHERE id = ? AND worker_id = ? AND status = 'running'
+                """,
+                (status, error, available_at, now if status == "dead" else None, now, job_id, worker_id),
+            )
+        
+        if status == "dead":
+            logger.error(f"Job {job_id} dead-lettered after {job['attempts']} attempt(s): {error}")
+            self._count("dead_lettered")
+        else:
+            logger.warning(
+                f"Job {job_id} attempt {job['attempts']} failed, retry in {available_at - now:.1f}s: {error}"
+            )
+            self._count("retried")
+        return status
+    
+    def set_callback_status(self, job_id: str, callback_status: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET callback_status = ?, updated_at = ? WHERE id = ?",
+                (callback_status, time.time(), job_id),
+            )
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row[0]: row[1] for row in rows})
+        with self._lock:
+            return {"by_status": counts, **self._stats}
+    
+    # ============================================
+    # Internals
+    # ============================================
+    
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff + full jitter (giây)"""
+        ceiling = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** max(attempts - 1, 0)))
+        return random.uniform(ceiling / 2, ceiling)
+    
+    def _dead_letter_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """Job hết lease đã dùng hết số lần thử (worker chết liên tục) → dead"""
+        cursor = conn.execute(
+            """
+            UPDATE jobs
+            SET status = 'dead', error = 'visibility timeout exceeded on last attempt',
+                lease_expires_at = NULL, finished_at = ?, updated_at = ?
+            WHERE status = 'running' AND lease_expires_at <= ? AND attempts >= max_attempts
+            """,
+            (now, now, now),
+        )
+        if cursor.rowcount:
+            logger.error(f"{cursor.rowcount} job(s) dead-lettered after lease expiry")
+            self._count("dead_lettered", cursor.rowcount)
+    
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += amount
+    
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+    
+    @contextmanager
+    def _connect(self):
+        if not self._initialized:
+            self._init_db()
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def _init_db(self) -> None:
+        with self._lock:
+            if self._initialized:
+                return
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        status TEXT NOT NULL,
+                        priority INTEGER NOT NULL,
+                        payload TEXT NOT NULL,
+                        result TEXT,
+                        error TEXT,
+                        attempts INTEGER NOT NULL,
+                        max_attempts INTEGER NOT NULL,
+                        available_at REAL NOT NULL,
+                        lease_expires_at REAL,
+                        worker_id TEXT,
+                        callback_url TEXT NOT NULL DEFAULT '',
+                        callback_status TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL,
+                        finished_at REAL
+                    )
+                    """
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority, available_at)"
+                )
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+
+
+# Singleton instance
+job_queue = JobQueue(
+    path=settings.JOB_QUEUE_PATH,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    visibility_timeout=settings.JOB_VISIBILITY_TIMEOUT_SECONDS,
+    retry_base_seconds=settings.JOB_RETRY_BASE_SECONDS,
+    retry_max_seconds=settings.JOB_RETRY_MAX_SECONDS,
+)
@@ -0,0 +1,320 @@
+"""
+Generation Response Cache
+Cache exact-match cho kết quả generate (router → planner → render)
+
+Key = input đã normalize (whitespace + Unicode NFC) + tham số + prompt revisions
++ chế độ planner + ngày hiện tại (plan phụ thuộc current_date nên cache theo ngày).
+"""
+
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.langsmith.versioning import PromptManager
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_user_input(text: str) -> str:
+    """
+    Normalize input để các bản gửi lại giống nhau cho cùng một key
+    
+    - Unicode NFC: dấu tiếng Việt dựng sẵn vs tổ hợp cho cùng kết quả
+    - Gộp khoảng trắng trong dòng, bỏ khoảng trắng đầu/cuối dòng
+    - Gộp nhiều dòng trống liên tiếp
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    lines = [re.sub(r"[^\S\n]+", " ", line).strip() for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def make_request_namespace(
+    study_hours_per_day: Any,
+    available_days: Any,
+    render_mode: str = "",
+) -> str:
+    """
+    Phần key không phụ thuộc input: tham số request + prompt revisions
+    + các chế độ planner (format instructions, structured output, chunked,
+    local scheduler)
+    
+    Dùng revision đã resolve (commit hash / content hash) thay vì version
+    cấu hình: "latest" đổi nội dung khi prompt được push lên hub.
+    """
+    prompt_names = getattr(settings, "PROMPT_VERSIONS", {}) or {}
+    payload = {
+        "study_hours_per_day": str(study_hours_per_day),
+        "available_days": str(available_days),
+        "render_mode": render_mode,
+        "prompt_versions": {name: PromptManager.get_resolved_version(name) for name in prompt_names},
+        "format_instructions": getattr(settings, "PLANNER_FORMAT_INSTRUCTIONS", "compact"),
+        "structured_output": getattr(settings, "LLM_STRUCTURED_OUTPUT", False),
+        "chunked": getattr(settings, "PLANNER_CHUNKED_ENABLED", False),
+        "local_scheduler": getattr(settings, "PLANNER_LOCAL_SCHEDULER", False),
+    }
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True)
+
+
+def make_request_key(
+    user_input: str,
+    study_hours_per_day: Any,
+    available_days: Any,
+    render_mode: str = "",
+) -> str:
+    """
+    Key cho một generate request (sha256 hex)
+    """
+    parts = [
+        make_request_namespace(study_hours_per_day, available_days, render_mode),
+        timezone.localdate().isoformat(),
+        normalize_user_input(user_input),
+    ]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache giới hạn theo bytes, có disk tier (SQLite) tùy chọn
+    
+    Usage:
+        cached = response_cache.get(key)
+        if cached is None:
+            result = chain.invoke(...)
+            response_cache.set(key, result)
+    """
+    
+    # Dọn disk tier sau mỗi N lần set
+    DISK_PRUNE_INTERVAL = 100
+    
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl_seconds: float,
+        disk_path: str = "",
+        disk_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_max_bytes = disk_max_bytes
+        
+        self._lock = threading.Lock()
+        # key -> (expires_at, size, value)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes_used = 0
+        self._sets_since_prune = 0
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "evictions": 0,
+            "expired": 0,
+            "bypasses": 0,
+        }
+        
+        if self.disk_path:
+            self._init_disk()
+    
+    # ============================================
+    # Public API
+    # ============================================
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                self._remove(key)
+                self._stats["expired"] += 1
+        
+        value = self._disk_get(key, now) if self.disk_path else None
+        
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+        
+        # Promote lên memory tier
+        self._memory_set(key, value, self._encode(value))
+        return value
+    
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        encoded = self._encode(value)
+        self._memory_set(key, value, encoded)
+        
+        with self._lock:
+            self._stats["sets"] += 1
+        
+        if self.disk_path:
+            self._disk_set(key, encoded)
+    
+    def record_bypass(self) -> None:
+        """Request yêu cầu regenerate (bỏ qua cache)"""
+        with self._lock:
+            self._stats["bypasses"] += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes_used = 0
+        
+        if self.disk_path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM responses")
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["hits"] + self._stats["disk_hits"]
+            return {
+                **self._stats,
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes_used": self._bytes_used,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.disk_path),
+            }
+    
+    # ============================================
+    # Memory tier
+    # ============================================
+    
+    def _memory_set(self, key: str, value: Dict[str, Any], encoded: str) -> None:
+        size = len(encoded.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            
+            self._entries[key] = (time.time() + self.ttl_seconds, size, value)
+            self._bytes_used += size
+            
+            while self._bytes_used > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+    
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes_used -= size
+    
+    @staticmethod
+    def _encode(value: Dict[str, Any]) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    
+    # ============================================
+    # Disk tier (SQLite)
+    # ============================================
+    
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.disk_path, timeout=5)
+        try:
+            with conn:  # commit / rollback
+                yield conn
+        finally:
+            conn.close()
+    
+    def _init_disk(self) -> None:
+        Path(self.disk_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+    
+    def _disk_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Response cache disk read failed: {e}")
+            return None
+    
+    def _disk_set(self, key: str, encoded: str) -> None:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, encoded, len(encoded.encode("utf-8")), now + self.ttl_seconds, now),
+                )
+            
+            with self._lock:
+                self._sets_since_prune += 1
+                should_prune = self._sets_since_prune >= self.DISK_PRUNE_INTERVAL
+                if should_prune:
+                    self._sets_since_prune = 0
+            
+            if should_prune:
+                self._disk_prune(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache disk write failed: {e}")
+    
+    def _disk_prune(self, now: float) -> None:
+        """Xóa entries hết hạn, rồi xóa LRU cho tới khi dưới disk_max_bytes"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            if not self.disk_max_bytes:
+                return
+            
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.disk_max_bytes:
+                return
+            
+            excess = total - self.disk_max_bytes
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+            stale_keys = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                stale_keys.append((key,))
+                excess -= size
+            conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+
+# Singleton instance
+response_cache = ResponseCache(
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+    disk_path=settings.RESPONSE_CACHE_DISK_PATH,
+    disk_max_bytes=settings.RESPONSE_CACHE_DISK_MAX_BYTES,
+)
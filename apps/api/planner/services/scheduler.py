@@ -0,0 +1,287 @@
+"""
+Local Scheduler
+Xếp lịch từng ngày từ PlanConstraints (môn, giờ, deadline, ngày rảnh) do
+LLM trích ra - phần tính toán lịch không cần gọi Gemini.
+
+Quy tắc:
+- Mỗi ngày tối đa min(daily_hours, 4h) học, session 50 phút + nghỉ 10 phút;
+  khối lượng được rải đều tới deadline thay vì dồn vào những ngày đầu
+- Môn được chọn theo độ gấp: giờ còn lại / thời gian còn tới deadline × priority
+- Spaced repetition: ôn lại sau 1, 3, 7 ngày kể từ buổi học mới
+- Mỗi môn đang học có một buổi ôn mỗi tuần (rải đều trong tuần, xếp trước
+  học mới nhưng luôn chừa một buổi học mới / ngày); tuần nào không đủ giờ thì
+  ghi vào ScheduleResult.missed_reviews
+- 3 ngày cuối trước deadline: luyện đề / tổng ôn
+
+Chạy deterministic, vài ms cho kế hoạch hàng trăm ngày → re-plan tức thì.
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from planner.guards.output_guard import (
+    DailySchedule,
+    Milestone,
+    PlanConstraints,
+    StudyPlan,
+    StudySession,
+)
+from .similarity_index import VIETNAMESE_WEEKDAYS
+
+logger = logging.getLogger(__name__)
+
+SESSION_MINUTES = 50
+REVIEW_MINUTES = 25
+BREAK_MINUTES = 10
+# Giới hạn học tập trung mỗi ngày (cùng quy tắc với planner prompt)
+MAX_STUDY_MINUTES = 4 * 60
+# Ngày ôn lại sau buổi học mới
+SPACED_INTERVALS = (1, 3, 7)
+# Số ngày cuối trước deadline chỉ luyện đề / tổng ôn
+FINAL_REVIEW_DAYS = 3
+# Session ngắn hơn thì gộp vào session trước
+MIN_SESSION_MINUTES = 15
+
+PRIORITY_WEIGHTS = {"high": 3.0, "medium": 2.0, "low": 1.0}
+
+
+@dataclass
+class _SubjectState:
+    name: str
+    weight: float
+    deadline: date
+    remaining: int  # phút
+    last_day: int = -1  # index ngày học cuối trước deadline
+    parts: int = 0
+    reviewed_week: int = -1
+
+
+@dataclass
+class ScheduleResult:
+    """
+    Lịch đã xếp + số phút không xếp được (thiếu ngày / quá giới hạn giờ)
+    + số tuần mỗi môn không có buổi ôn (ngày học trong tuần không đủ giờ)
+    """
+    schedule: List[DailySchedule]
+    unscheduled_minutes: Dict[str, int] = field(default_factory=dict)
+    missed_reviews: Dict[str, int] = field(default_factory=dict)
+
+
+def _clock(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _study_days(constraints: PlanConstraints, start: date, end: date) -> List[date]:
+    allowed = set(constraints.study_days)
+    return [
+        start + timedelta(days=offset)
+        for offset in range((end - start).days + 1)
+        if (start + timedelta(days=offset)).weekday() in allowed
+    ]
+
+
+def _subject_states(constraints: PlanConstraints, end: date) -> List[_SubjectState]:
+    states = []
+    for subject in constraints.subjects:
+        deadline = end
+        if subject.name in constraints.deadlines:
+            deadline = min(date.fromisoformat(constraints.deadlines[subject.name]), end)
+        states.append(_SubjectState(
+            name=subject.name,
+            weight=PRIORITY_WEIGHTS.get(subject.priority, 1.0),
+            deadline=deadline,
+            remaining=int(round(subject.total_hours * 60)),
+        ))
+    return states
+
+
+def _layout(day: date, start_minutes: int, blocks: List[Tuple[str, str, str, int]]) -> DailySchedule:
+    """(subject, task, type, phút) → sessions có giờ cụ thể, nghỉ giữa các block"""
+    sessions = []
+    clock = start_minutes
+    for index, (subject, task, kind, minutes) in enumerate(blocks):
+        if clock + (BREAK_MINUTES if index else 0) + minutes >= 24 * 60:
+            break
+        if index:
+            sessions.append(StudySession(
+                start_time=_clock(clock),
+                end_time=_clock(clock + BREAK_MINUTES),
+                subject=subject,
+                task="Nghỉ giải lao",
+                type="break",
+            ))
+            clock += BREAK_MINUTES
+        sessions.append(StudySession(
+            start_time=_clock(clock),
+            end_time=_clock(clock + minutes),
+            subject=subject,
+            task=task,
+            type=kind,
+        ))
+        clock += minutes
+    return DailySchedule(date=day.isoformat(), day_of_week=VIETNAMESE_WEEKDAYS[day.weekday()], sessions=sessions)
+
+
+def build_schedule(constraints: PlanConstraints) -> ScheduleResult:
+    """
+    Xếp lịch cho constraints (không gọi LLM)
+    
+    Returns:
+        ScheduleResult (ngày không có session nào bị bỏ)
+    """
+    start = date.fromisoformat(constraints.start_date)
+    end = date.fromisoformat(constraints.end_date)
+    days = _study_days(constraints, start, end)
+    states = _subject_states(constraints, end)
+    budget = min(int(constraints.daily_hours * 60), MAX_STUDY_MINUTES)
+    day_start = int(constraints.day_start[:2]) * 60 + int(constraints.day_start[3:])
+    
+    # Ngày học cuối trước deadline của từng môn, số ngày học còn lại trong tuần
+    for state in states:
+        state.last_day = len(days) - 1
+        while state.last_day >= 0 and days[state.last_day] > state.deadline:
+            state.last_day -= 1
+    week_of = [(day - start).days // 7 for day in days]
+    days_left_in_week = [0] * len(days)
+    for i in range(len(days) - 1, -1, -1):
+        same_week = i + 1 < len(days) and week_of[i + 1] == week_of[i]
+        days_left_in_week[i] = (days_left_in_week[i + 1] if same_week else 0) + 1
+    
+    reviews_due: Dict[date, List[str]] = {}
+    by_name = {state.name: state for state in states}
+    missed: Dict[str, int] = {}
+    schedule = []
+    
+    for i, day in enumerate(days):
+        week = week_of[i]
+        active = [s for s in states if s.remaining > 0 and day <= s.deadline]
+        if not active:
+            continue
+        # Rải đều: mỗi môn cần remaining / số ngày học còn lại tới deadline mỗi ngày
+        days_until = {s.name: max(s.last_day - i + 1, 1) for s in active}
+        demand = sum(s.remaining / days_until[s.name] for s in active)
+        day_budget = min(budget, max(math.ceil(demand / 5) * 5, SESSION_MINUTES))
+        
+        # Ôn tuần: môn tới ngày học cuối trước deadline phải ôn hôm nay, còn lại rải đều
+        # các ngày học còn lại của tuần; được dùng quá nửa ngày nhưng chừa một buổi học mới
+        pending = [s for s in active if s.parts and s.reviewed_week < week]
+        pending.sort(key=lambda s: (s.last_day != i, -s.weight))
+        due_today = sum(s.last_day == i for s in pending)
+        share = math.ceil((len(pending) - due_today) / days_left_in_week[i])
+        weekly = pending[:due_today + share]
+        weekly_minutes = sum(min(REVIEW_MINUTES, s.remaining) for s in weekly)
+        day_budget = min(budget, max(day_budget, weekly_minutes + SESSION_MINUTES if weekly else 0))
+        weekly_budget = max(day_budget // 2, day_budget - SESSION_MINUTES)
+        minutes_left = day_budget
+        study_blocks, review_blocks = [], []
+        reviewed = set()
+        
+        def add_review(state: _SubjectState, task: str) -> None:
+            nonlocal minutes_left
+            minutes = min(REVIEW_MINUTES, state.remaining)
+            review_blocks.append((state.name, task, "review", minutes))
+            state.remaining -= minutes
+            state.reviewed_week = week
+            minutes_left -= minutes
+            reviewed.add(state.name)
+        
+        # 1. Ôn tuần, rồi spaced repetition (spaced: tối đa nửa ngày tính cả ôn tuần)
+        for state in weekly:
+            if day_budget - minutes_left + min(REVIEW_MINUTES, state.remaining) > weekly_budget:
+                break
+            add_review(state, f"Ôn tập tuần: {state.name}")
+        
+        review_budget = day_budget // 2
+        for name in reviews_due.pop(day, []):
+            state = by_name[name]
+            if day_budget - minutes_left + REVIEW_MINUTES > review_budget:
+                break
+            if day <= state.deadline and state.remaining > 0 and name not in reviewed:
+                add_review(state, f"Ôn lại {name} (lặp lại ngắt quãng)")
+        
+        # 2. Học mới / luyện tập theo độ gấp
+        studied = {}
+        while minutes_left > 0:
+            best, best_score = None, 0.0
+            for state in active:
+                if state.remaining <= 0 or studied.get(state.name, 0) >= 2:
+                    continue
+                score = state.remaining / (days_until[state.name] * budget) * state.weight
+                if studied.get(state.name):
+                    score /= 4  # ưu tiên đổi môn trong ngày
+                if score > best_score:
+                    best, best_score = state, score
+            if best is None:
+                break
+            
+            minutes = min(SESSION_MINUTES, best.remaining, minutes_left)
+            # Phần lẻ còn lại gộp vào session này (vẫn trong giới hạn giờ / ngày)
+            if best.remaining - minutes < MIN_SESSION_MINUTES and best.remaining <= budget - day_budget + minutes_left:
+                minutes = best.remaining
+            if minutes < min(MIN_SESSION_MINUTES, best.remaining):
+                break
+            best.parts += 1
+            if (best.deadline - day).days < FINAL_REVIEW_DAYS:
+                task, kind = f"Luyện đề / tổng ôn {best.name}", "practice"
+            elif best.parts % 3 == 0:
+                task, kind = f"Làm bài tập {best.name}", "practice"
+            else:
+                task, kind = f"Học {best.name} - phần {best.parts}", "study"
+            study_blocks.append((best.name, task, kind, minutes))
+            best.remaining -= minutes
+            minutes_left -= minutes
+            
+            if not studied.get(best.name) and kind == "study":
+                for interval in SPACED_INTERVALS:
+                    reviews_due.setdefault(day + timedelta(days=interval), []).append(best.name)
+            studied[best.name] = studied.get(best.name, 0) + 1
+        
+        # Hết cơ hội ôn trong tuần này: ngày học cuối của tuần / trước deadline, hoặc đã hết giờ của môn
+        for state in pending:
+            if state.reviewed_week < week and (
+                days_left_in_week[i] == 1 or state.last_day == i or state.remaining <= 0
+            ):
+                missed[state.name] = missed.get(state.name, 0) + 1
+        
+        # Học mới buổi sáng (năng lượng cao), ôn tập sau
+        blocks = study_blocks + review_blocks
+        if blocks:
+            schedule.append(_layout(day, day_start, blocks))
+    
+    unscheduled = {s.name: s.remaining for s in states if s.remaining > 0}
+    if unscheduled:
+        logger.info(f"Scheduler: not enough time for {unscheduled} (minutes)")
+    if missed:
+        logger.info(f"Scheduler: weekly reviews missed {missed} (weeks)")
+    return ScheduleResult(schedule=schedule, unscheduled_minutes=unscheduled, missed_reviews=missed)
+
+
+def schedule_plan(constraints: PlanConstraints, result: Optional[ScheduleResult] = None) -> StudyPlan:
+    """
+    PlanConstraints → StudyPlan (deadline chưa có milestone được thêm milestone)
+    
+    Raises:
+        ValueError: không có ngày học nào trong khoảng start_date → end_date
+    """
+    result = result or build_schedule(constraints)
+    if not result.schedule:
+        raise ValueError("Cannot schedule plan: no study days between start_date and end_date")
+    
+    milestones = list(constraints.milestones)
+    milestone_dates = {m.date for m in milestones}
+    for name, deadline in sorted(constraints.deadlines.items(), key=lambda item: item[1]):
+        if deadline not in milestone_dates and constraints.start_date <= deadline <= constraints.end_date:
+            milestones.append(Milestone(date=deadline, title=f"Hạn chót: {name}"[:200], description=""))
+    
+    return StudyPlan(
+        title=constraints.title,
+        start_date=constraints.start_date,
+        end_date=constraints.end_date,
+        subjects=constraints.subjects,
+        schedule=result.schedule,
+        milestones=sorted(milestones, key=lambda m: m.date),
+        tips=constraints.tips,
+    )
@@ -0,0 +1,301 @@
+"""
+Near-Duplicate Index
+Tìm input gần giống (sửa typo, đổi thứ tự dòng, thêm một bullet) trong các
+input đã generate gần đây để dùng lại plan thay vì gọi Gemini.
+
+MinHash (one-permutation hashing trên character shingles) + LSH banding,
+chạy hoàn toàn local, không cần embedding service.
+"""
+
+import re
+import logging
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from datetime import date, timedelta
+from typing import Optional, Dict, Any, List, NamedTuple
+
+from django.conf import settings
+
+from .response_cache import normalize_user_input
+
+logger = logging.getLogger(__name__)
+
+# Tên thứ trong tuần (date.weekday(): 0 = Thứ 2)
+VIETNAMESE_WEEKDAYS = ["Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật"]
+
+# Ngày tuyệt đối trong input (ngày thi, deadline): 2026-06-15, 15/6, ngày 15 tháng 6, June 15...
+_ABSOLUTE_DATE = re.compile(
+    r"\b\d{4}-\d{1,2}-\d{1,2}\b"
+    r"|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b"
+    r"|\bngày\s+\d{1,2}\s+tháng\s+\d{1,2}\b"
+    r"|\btháng\s+\d{1,2}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}(?:st|nd|rd|th)?\b"
+    r"|\b\d{1,2}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b",
+    re.IGNORECASE,
+)
+
+# Số lượng trong input (thời lượng, số giờ, số chương...): 2 tuần, 3.5 tiếng, hai tuần
+_NUMBER_WORDS = {
+    "một": 1, "hai": 2, "ba": 3, "bốn": 4, "tư": 4, "năm": 5, "sáu": 6, "bảy": 7,
+    "tám": 8, "chín": 9, "mười": 10, "rưỡi": 0.5,
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "half": 0.5,
+}
+_QUANTITY = re.compile(
+    r"(?<![\w.,])(\d+(?:[.,]\d+)?)"
+    r"|\b(" + "|".join(_NUMBER_WORDS) + r")\s+"
+    r"(?:tuần|ngày|tháng|tiếng|giờ|phút|buổi|chương|bài|môn|đề|trang|"
+    r"weeks?|days?|months?|hours?|minutes?|sessions?|chapters?|lessons?|subjects?|pages?)\b",
+    re.IGNORECASE,
+)
+
+_MASK_32 = 0xFFFFFFFF
+_EMPTY_BIN = _MASK_32 + 1
+
+
+class NearDuplicateMatch(NamedTuple):
+    entry_id: int
+    similarity: float
+    payload: Dict[str, Any]
+
+
+def compute_signature(text: str, num_bins: int = 64, shingle_size: int = 5) -> array:
+    """
+    MinHash signature bằng one-permutation hashing
+    
+    Mỗi shingle chỉ hash một lần: bin = h % num_bins, giá trị = min(h // num_bins).
+    Bin rỗng (input quá ngắn) được lấp bằng bin kế tiếp (densification).
+    """
+    normalized = " ".join(normalize_user_input(text).lower().split())
+    if len(normalized) < shingle_size:
+        normalized = normalized.ljust(shingle_size)
+    
+    mins = [_EMPTY_BIN] * num_bins
+    for shingle in {normalized[i:i + shingle_size] for i in range(len(normalized) - shingle_size + 1)}:
+        h = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        bin_index = h % num_bins
+        value = (h // num_bins) & _MASK_32
+        if value < mins[bin_index]:
+            mins[bin_index] = value
+    
+    # Densification: bin rỗng lấy giá trị của bin không rỗng kế tiếp (vòng tròn)
+    if _EMPTY_BIN in mins:
+        filled = [i for i, v in enumerate(mins) if v != _EMPTY_BIN]
+        for i in range(num_bins):
+            if mins[i] == _EMPTY_BIN:
+                source = next((j for j in filled if j > i), filled[0])
+                mins[i] = (mins[source] + (source - i) % num_bins) & _MASK_32
+    
+    return array("I", mins)
+
+
+def estimate_similarity(a: array, b: array) -> float:
+    """Ước lượng Jaccard similarity từ hai signatures"""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def absolute_dates(text: str) -> List[str]:
+    """Các ngày tuyệt đối được nhắc trong input (đã chuẩn hóa, sorted)"""
+    return sorted({" ".join(match.lower().split()) for match in _ABSOLUTE_DATE.findall(text)})
+
+
+def numeric_quantities(text: str) -> List[str]:
+    """
+    Các số lượng trong input (ngoài ngày tuyệt đối), đã chuẩn hóa và sorted
+    
+    "trong 2 tuần" → "4 tuần" hay "3 tiếng" → "6 tiếng" gần như không đổi
+    similarity nhưng đổi hẳn plan: plan chỉ được dùng lại khi các số này khớp.
+    """
+    quantities = []
+    for digits, word in _QUANTITY.findall(_ABSOLUTE_DATE.sub(" ", text)):
+        value = float(digits.replace(",", ".")) if digits else _NUMBER_WORDS[word.lower()]
+        quantities.append(f"{value:g}")
+    return sorted(quantities)
+
+
+def adapt_plan_dates(plan: Dict[str, Any], days: int) -> Dict[str, Any]:
+    """
+    Dời mọi ngày (YYYY-MM-DD) trong plan đi `days` ngày, cập nhật day_of_week
+    """
+    if not days:
+        return plan
+    
+    def shift(value: str) -> str:
+        try:
+            return (date.fromisoformat(value) + timedelta(days=days)).isoformat()
+        except (TypeError, ValueError):
+            return value
+    
+    adapted = {**plan}
+    for field in ("start_date", "end_date"):
+        if field in adapted:
+            adapted[field] = shift(adapted[field])
+    
+    adapted["schedule"] = []
+    for day in plan.get("schedule", []):
+        new_date = shift(day.get("date", ""))
+        day = {**day, "date": new_date}
+        try:
+            day["day_of_week"] = VIETNAMESE_WEEKDAYS[date.fromisoformat(new_date).weekday()]
+        except ValueError:
+            pass
+        adapted["schedule"].append(day)
+    
+    adapted["milestones"] = [
+        {**milestone, "date": shift(milestone.get("date", ""))}
+        for milestone in plan.get("milestones", [])
+    ]
+    return adapted
+
+
+class NearDuplicateIndex:
+    """
+    LSH index trên MinHash signatures, giới hạn số entries (LRU)
+    
+    - num_bands × rows_per_band = số bins của signature
+    - namespace: tham số request (giờ học, ngày rảnh, prompt versions...) -
+      chỉ so khớp input cùng namespace
+    - lookup có chi phí giới hạn: mỗi bucket giữ tối đa max_bucket_size entries
+      mới nhất, chỉ so signature với max_candidates entries trùng nhiều band nhất
+    
+    Usage:
+        match = near_duplicate_index.lookup(user_input, namespace)
+        if match is None:
+            ...
+            near_duplicate_index.insert(user_input, namespace, payload)
+    """
+    
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        max_entries: int = 10000,
+        num_bands: int = 16,
+        rows_per_band: int = 4,
+        shingle_size: int = 5,
+        max_bucket_size: int = 64,
+        max_candidates: int = 32,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.num_bins = num_bands * rows_per_band
+        self.shingle_size = shingle_size
+        self.max_bucket_size = max_bucket_size
+        self.max_candidates = max_candidates
+        
+        self._lock = threading.Lock()
+        self._next_id = 0
+        # entry_id -> (namespace, signature, payload); thứ tự = LRU
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # bucket hash -> [entry_id, ...]
+        self._buckets: Dict[int, List[int]] = {}
+        self._stats = {
+            "lookups": 0,
+            "matches": 0,
+            "inserts": 0,
+            "evictions": 0,
+            "candidates_checked": 0,
+            "bucket_overflows": 0,
+        }
+    
+    def signature(self, text: str) -> array:
+        return compute_signature(text, self.num_bins, self.shingle_size)
+    
+    def lookup(self, text: str, namespace: str = "") -> Optional[NearDuplicateMatch]:
+        """Entry giống nhất có similarity >= threshold (hoặc None)"""
+        signature = self.signature(text)
+        bucket_keys = self._bucket_keys(signature, namespace)
+        
+        with self._lock:
+            self._stats["lookups"] += 1
+            
+            # Số band trùng ~ similarity: chỉ so kỹ các entries trùng nhiều band nhất
+            band_hits = Counter()
+            for key in bucket_keys:
+                band_hits.update(self._buckets.get(key, ()))
+            candidates = [entry_id for entry_id, _ in band_hits.most_common(self.max_candidates)]
+            
+            best = None
+            for entry_id in candidates:
+                entry_namespace, entry_signature, payload = self._entries[entry_id]
+                if entry_namespace != namespace:
+                    continue
+                similarity = estimate_similarity(signature, entry_signature)
+                if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                    best = NearDuplicateMatch(entry_id, similarity, payload)
+            
+            self._stats["candidates_checked"] += len(candidates)
+            if best is not None:
+                self._entries.move_to_end(best.entry_id)
+                self._stats["matches"] += 1
+            return best
+    
+    def insert(self, text: str, namespace: str, payload: Dict[str, Any]) -> int:
+        signature = self.signature(text)
+        bucket_keys = self._bucket_keys(signature, namespace)
+        
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            
+            self._entries[entry_id] = (namespace, signature, payload)
+            for key in bucket_keys:
+                bucket = self._buckets.setdefault(key, [])
+                bucket.append(entry_id)
+                if len(bucket) > self.max_bucket_size:
+                    # Bucket quá đông (input rất phổ biến): bỏ entry cũ nhất khỏi bucket này
+                    del bucket[0]
+                    self._stats["bucket_overflows"] += 1
+            self._stats["inserts"] += 1
+            
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+        
+        return entry_id
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["lookups"]
+            return {
+                **self._stats,
+                "match_rate": round(self._stats["matches"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "buckets": len(self._buckets),
+                "threshold": self.threshold,
+            }
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _bucket_keys(self, signature: array, namespace: str) -> List[int]:
+        rows = self.rows_per_band
+        return [
+            hash((namespace, band, tuple(signature[band * rows:(band + 1) * rows])))
+            for band in range(self.num_bands)
+        ]
+    
+    def _evict_oldest(self) -> None:
+        entry_id, (namespace, signature, _) = self._entries.popitem(last=False)
+        for key in self._bucket_keys(signature, namespace):
+            bucket = self._buckets.get(key)
+            # Có thể đã bị đẩy khỏi bucket đầy
+            if bucket is None or entry_id not in bucket:
+                continue
+            bucket.remove(entry_id)
+            if not bucket:
+                del self._buckets[key]
+        self._stats["evictions"] += 1
+
+
+# Singleton instance
+near_duplicate_index = NearDuplicateIndex(
+    threshold=settings.NEAR_DUPLICATE_THRESHOLD,
+    max_entries=settings.NEAR_DUPLICATE_MAX_ENTRIES,
+)
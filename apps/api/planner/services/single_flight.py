@@ -0,0 +1,174 @@
+"""
+Single-flight - Gộp các generate request giống nhau đang chạy cùng lúc
+
+Double-click, frontend retry, cả lớp paste cùng một đề cương... → chỉ một
+chain execution (leader) chạy, các request cùng key (followers) đợi và dùng
+chung kết quả.
+
+Leader lỗi do model / output (API error, parse, breaker open) → followers
+nhận chính exception đó (không chạy lại cả loạt). Lỗi chỉ thuộc về request
+của leader - bị hủy (client ngắt kết nối), hết deadline của chính nó
+(StageTimeout) hay hết hạn đợi admission (AdmissionRejected) - → followers
+join lại, một follower thành leader mới với budget của nó. Follower đợi quá
+lâu → tự chạy riêng, không đợi leader nữa.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from core.langchain.admission import AdmissionRejected
+from core.langchain.resilience import StageTimeout, remaining
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderFailed(Exception):
+    """Leader dừng vì lý do của riêng request đó (followers join lại)"""
+    
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"leader {reason}: {detail}" if detail else f"leader {reason}")
+        self.reason = reason  # cancelled | deadline
+
+
+# Lỗi theo deadline / budget của request leader, không phải lỗi của model
+LEADER_ONLY_ERRORS = (StageTimeout, AdmissionRejected)
+
+
+class _Flight:
+    __slots__ = ("future", "followers")
+    
+    def __init__(self):
+        # concurrent.futures.Future: followers ở thread / event loop khác vẫn đợi được
+        self.future: Future = Future()
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Usage:
+        result, shared = await single_flight.run(key, lambda: chain.ainvoke(data))
+        # shared=True: kết quả của request khác đang chạy cùng key
+    """
+    
+    def __init__(self, wait_timeout: float = 120.0):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._stats = {
+            "leaders": 0,
+            "followers": 0,
+            "coalesced": 0,
+            "shared_errors": 0,
+            "rejoined_leader_cancelled": 0,
+            "rejoined_leader_deadline": 0,
+            "detached_timeout": 0,
+            "llm_calls_saved": 0,
+        }
+    
+    async def run(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        count_llm_calls: Optional[Callable[[Any], int]] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Chạy func() hoặc đợi execution đang chạy cùng key
+        
+        Args:
+            key: make_request_key(...) của request
+            func: coroutine factory, chỉ được gọi khi request là leader
+            count_llm_calls: số LLM calls một execution tốn (để đếm calls tiết kiệm được)
+        
+        Returns:
+            (result, shared)
+        
+        Raises:
+            Exception của leader khi leader lỗi do model / output (follower không tự chạy lại)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+            else:
+                flight.followers += 1
+                self._stats["followers"] += 1
+        
+        if leader:
+            return await self._lead(key, flight, func, count_llm_calls), False
+        
+        # Không đợi quá deadline của chính request này
+        left = remaining()
+        wait_timeout = self.wait_timeout if left is None else max(min(self.wait_timeout, left), 0)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(flight.future)), wait_timeout
+            )
+            return result, True
+        except LeaderFailed as e:
+            # Leader bị hủy / hết deadline của nó: join lại, chỉ một request thành leader mới
+            with self._lock:
+                self._stats[f"rejoined_leader_{e.reason}"] += 1
+            logger.info(f"Single-flight: {e}, follower rejoining")
+            return await self.run(key, func, count_llm_calls)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["detached_timeout"] += 1
+                flight.followers -= 1
+            logger.warning(f"Single-flight: follower waited {wait_timeout:.1f}s, running on its own")
+        
+        return await func(), False
+    
+    async def _lead(self, key, flight, func, count_llm_calls):
+        try:
+            result = await func()
+        except LEADER_ONLY_ERRORS as e:
+            self._finish(key, flight)
+            flight.future.set_exception(LeaderFailed("deadline", str(e) or type(e).__name__))
+            raise
+        except Exception as e:
+            followers = self._finish(key, flight)
+            if followers:
+                with self._lock:
+                    self._stats["shared_errors"] += followers
+            flight.future.set_exception(e)
+            raise
+        except BaseException as e:
+            # CancelledError (client ngắt kết nối): lỗi không phải của request → followers join lại
+            self._finish(key, flight)
+            flight.future.set_exception(LeaderFailed("cancelled", str(e) or type(e).__name__))
+            raise
+        
+        followers = self._finish(key, flight)
+        if followers:
+            calls = count_llm_calls(result) if count_llm_calls else 0
+            with self._lock:
+                self._stats["coalesced"] += followers
+                self._stats["llm_calls_saved"] += calls * followers
+            logger.info(f"Single-flight: result shared with {followers} follower(s)")
+        flight.future.set_result(result)
+        return result
+    
+    def _finish(self, key: str, flight: _Flight) -> int:
+        """Gỡ flight khỏi map (request mới sẽ chạy execution mới); trả về số followers"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight.followers
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": len(self._flights),
+            }
+
+
+# Singleton instance
+single_flight = SingleFlight(wait_timeout=settings.SINGLE_FLIGHT_WAIT_SECONDS)
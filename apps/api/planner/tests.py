@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import json
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from pydantic import ValidationError
+from langchain_core.runnables import RunnableLambda
+
+from core.langchain.admission import AdmissionController, AdmissionRejected
+from core.langchain.chunked import ChunkedPlanner, merge_weeks, week_windows
+from core.langchain.cassette import LatencySampler, parse_latency_spec
+from core.langchain.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpen,
+    atrack_stream,
+    circuit_breakers,
+    slow_call_seconds,
+    track_stream,
+)
+from core.langchain.regenerate import compact_plan, refiner_inputs
+from core.langchain.resilience import StageTimeout, remaining
+from core.metrics import ADMISSION_SHED, ADMISSION_WAIT, MetricsRegistry, registry
+
+from planner.apps import _component_gauges
+from planner.guards.json_stream import IncrementalJSONParser, StreamValidationError
+from planner.guards.output_guard import (
+    DailySchedule,
+    OutputGuard,
+    PlanConstraints,
+    PlanOutline,
+    StudyPlan,
+    StudySession,
+    WeekSchedule,
+    format_loc,
+    repair_targets,
+    study_plan_guard,
+)
+from planner.services.job_queue import JobQueue
+from planner.services.scheduler import MAX_STUDY_MINUTES, build_schedule, schedule_plan
+from planner.services.response_cache import ResponseCache, make_request_key
+from planner.services.similarity_index import (
+    NearDuplicateIndex,
+    absolute_dates,
+    near_duplicate_index,
+    numeric_quantities,
+)
+from planner.services.single_flight import SingleFlight
+from planner.views import GenerateBatchView, GeneratePlanView
+from planner.workers import JobWorkerPool
+
+
+SCHEDULE_DAY = ("schedule", "*")
+
+PLAN = {
+    "title": "Ôn thi cuối kỳ",
+    "start_date": "2026-10-19",
+    "end_date": "2026-10-20",
+    "subjects": [{"name": "Toán", "priority": "high", "total_hours": 2, "color": "#3366FF"}],
+    "schedule": [
+        {
+            "date": day,
+            "day_of_week": weekday,
+            "sessions": [
+                {"start_time": "08:00", "end_time": "08:50", "subject": "Toán", "task": "Học chương 1", "type": "study"},
+            ],
+        }
+        for day, weekday in (("2026-10-19", "Thứ Hai"), ("2026-10-20", "Thứ Ba"))
+    ],
+}
+
+
+def feed_in_chunks(parser, text, size=7):
+    items = []
+    for i in range(0, len(text), size):
+        items += parser.feed(text[i:i + size])
+    return items
+
+
+def guard_feed_in_chunks(parser, text, size=7):
+    items = []
+    for i in range(0, len(text), size):
+        items += study_plan_guard.feed(parser, text[i:i + size])
+    return items
+
+
+# ============================================
+# Incremental JSON parser
+# ============================================
+
+class IncrementalJSONParserTests(SimpleTestCase):
+    def parser(self):
+        return IncrementalJSONParser({SCHEDULE_DAY: DailySchedule})
+    
+    def test_items_validated_while_streaming(self):
+        parser = self.parser()
+        text = json.dumps(PLAN, ensure_ascii=False)
+        items = feed_in_chunks(parser, text)
+        
+        self.assertEqual([item.index for item in items], [0, 1])
+        self.assertEqual(items[1].value.date, "2026-10-20")
+        self.assertEqual(parser.close(), PLAN)
+    
+    def test_fence_and_preamble_are_skipped(self):
+        parser = self.parser()
+        text = "Đây là kế hoạch:\n```json\n" + json.dumps(PLAN, ensure_ascii=False) + "\n```"
+        feed_in_chunks(parser, text)
+        
+        self.assertEqual(parser.close(), PLAN)
+    
+    def test_brace_in_prose_is_not_the_root(self):
+        parser = self.parser()
+        text = "Kế hoạch {tuần 1} của bạn:\n" + json.dumps(PLAN, ensure_ascii=False)
+        items = feed_in_chunks(parser, text)
+        
+        self.assertEqual(len(items), 2)
+        self.assertEqual(parser.close(), PLAN)
+    
+    def test_syntax_error_aborts_immediately(self):
+        parser = self.parser()
+        with self.assertRaises(StreamValidationError):
+            feed_in_chunks(parser, '{"title": "x", "schedule": [oops')
+    
+    def test_invalid_item_aborts_without_repair_budget(self):
+        parser = self.parser()
+        day = {"date": "20/10/2026", "day_of_week": "Thứ Ba", "sessions": []}
+        with self.assertRaises(StreamValidationError):
+            feed_in_chunks(parser, json.dumps({"schedule": [day]}))
+    
+    def test_truncated_stream_fails_on_close(self):
+        parser = self.parser()
+        feed_in_chunks(parser, json.dumps(PLAN)[:-20])
+        with self.assertRaises(StreamValidationError):
+            parser.close()
+    
+    def test_guard_falls_back_to_parse_on_full_text(self):
+        parser = study_plan_guard.stream_parser()
+        text = 'Ví dụ: {"ghi chú": "x"\n```json\n' + json.dumps(PLAN, ensure_ascii=False) + "\n```"
+        guard_feed_in_chunks(parser, text)
+        
+        plan = study_plan_guard.finish(parser)
+        self.assertEqual(plan.title, PLAN["title"])
+    
+    def test_guard_aborts_after_items_were_validated(self):
+        parser = study_plan_guard.stream_parser()
+        text = json.dumps(PLAN, ensure_ascii=False)
+        broken = text[:text.index('{"date": "2026-10-20"')] + '{"date": oops'
+        with self.assertRaises(ValueError):
+            guard_feed_in_chunks(parser, broken)
+
+
+# ============================================
+# Job queue
+# ============================================
+
+class JobQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+    
+    def queue(self, **kwargs):
+        options = {"max_attempts": 3, "retry_base_seconds": 0.0, "retry_max_seconds": 0.0, **kwargs}
+        return JobQueue(str(Path(self.tmp.name) / "jobs.sqlite3"), **options)
+    
+    def test_claim_highest_priority_first(self):
+        queue = self.queue()
+        queue.enqueue({"n": 1}, priority=0)
+        high = queue.enqueue({"n": 2}, priority=5)
+        
+        job = queue.claim("w1")
+        self.assertEqual(job["id"], high["id"])
+        self.assertEqual(job["status"], "running")
+        self.assertEqual(job["attempts"], 1)
+    
+    def test_claim_empty_queue(self):
+        self.assertIsNone(self.queue().claim("w1"))
+    
+    def test_complete(self):
+        queue = self.queue()
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        self.assertTrue(queue.complete(job["id"], "w1", {"ok": True}))
+        done = queue.get(job["id"])
+        self.assertEqual(done["status"], "succeeded")
+        self.assertEqual(done["result"], {"ok": True})
+    
+    def test_retryable_failure_is_requeued(self):
+        queue = self.queue()
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        self.assertEqual(queue.fail(job["id"], "w1", "timeout"), "queued")
+        retry = queue.claim("w2")
+        self.assertEqual(retry["id"], job["id"])
+        self.assertEqual(retry["attempts"], 2)
+        self.assertEqual(retry["error"], "timeout")
+    
+    def test_retry_waits_for_backoff(self):
+        queue = self.queue(retry_base_seconds=60.0, retry_max_seconds=60.0)
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        queue.fail(job["id"], "w1", "timeout")
+        self.assertIsNone(queue.claim("w1"))
+        self.assertGreaterEqual(queue.get(job["id"])["available_at"], time.time() + 29)
+    
+    def test_dead_letter_after_max_attempts(self):
+        queue = self.queue(max_attempts=2)
+        queue.enqueue({"n": 1})
+        
+        statuses = []
+        for _ in range(2):
+            job = queue.claim("w1")
+            statuses.append(queue.fail(job["id"], "w1", "boom"))
+        
+        self.assertEqual(statuses, ["queued", "dead"])
+        self.assertIsNone(queue.claim("w1"))
+        self.assertEqual(queue.stats()["by_status"]["dead"], 1)
+    
+    def test_non_retryable_failure_is_dead_lettered(self):
+        queue = self.queue()
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        self.assertEqual(queue.fail(job["id"], "w1", "invalid input", retryable=False), "dead")
+    
+    def test_expired_lease_is_reclaimed(self):
+        queue = self.queue(visibility_timeout=0.0)
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        reclaimed = queue.claim("w2")
+        self.assertEqual(reclaimed["id"], job["id"])
+        self.assertEqual(reclaimed["worker_id"], "w2")
+        # Worker cũ đã mất lease: kết quả / lỗi của nó bị bỏ
+        self.assertFalse(queue.complete(job["id"], "w1", {"ok": True}))
+        self.assertIsNone(queue.fail(job["id"], "w1", "late"))
+        self.assertEqual(queue.stats()["reclaimed"], 1)
+    
+    def test_expired_lease_on_last_attempt_is_dead_lettered(self):
+        queue = self.queue(max_attempts=1, visibility_timeout=0.0)
+        queue.enqueue({"n": 1})
+        job = queue.claim("w1")
+        
+        self.assertIsNone(queue.claim("w2"))
+        self.assertEqual(queue.get(job["id"])["status"], "dead")
+
+class JobWorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.queue = JobQueue(str(Path(self.tmp.name) / "jobs.sqlite3"), retry_base_seconds=0.0, retry_max_seconds=0.0)
+        chain = mock.Mock()
+        chain.ainvoke = mock.AsyncMock(return_value={"plan": PLAN, "html": "<html></html>", "model_used": "flash"})
+        for target, value in (
+            ("planner.workers.job_queue", self.queue),
+            ("planner.workers.create_safe_generation_chain", mock.Mock(return_value=chain)),
+            ("planner.workers.study_plan_repo.save", mock.AsyncMock()),
+            ("planner.workers.QUEUE_WRITE_ATTEMPTS", 3),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.chain = chain
+    
+    async def run_pool(self, seconds=0.3):
+        pool = JobWorkerPool(workers=2, poll_interval=0.01)
+        task = asyncio.create_task(pool.run_forever())
+        await asyncio.sleep(seconds)
+        self.assertFalse(task.done(), "worker pool stopped")
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+    
+    async def test_jobs_succeed(self):
+        job = self.queue.enqueue({"user_input": "x"})
+        await self.run_pool()
+        
+        self.assertEqual(self.queue.get(job["id"])["status"], "succeeded")
+    
+    async def test_complete_is_retried_on_database_errors(self):
+        job = self.queue.enqueue({"user_input": "x"})
+        complete = self.queue.complete
+        calls = []
+        
+        def flaky_complete(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return complete(*args)
+        
+        with mock.patch.object(self.queue, "complete", flaky_complete):
+            await self.run_pool(1.0)
+        
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.chain.ainvoke.await_count, 1)
+        self.assertEqual(self.queue.get(job["id"])["status"], "succeeded")
+    
+    async def test_pool_survives_queue_errors(self):
+        for i in range(2):
+            self.queue.enqueue({"user_input": str(i)})
+        
+        def locked(*args):
+            raise sqlite3.OperationalError("database is locked")
+        
+        with mock.patch.object(self.queue, "complete", locked):
+            await self.run_pool(2.0)  # run_pool kiểm tra pool vẫn chạy sau khi hết lượt retry
+        
+        self.assertEqual(self.chain.ainvoke.await_count, 2)
+        
+        # Worker vẫn nhận job mới
+        job = self.queue.enqueue({"user_input": "next"})
+        await self.run_pool()
+        self.assertEqual(self.queue.get(job["id"])["status"], "succeeded")
+    
+    async def test_chain_error_is_retried_then_dead_lettered(self):
+        self.chain.ainvoke.side_effect = RuntimeError("503 overloaded")
+        job = self.queue.enqueue({"user_input": "x"}, max_attempts=2)
+        await self.run_pool()
+        
+        self.assertEqual(self.chain.ainvoke.await_count, 2)
+        self.assertEqual(self.queue.get(job["id"])["status"], "dead")
+
+
+
+# ============================================
+# Near-duplicate index
+# ============================================
+
+SYLLABUS = (
+    "Mình cần ôn thi cuối kỳ môn Giải tích 1 trong 2 tuần, mỗi ngày học 3 tiếng.\n"
+    "- Chương 1: Giới hạn và liên tục\n"
+    "- Chương 2: Đạo hàm và vi phân\n"
+    "- Chương 3: Tích phân xác định và ứng dụng\n"
+    "Ưu tiên làm bài tập, cuối mỗi tuần làm một đề thi thử."
+)
+
+
+class NearDuplicateIndexTests(SimpleTestCase):
+    def test_lookup_finds_light_edits(self):
+        index = NearDuplicateIndex(threshold=0.8)
+        entry_id = index.insert(SYLLABUS, "ns", {"id": "a"})
+        
+        match = index.lookup(SYLLABUS.replace("Ưu tiên", "Uu tiên") + "\n", "ns")
+        self.assertIsNotNone(match)
+        self.assertEqual((match.entry_id, match.payload["id"]), (entry_id, "a"))
+        self.assertGreaterEqual(match.similarity, 0.8)
+    
+    def test_namespaces_are_separate(self):
+        index = NearDuplicateIndex(threshold=0.8)
+        index.insert(SYLLABUS, "3h", {"id": "a"})
+        
+        self.assertIsNone(index.lookup(SYLLABUS, "6h"))
+    
+    def test_unrelated_input_does_not_match(self):
+        index = NearDuplicateIndex(threshold=0.8)
+        index.insert(SYLLABUS, "", {"id": "a"})
+        
+        self.assertIsNone(index.lookup("Lập kế hoạch học tiếng Anh giao tiếp cho người mới bắt đầu", ""))
+    
+    def test_oldest_entries_are_evicted(self):
+        index = NearDuplicateIndex(threshold=0.8, max_entries=2)
+        for i in range(3):
+            index.insert(f"{SYLLABUS}\nGhi chú riêng số {i} " + "x" * i * 40, "", {"id": i})
+        
+        self.assertEqual(len(index), 2)
+        remaining = {index.lookup(f"{SYLLABUS}\nGhi chú riêng số {i} " + "x" * i * 40, "").payload["id"] for i in range(3)}
+        self.assertNotIn(0, remaining)
+    
+    def test_absolute_dates(self):
+        self.assertEqual(
+            absolute_dates("Thi Toán ngày 15/6, Lý 2026-06-20, mỗi ngày 3 tiếng"),
+            ["15/6", "2026-06-20"],
+        )
+    
+    def test_numeric_quantities(self):
+        self.assertEqual(numeric_quantities("trong 2 tuần, mỗi ngày 3,5 tiếng, thi 15/6"), ["2", "3.5"])
+        self.assertEqual(numeric_quantities("trong hai tuần"), numeric_quantities("trong 2 tuần"))
+        self.assertNotEqual(numeric_quantities(SYLLABUS), numeric_quantities(SYLLABUS.replace("2 tuần", "4 tuần")))
+
+
+class NearDuplicateReuseTests(SimpleTestCase):
+    def setUp(self):
+        near_duplicate_index.clear()
+        self.addCleanup(near_duplicate_index.clear)
+        near_duplicate_index.insert(SYLLABUS, "tests", {
+            "generated_on": timezone.localdate().isoformat(),
+            "response": {"plan": PLAN, "html": "<html></html>"},
+            "dates": absolute_dates(SYLLABUS),
+            "quantities": numeric_quantities(SYLLABUS),
+        })
+    
+    def reuse(self, text):
+        return GeneratePlanView._reuse_near_duplicate(text, "tests", "template")
+    
+    def test_reuses_light_edit(self):
+        reused = self.reuse(SYLLABUS.replace("Ưu tiên", "Uu tiên"))
+        
+        self.assertIsNotNone(reused)
+        self.assertEqual(reused["plan"], PLAN)
+    
+    def test_number_edits_are_not_reused(self):
+        for old, new in (("2 tuần", "4 tuần"), ("3 tiếng", "6 tiếng"), ("2 tuần", "hai tuần kèm 1 ngày")):
+            with self.subTest(new=new):
+                self.assertIsNone(self.reuse(SYLLABUS.replace(old, new)))
+    
+    def test_added_exam_date_is_not_reused(self):
+        self.assertIsNone(self.reuse(SYLLABUS + "\nThi ngày 20/6."))
+
+
+# ============================================
+# Single-flight
+# ============================================
+
+class SingleFlightTests(SimpleTestCase):
+    async def test_concurrent_requests_share_one_execution(self):
+        flight = SingleFlight(wait_timeout=5)
+        calls = 0
+        
+        async def func():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"plan": calls}
+        
+        results = await asyncio.gather(*(flight.run("k", func, lambda result: 2) for _ in range(5)))
+        
+        self.assertEqual(calls, 1)
+        self.assertEqual([shared for _, shared in results].count(True), 4)
+        self.assertTrue(all(result == {"plan": 1} for result, _ in results))
+        stats = flight.stats()
+        self.assertEqual((stats["coalesced"], stats["llm_calls_saved"], stats["in_flight"]), (4, 8, 0))
+    
+    async def test_different_keys_run_separately(self):
+        flight = SingleFlight(wait_timeout=5)
+        
+        async def func():
+            await asyncio.sleep(0.01)
+            return "ok"
+        
+        results = await asyncio.gather(flight.run("a", func), flight.run("b", func))
+        self.assertEqual(results, [("ok", False), ("ok", False)])
+    
+    async def test_leader_error_is_shared(self):
+        flight = SingleFlight(wait_timeout=5)
+        calls = 0
+        
+        async def func():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            raise ValueError("boom")
+        
+        results = await asyncio.gather(*(flight.run("k", func) for _ in range(3)), return_exceptions=True)
+        
+        self.assertEqual(calls, 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(flight.stats()["shared_errors"], 2)
+    
+    async def test_follower_rejoins_when_leader_is_cancelled(self):
+        flight = SingleFlight(wait_timeout=5)
+        calls = 0
+        
+        async def func():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+        
+        leader = asyncio.create_task(flight.run("k", func))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.run("k", func))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        
+        self.assertEqual(await follower, (2, False))
+        self.assertEqual(flight.stats()["rejoined_leader_cancelled"], 1)
+    
+    async def test_follower_stops_waiting_after_timeout(self):
+        flight = SingleFlight(wait_timeout=0.02)
+        
+        async def slow():
+            await asyncio.sleep(0.2)
+            return "leader"
+        
+        async def fast():
+            return "own"
+        
+        leader = asyncio.create_task(flight.run("k", slow))
+        await asyncio.sleep(0.01)
+        
+        self.assertEqual(await flight.run("k", fast), ("own", False))
+        self.assertEqual(flight.stats()["detached_timeout"], 1)
+        await leader
+    
+    async def test_leader_deadline_errors_are_not_shared(self):
+        for error in (StageTimeout("planner_pro", 150), AdmissionRejected("pro", 503, 5, "wait deadline exceeded")):
+            with self.subTest(error=type(error).__name__):
+                flight = SingleFlight(wait_timeout=5)
+                calls = 0
+                
+                async def func():
+                    nonlocal calls
+                    calls += 1
+                    await asyncio.sleep(0.05)
+                    if calls == 1:
+                        raise error
+                    return calls
+                
+                leader = asyncio.create_task(flight.run("k", func))
+                await asyncio.sleep(0.01)
+                follower = asyncio.create_task(flight.run("k", func))
+                
+                with self.assertRaises(type(error)):
+                    await leader
+                self.assertEqual(await follower, (2, False))
+                stats = flight.stats()
+                self.assertEqual((stats["rejoined_leader_deadline"], stats["shared_errors"]), (1, 0))
+
+
+# ============================================
+# Circuit breaker
+# ============================================
+
+class CircuitBreakerTests(SimpleTestCase):
+    def make_breaker(self, **kwargs):
+        options = {"window": 4, "min_calls": 4, "failure_rate": 0.5, "slow_call_seconds": 10, "open_seconds": 0.05}
+        return CircuitBreaker("test", **{**options, **kwargs})
+    
+    def open_breaker(self, breaker):
+        for _ in range(4):
+            breaker.record(TimeoutError(), 0.1)
+        self.assertEqual(breaker.state, "open")
+    
+    def test_opens_at_failure_rate_and_rejects_calls(self):
+        breaker = self.make_breaker()
+        for error in (None, None, TimeoutError(), None):
+            breaker.record(error, 0.1)
+        self.assertEqual(breaker.state, "closed")
+        
+        breaker.record(TimeoutError(), 0.1)
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        self.assertEqual(breaker.stats()["rejected"], 1)
+    
+    def test_output_errors_do_not_count(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            breaker.record(ValueError("invalid JSON"), 0.1)
+        self.assertEqual(breaker.state, "closed")
+    
+    def test_slow_calls_count_as_failures(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            breaker.record(None, 10)
+        self.assertEqual(breaker.state, "open")
+        self.assertEqual(breaker.stats()["slow_calls"], 4)
+    
+    def test_fast_cancel_is_not_recorded(self):
+        breaker = self.make_breaker()
+        for _ in range(4):
+            breaker.record(asyncio.CancelledError(), 0.1)
+        self.assertEqual((breaker.state, breaker.stats()["calls"]), ("closed", 0))
+    
+    def test_half_open_allows_one_probe(self):
+        for error, state in ((None, "closed"), (TimeoutError(), "open")):
+            with self.subTest(state=state):
+                breaker = self.make_breaker()
+                self.open_breaker(breaker)
+                time.sleep(0.06)
+                
+                self.assertEqual(breaker.state, "half_open")
+                breaker.before_call()
+                with self.assertRaises(CircuitOpen):
+                    breaker.before_call()
+                breaker.record(error, 0.1)
+                self.assertEqual(breaker.state, state)
+    
+    @override_settings(CIRCUIT_BREAKER_SLOW_CALL_RATIO=0.5)
+    def test_slow_threshold_follows_stage_timeout(self):
+        with override_settings(STAGE_TIMEOUTS={"planner_pro": 150, "planner_flash": 60, "router": 15}):
+            self.assertEqual(slow_call_seconds("gemini-2.5-pro"), 75)
+            self.assertEqual(slow_call_seconds("gemini-2.5-flash"), 30)
+            self.assertEqual(slow_call_seconds("other"), 75)
+    
+    def test_track_stream_times_only_the_stream(self):
+        breaker = circuit_breakers.get("test-track-stream")
+        breaker.slow_call_seconds = 0.05
+        
+        # Repair sau khi stream xong không làm call thành chậm
+        for _ in track_stream(iter(["{", "}"]), "test-track-stream"):
+            pass
+        time.sleep(0.06)
+        self.assertEqual((breaker.stats()["calls"], breaker.stats()["slow_calls"]), (1, 0))
+        
+        # Parse lỗi → consumer close() stream: không tính
+        stream = track_stream(iter(["{", "}"]), "test-track-stream")
+        next(stream)
+        stream.close()
+        self.assertEqual(breaker.stats()["calls"], 1)
+        
+        def failing():
+            yield "{"
+            raise TimeoutError()
+        
+        with self.assertRaises(TimeoutError):
+            list(track_stream(failing(), "test-track-stream"))
+        self.assertEqual((breaker.stats()["calls"], breaker.stats()["failures"]), (2, 1))
+    
+    async def test_atrack_stream_closes_llm_stream(self):
+        closed = []
+        
+        async def chunks():
+            try:
+                yield "{"
+                yield "}"
+            finally:
+                closed.append(True)
+        
+        stream = atrack_stream(chunks(), "test-atrack-stream")
+        await stream.__anext__()
+        await stream.aclose()
+        
+        self.assertEqual(closed, [True])
+        self.assertEqual(circuit_breakers.get("test-atrack-stream").stats()["calls"], 0)
+
+
+# ============================================
+# Metrics
+# ============================================
+
+class MetricsRegistryTests(SimpleTestCase):
+    def test_shards_of_finished_threads_are_folded(self):
+        registry = MetricsRegistry()
+        requests = registry.counter("test_requests_total", "Requests", ["kind"])
+        latency = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1))
+        
+        def handle():
+            requests.inc(kind="a")
+            latency.observe(0.5)
+        
+        for _ in range(50):
+            thread = threading.Thread(target=handle)
+            thread.start()
+            thread.join()
+        requests.inc(kind="a")
+        
+        values = registry.snapshot()
+        self.assertEqual(values[("test_requests_total", ("a",))], 51)
+        self.assertEqual(values[("test_latency_seconds", ())], [0, 50, 0, 25.0])
+        self.assertEqual(len(registry._shards), 1)
+        # Gộp lại không làm đếm hai lần
+        self.assertEqual(registry.snapshot(), values)
+
+
+# ============================================
+# Response cache
+# ============================================
+
+class ResponseCacheKeyTests(SimpleTestCase):
+    def test_whitespace_and_unicode_form_share_a_key(self):
+        base = make_request_key("Ôn thi Toán\n\n\n\nmỗi ngày 3 tiếng", "3-4", "Tất cả các ngày")
+        # "Ô" dạng tổ hợp (O + U+0302), khoảng trắng và dòng trống thừa
+        variant = make_request_key("  O\u0302n  thi Toán \n\nmỗi ngày   3 tiếng ", "3-4", "Tất cả các ngày")
+        self.assertEqual(base, variant)
+    
+    def test_parameters_change_the_key(self):
+        base = make_request_key("Ôn thi Toán", "3-4", "Tất cả các ngày")
+        self.assertNotEqual(base, make_request_key("Ôn thi Toán", "1-2", "Tất cả các ngày"))
+        self.assertNotEqual(base, make_request_key("Ôn thi Toán", "3-4", "Tất cả các ngày", render_mode="llm"))
+        with override_settings(LLM_STRUCTURED_OUTPUT=True):
+            self.assertNotEqual(base, make_request_key("Ôn thi Toán", "3-4", "Tất cả các ngày"))
+    
+    def test_prompt_revision_changes_the_key(self):
+        base = make_request_key("Ôn thi Toán", "3-4", "Tất cả các ngày")
+        with mock.patch(
+            "planner.services.response_cache.PromptManager.get_resolved_version", return_value="latest@abc123"
+        ):
+            self.assertNotEqual(base, make_request_key("Ôn thi Toán", "3-4", "Tất cả các ngày"))
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def value(self, size):
+        return {"plan": "x" * size}
+    
+    def test_evicts_least_recently_used_past_max_bytes(self):
+        cache = ResponseCache(max_bytes=300, ttl_seconds=60)
+        for key in ("a", "b"):
+            cache.set(key, self.value(100))
+        cache.get("a")
+        cache.set("c", self.value(100))
+        
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        stats = cache.stats()
+        self.assertEqual((stats["evictions"], stats["entries"]), (1, 2))
+        self.assertLessEqual(stats["bytes_used"], 300)
+    
+    def test_oversized_value_is_not_stored(self):
+        cache = ResponseCache(max_bytes=100, ttl_seconds=60)
+        cache.set("a", self.value(200))
+        self.assertEqual((cache.get("a"), cache.stats()["bytes_used"]), (None, 0))
+    
+    def test_expired_entries_miss(self):
+        cache = ResponseCache(max_bytes=1000, ttl_seconds=0.01)
+        cache.set("a", self.value(10))
+        time.sleep(0.02)
+        
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["expired"], stats["misses"], stats["entries"]), (1, 1, 0))
+    
+    def test_disk_tier_is_promoted_to_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(max_bytes=1000, ttl_seconds=60, disk_path=str(Path(tmp) / "cache.sqlite3"))
+            cache.set("a", self.value(10))
+            cache._entries.clear()
+            cache._bytes_used = 0
+            
+            self.assertEqual(cache.get("a"), self.value(10))
+            self.assertEqual(cache.get("a"), self.value(10))
+            stats = cache.stats()
+            self.assertEqual((stats["disk_hits"], stats["hits"]), (1, 1))
+    
+    def test_metrics_gauges(self):
+        names = [name for name, _, _ in _component_gauges()]
+        for name in ("planner_response_cache_hits", "planner_response_cache_misses", "planner_response_cache_bytes"):
+            self.assertIn(name, names)
+
+
+# ============================================
+# Admission control
+# ============================================
+
+class AdmissionControllerTests(SimpleTestCase):
+    def controller(self, limit=1, max_queue=1, max_wait_seconds=1.0):
+        return AdmissionController({"flash": limit, "pro": limit}, max_queue, max_wait_seconds)
+    
+    async def test_queue_full_is_rejected_with_429(self):
+        controller = self.controller(max_queue=0)
+        await controller.acquire_async("flash")
+        
+        with self.assertRaises(AdmissionRejected) as ctx:
+            await controller.acquire_async("flash")
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(controller.stats()["flash"]["shed_queue_full"], 1)
+    
+    async def test_wait_past_deadline_is_rejected_with_503(self):
+        controller = self.controller(max_wait_seconds=0.05)
+        await controller.acquire_async("flash")
+        
+        with self.assertRaises(AdmissionRejected) as ctx:
+            await controller.acquire_async("flash")
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(controller.stats()["flash"]["queue_depth"], 0)
+    
+    async def test_release_admits_next_waiter(self):
+        controller = self.controller()
+        order = []
+        
+        async def worker(name):
+            async with controller.aslot("flash"):
+                order.append(name)
+                await asyncio.sleep(0.01)
+        
+        await asyncio.gather(worker("a"), worker("b"))
+        self.assertEqual(order, ["a", "b"])
+        stats = controller.stats()["flash"]
+        self.assertEqual((stats["admitted"], stats["queued"], stats["in_flight"]), (2, 1, 0))
+    
+    async def test_lanes_are_independent(self):
+        controller = self.controller(max_queue=0)
+        await controller.acquire_async("flash")
+        await controller.acquire_async("pro")
+        
+        self.assertEqual(controller.stats()["pro"]["in_flight"], 1)
+    
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        controller = self.controller()
+        await controller.acquire_async("flash")
+        waiter = asyncio.create_task(controller.acquire_async("flash"))
+        await asyncio.sleep(0.01)
+        
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(controller.stats()["flash"]["queue_depth"], 0)
+        controller.release("flash")
+        self.assertEqual(controller.stats()["flash"]["in_flight"], 0)
+    
+    def test_sync_slot(self):
+        controller = self.controller()
+        with controller.slot("pro"):
+            self.assertEqual(controller.stats()["pro"]["in_flight"], 1)
+        self.assertEqual(controller.stats()["pro"]["in_flight"], 0)
+    
+    def test_precheck_rejects_when_every_lane_is_full(self):
+        controller = self.controller(max_queue=0)
+        controller.acquire("flash")
+        controller.precheck()  # pro còn chỗ
+        controller.acquire("pro")
+        
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.precheck()
+        self.assertEqual(ctx.exception.status_code, 429)
+    
+    async def test_shed_and_wait_metrics(self):
+        def sample(metric, **labels):
+            return registry.snapshot().get(metric._key(labels))
+        
+        controller = self.controller(max_queue=0)
+        shed_before = sample(ADMISSION_SHED, lane="flash", reason="queue_full") or 0
+        await controller.acquire_async("flash")
+        with self.assertRaises(AdmissionRejected):
+            await controller.acquire_async("flash")
+        self.assertEqual(sample(ADMISSION_SHED, lane="flash", reason="queue_full"), shed_before + 1)
+        
+        controller = self.controller()
+        waits_before = sum((sample(ADMISSION_WAIT, lane="pro") or [0])[:-1])
+        await controller.acquire_async("pro")
+        waiter = asyncio.create_task(controller.acquire_async("pro"))
+        await asyncio.sleep(0.01)
+        controller.release("pro")
+        await waiter
+        self.assertEqual(sum(sample(ADMISSION_WAIT, lane="pro")[:-1]), waits_before + 1)
+
+
+# ============================================
+# Batch
+# ============================================
+
+class GenerateBatchTests(SimpleTestCase):
+    async def run_batch(self, items, chain, budget=None):
+        with override_settings(RESPONSE_CACHE_ENABLED=False), mock.patch("planner.views.chain_registry") as registry:
+            registry.get.return_value = chain
+            return [json.loads(line) async for line in GenerateBatchView._stream(items, 2, budget)]
+    
+    async def test_item_deadline_is_reported_as_deadline_exceeded(self):
+        budgets = []
+        
+        async def generate(data):
+            budgets.append(remaining())
+            if "Vật lý" in data["user_input"]:
+                raise StageTimeout("planner_flash", 60)
+            return {"plan": PLAN, "html": "<p></p>", "model_used": "gemini-2.5-flash"}
+        
+        lines = await self.run_batch(
+            [
+                {"id": "math", "input": "Lập kế hoạch ôn thi Toán trong 2 tuần"},
+                {"id": "physics", "input": "Lập kế hoạch ôn thi Vật lý trong 2 tuần"},
+            ],
+            RunnableLambda(generate),
+            budget=30,
+        )
+        
+        items = {line["id"]: line for line in lines if line["type"] == "item"}
+        self.assertTrue(items["math"]["success"])
+        self.assertEqual(
+            (items["physics"]["code"], items["physics"]["stage"]), ("DEADLINE_EXCEEDED", "planner_flash")
+        )
+        self.assertEqual(lines[-1]["failed"], 1)
+        # Mỗi item có deadline riêng theo budget
+        self.assertEqual(len(budgets), 2)
+        self.assertTrue(all(0 < budget <= 30 for budget in budgets))
+
+
+# ============================================
+# Local scheduler
+# ============================================
+
+class BuildScheduleTests(SimpleTestCase):
+    def constraints(self, **kwargs):
+        data = {
+            "title": "Ôn thi",
+            "start_date": "2026-10-19",  # Thứ Hai
+            "end_date": "2026-11-01",
+            "subjects": [
+                {"name": "Toán", "priority": "high", "total_hours": 10, "color": "#3366FF"},
+                {"name": "Văn", "priority": "low", "total_hours": 6, "color": "#FF6633"},
+            ],
+            "daily_hours": 3,
+            **kwargs,
+        }
+        return PlanConstraints.model_validate(data)
+    
+    @staticmethod
+    def study_minutes(day: DailySchedule) -> int:
+        return sum(_minutes(s) for s in day.sessions if s.type != "break")
+    
+    def test_schedules_all_hours_when_there_is_time(self):
+        result = build_schedule(self.constraints())
+        
+        self.assertEqual(result.unscheduled_minutes, {})
+        minutes = {}
+        for day in result.schedule:
+            for session in day.sessions:
+                if session.type != "break":
+                    minutes[session.subject] = minutes.get(session.subject, 0) + _minutes(session)
+        self.assertEqual(minutes, {"Toán": 600, "Văn": 360})
+    
+    def test_respects_daily_budget(self):
+        result = build_schedule(self.constraints(daily_hours=8))
+        
+        for day in result.schedule:
+            self.assertLessEqual(self.study_minutes(day), MAX_STUDY_MINUTES)
+        for day in build_schedule(self.constraints(daily_hours=1)).schedule:
+            self.assertLessEqual(self.study_minutes(day), 60)
+    
+    def test_only_available_weekdays(self):
+        result = build_schedule(self.constraints(study_days=[5, 6]))
+        
+        self.assertTrue(result.schedule)
+        for day in result.schedule:
+            self.assertIn(date.fromisoformat(day.date).weekday(), (5, 6))
+    
+    def test_nothing_after_subject_deadline(self):
+        result = build_schedule(self.constraints(deadlines={"Văn": "2026-10-23"}))
+        
+        for day in result.schedule:
+            if day.date > "2026-10-23":
+                self.assertNotIn("Văn", {s.subject for s in day.sessions})
+    
+    def test_spaced_reviews(self):
+        result = build_schedule(self.constraints())
+        
+        self.assertTrue(any(s.type == "review" for day in result.schedule for s in day.sessions))
+    
+    def test_reports_unscheduled_minutes(self):
+        result = build_schedule(self.constraints(end_date="2026-10-19", daily_hours=1))
+        
+        scheduled = sum(self.study_minutes(day) for day in result.schedule)
+        self.assertLessEqual(scheduled, 60)
+        self.assertEqual(sum(result.unscheduled_minutes.values()), 600 + 360 - scheduled)
+    
+    def test_sessions_do_not_overlap(self):
+        for day in build_schedule(self.constraints()).schedule:
+            for previous, session in zip(day.sessions, day.sessions[1:]):
+                self.assertLessEqual(previous.end_time, session.start_time)
+    
+    def test_deterministic(self):
+        constraints = self.constraints()
+        self.assertEqual(build_schedule(constraints), build_schedule(constraints))
+    
+    def test_schedule_plan_adds_deadline_milestones(self):
+        plan = schedule_plan(self.constraints(deadlines={"Văn": "2026-10-23"}))
+        
+        self.assertIn("2026-10-23", {m.date for m in plan.milestones})
+    
+    def test_schedule_plan_without_study_days(self):
+        constraints = self.constraints(start_date="2026-10-19", end_date="2026-10-20", study_days=[6])
+        with self.assertRaises(ValueError):
+            schedule_plan(constraints)
+    
+    def many_subjects(self, count, **kwargs):
+        subjects = [
+            {"name": f"Môn {index}", "priority": "medium", "total_hours": 12, "color": "#3366FF"}
+            for index in range(count)
+        ]
+        return self.constraints(subjects=subjects, end_date="2026-12-13", **kwargs)
+    
+    @staticmethod
+    def unreviewed_weeks(result) -> dict:
+        """Tuần (sau tuần học đầu tiên, tới tuần học cuối) không có buổi ôn, theo môn"""
+        start = date.fromisoformat(result.schedule[0].date)
+        weeks, reviewed = defaultdict(set), defaultdict(set)
+        for day in result.schedule:
+            week = (date.fromisoformat(day.date) - start).days // 7
+            for session in day.sessions:
+                if session.type != "break":
+                    weeks[session.subject].add(week)
+                if session.type == "review":
+                    reviewed[session.subject].add(week)
+        return {
+            subject: sum(week not in reviewed[subject] for week in range(min(seen) + 1, max(seen) + 1))
+            for subject, seen in weeks.items()
+        }
+    
+    def test_weekly_review_for_every_subject(self):
+        result = build_schedule(self.many_subjects(12, daily_hours=4))
+        
+        self.assertEqual(result.missed_reviews, {})
+        self.assertEqual(set(self.unreviewed_weeks(result).values()), {0})
+    
+    def test_reports_missed_weekly_reviews(self):
+        # Hai buổi 1 tiếng / tuần: không đủ giờ ôn mọi môn mà vẫn chừa chỗ học mới
+        result = build_schedule(self.many_subjects(10, daily_hours=1, study_days=[0, 5]))
+        
+        self.assertTrue(result.missed_reviews)
+        for subject, weeks in self.unreviewed_weeks(result).items():
+            self.assertLessEqual(weeks, result.missed_reviews.get(subject, 0))
+
+
+def _minutes(session: StudySession) -> int:
+    start_h, start_m = map(int, session.start_time.split(":"))
+    end_h, end_m = map(int, session.end_time.split(":"))
+    return (end_h * 60 + end_m) - (start_h * 60 + start_m)
+
+
+# ============================================
+# Output repair
+# ============================================
+
+class OutputRepairTests(SimpleTestCase):
+    def invalid_plan(self):
+        plan = json.loads(json.dumps(PLAN))
+        plan["schedule"][0]["sessions"][0]["end_time"] = "8h50"
+        plan["subjects"][0]["color"] = "blue"
+        return plan
+    
+    def guard_with_repair(self, patches):
+        """OutputGuard với repair chain giả: trả patches, ghi lại inputs mỗi lần gọi"""
+        guard = OutputGuard(StudyPlan)
+        calls = []
+        
+        def repair(inputs):
+            calls.append(inputs)
+            return patches
+        
+        guard._repair_chain = lambda: RunnableLambda(repair)
+        return guard, calls
+    
+    def test_targets_are_smallest_objects_with_errors(self):
+        with self.assertRaises(ValidationError) as ctx:
+            StudyPlan.model_validate(self.invalid_plan())
+        
+        targets = repair_targets(ctx.exception)
+        self.assertEqual(sorted(format_loc(loc) for loc in targets), ["schedule[0].sessions[0]", "subjects[0]"])
+    
+    def test_repairs_only_the_invalid_fragments(self):
+        guard, calls = self.guard_with_repair({
+            "schedule[0].sessions[0]": PLAN["schedule"][0]["sessions"][0],
+            "subjects[0]": PLAN["subjects"][0],
+        })
+        
+        plan = guard.parse(json.dumps(self.invalid_plan(), ensure_ascii=False))
+        
+        self.assertEqual(plan, StudyPlan.model_validate(PLAN))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(json.loads(calls[0]["fragments"])), {"schedule[0].sessions[0]", "subjects[0]"})
+        self.assertNotIn("Ôn thi cuối kỳ", calls[0]["fragments"])
+        self.assertEqual(guard.stats()["repairs_succeeded"], 1)
+    
+    def test_gives_up_after_max_retries(self):
+        guard, calls = self.guard_with_repair({})
+        
+        with self.assertRaises(ValueError):
+            guard.parse(json.dumps(self.invalid_plan()))
+        self.assertEqual(len(calls), guard.max_retries)
+        self.assertEqual(guard.stats()["repairs_failed"], 1)
+    
+    @override_settings(OUTPUT_REPAIR_MAX_TOKENS=10)
+    def test_stops_at_token_budget(self):
+        guard, calls = self.guard_with_repair({})
+        
+        with self.assertRaises(ValueError):
+            guard.parse(json.dumps(self.invalid_plan()))
+        self.assertEqual((calls, guard.stats()["repair_budget_exceeded"]), ([], 1))
+    
+    @override_settings(OUTPUT_REPAIR_ENABLED=False)
+    def test_disabled(self):
+        guard, calls = self.guard_with_repair({})
+        
+        with self.assertRaises(ValueError):
+            guard.parse(json.dumps(self.invalid_plan()))
+        self.assertEqual(calls, [])
+
+
+# ============================================
+# Chunked planning
+# ============================================
+
+OUTLINE = {
+    "title": "Ôn thi học kỳ",
+    "start_date": "2026-10-19",
+    "end_date": "2026-11-04",  # 17 ngày → 3 tuần
+    "subjects": PLAN["subjects"],
+    "weeks": [
+        {"week": 1, "focus": "Chương 1", "hours": {"Toán": 6}},
+        {"week": 2, "focus": "Chương 2", "hours": {"Toán": 6}},
+    ],
+}
+
+
+def week_of(*days):
+    return WeekSchedule.model_validate({
+        "schedule": [{**PLAN["schedule"][0], "date": day, "day_of_week": "Thứ"} for day in days],
+    })
+
+
+class ChunkedPlanningTests(SimpleTestCase):
+    def test_week_windows(self):
+        outline = PlanOutline.model_validate(OUTLINE)
+        windows = week_windows(outline, max_weeks=10)
+        
+        self.assertEqual([(n, start.isoformat(), end.isoformat()) for n, start, end, _ in windows], [
+            (1, "2026-10-19", "2026-10-25"),
+            (2, "2026-10-26", "2026-11-01"),
+            (3, "2026-11-02", "2026-11-04"),
+        ])
+        focus = [allocation.focus if allocation else None for *_, allocation in windows]
+        self.assertEqual(focus, ["Chương 1", "Chương 2", None])
+        self.assertEqual(len(week_windows(outline, max_weeks=2)), 2)
+    
+    def test_merge_weeks_keeps_days_inside_their_week(self):
+        outline = PlanOutline.model_validate(OUTLINE)
+        windows = week_windows(outline, max_weeks=10)
+        weeks = [
+            week_of("2026-10-20", "2026-10-19", "2026-10-27"),  # 27/10 thuộc tuần 2
+            week_of("2026-10-26", "2026-10-26"),  # trùng ngày
+            week_of("2026-11-04"),
+        ]
+        
+        plan = merge_weeks(outline, windows, weeks)
+        
+        dates = [day.date for day in plan.schedule]
+        self.assertEqual(dates, ["2026-10-19", "2026-10-20", "2026-10-26", "2026-11-04"])
+        self.assertEqual((plan.title, plan.end_date), ("Ôn thi học kỳ", "2026-11-04"))
+    
+    def test_merge_weeks_ends_at_last_window(self):
+        outline = PlanOutline.model_validate(OUTLINE)
+        windows = week_windows(outline, max_weeks=1)
+        
+        plan = merge_weeks(outline, windows, [week_of("2026-10-19")])
+        self.assertEqual(plan.end_date, "2026-10-25")
+    
+    def test_merge_weeks_without_days(self):
+        outline = PlanOutline.model_validate(OUTLINE)
+        windows = week_windows(outline, max_weeks=1)
+        
+        with self.assertRaises(ValueError):
+            merge_weeks(outline, windows, [week_of("2026-12-01")])
+    
+    async def test_failing_week_raises_its_own_error(self):
+        outline = RunnableLambda(lambda inputs: json.dumps(OUTLINE, ensure_ascii=False))
+        
+        async def week(inputs):
+            if inputs["week_number"] == 2:
+                raise TimeoutError("week 2")
+            await asyncio.sleep(0.01)
+            return week_of(inputs["week_start"]).model_dump_json()
+        
+        with self.assertRaises(TimeoutError):
+            await ChunkedPlanner(outline, RunnableLambda(week), concurrency=3).ainvoke({"user_input": "Ôn thi"})
+
+
+# ============================================
+# Regenerate
+# ============================================
+
+def long_plan(days=21):
+    start = date(2026, 10, 19)
+    sessions = [
+        {"start_time": "08:00", "end_time": "09:30", "subject": "Toán", "task": "Học chương 1 " * 10, "type": "study"},
+        {"start_time": "09:30", "end_time": "09:45", "subject": "Toán", "task": "Nghỉ", "type": "break"},
+        {"start_time": "09:45", "end_time": "10:45", "subject": "Văn", "task": "Đọc tác phẩm " * 10, "type": "practice"},
+    ]
+    return {
+        **PLAN,
+        "end_date": (start + timedelta(days=days - 1)).isoformat(),
+        "schedule": [
+            {"date": (start + timedelta(days=i)).isoformat(), "day_of_week": "Thứ", "sessions": sessions}
+            for i in range(days)
+        ],
+        "milestones": [{"date": "2026-11-08", "title": "Thi cuối kỳ", "description": ""}],
+    }
+
+
+class CompactPlanTests(SimpleTestCase):
+    def test_daily_detail_then_weekly_totals(self):
+        lines = compact_plan(long_plan(), daily_days=14).splitlines()
+        
+        self.assertIn("2026-10-19 Thứ | 2.5h | 08:00-09:30 Toán study, 09:45-10:45 Văn practice | 1 break", lines)
+        self.assertNotIn("2026-11-02", "\n".join(line for line in lines if not line.startswith("Week")))
+        self.assertIn("Week 3 (2026-11-02 → 2026-11-08) | 7 days | Toán 10.5h, Văn 7h", lines)
+        self.assertEqual(lines[-1], "Milestones: 2026-11-08 Thi cuối kỳ")
+    
+    def test_drops_tasks_and_is_much_smaller(self):
+        plan = long_plan(60)
+        compact = compact_plan(plan)
+        
+        self.assertNotIn("Học chương 1", compact)
+        self.assertLess(len(compact) * 5, len(json.dumps(plan, ensure_ascii=False)))
+    
+    def test_invalid_date_raises(self):
+        plan = long_plan()
+        plan["schedule"][20]["date"] = "2026-13-01"
+        
+        with self.assertRaises(ValueError):
+            compact_plan(plan)
+    
+    def test_refiner_inputs_carry_feedback(self):
+        context = {
+            "user_input": "Ôn thi Toán",
+            "current_date": "2026-10-17",
+            "study_hours_per_day": "3-4",
+            "available_days": "Tất cả các ngày",
+        }
+        inputs = refiner_inputs(context, long_plan(), attempt=2, feedback="Ít giờ Văn hơn")
+        
+        self.assertIn("Student feedback on the previous plan: Ít giờ Văn hơn", inputs["original_input"])
+        self.assertEqual(inputs["attempt_number"], 2)
+        self.assertTrue(inputs["previous_plan"].startswith("Title: Ôn thi cuối kỳ"))
+
+
+# ============================================
+# Replay latency
+# ============================================
+
+class LatencySpecTests(SimpleTestCase):
+    def test_parses_models_and_defaults(self):
+        self.assertEqual(parse_latency_spec("gemini-2.5-flash=lognormal:1.5:0.35, *=recorded"), {
+            "gemini-2.5-flash": ("lognormal", (1.5, 0.35)),
+            "*": ("recorded", (1.0,)),
+        })
+        self.assertEqual(parse_latency_spec("pro=uniform:2:4,flash=fixed:0.5,"), {
+            "pro": ("uniform", (2.0, 4.0)),
+            "flash": ("fixed", (0.5,)),
+        })
+        self.assertEqual(parse_latency_spec(""), {})
+    
+    def test_rejects_malformed_entries(self):
+        for spec in ("flash=gamma:1", "=fixed:1", "flash=uniform:1", "flash=fixed:1:2", "flash=fixed:fast"):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                parse_latency_spec(spec)
+    
+    @override_settings(LLM_REPLAY_LATENCY="flash=uniform:1:2,*=recorded:2", LLM_REPLAY_SEED=7)
+    def test_sampler_is_seeded_per_model(self):
+        sampler = LatencySampler()
+        first = [sampler.sample("flash", 9.0) for _ in range(5)]
+        sampler.reset()
+        
+        self.assertEqual([sampler.sample("flash", 9.0) for _ in range(5)], first)
+        self.assertTrue(all(1.0 <= s <= 2.0 for s in first))
+        self.assertEqual(sampler.sample("pro", 1.5), 3.0)
@@ -5,14 +5,24 @@ Planner URL Configuration
 from django.urls import path
 from .views import (
     GeneratePlanView,
+    GenerateStreamView,
+    GenerateBatchView,
+    JobCreateView,
+    JobDetailView,
     PlanDetailView,
     PlanCreateView,
+    RegeneratePlanView,
     HealthCheckView,
 )
 
 urlpatterns = [
     path('generate/', GeneratePlanView.as_view(), name='generate-plan'),
+    path('generate/stream/', GenerateStreamView.as_view(), name='generate-plan-stream'),
+    path('generate/batch/', GenerateBatchView.as_view(), name='generate-plan-batch'),
+    path('jobs/', JobCreateView.as_view(), name='create-job'),
+    path('jobs/<str:job_id>/', JobDetailView.as_view(), name='job-detail'),
     path('plans/', PlanCreateView.as_view(), name='create-plan'),
     path('plans/<str:plan_id>/', PlanDetailView.as_view(), name='plan-detail'),
+    path('plans/<str:plan_id>/regenerate/', RegeneratePlanView.as_view(), name='regenerate-plan'),
     path('health/', HealthCheckView.as_view(), name='health-check'),
 ]
@@ -2,32 +2,150 @@
 Planner API Views
 """
 
+import json
+import time
+import asyncio
 import uuid
 import logging
-import asyncio
-from rest_framework.views import APIView
+from contextlib import aclosing
+from datetime import date
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.response import Response
 from rest_framework import status
+from pydantic import ValidationError
+from langchain_core.runnables import RunnableLambda
 
 from .guards.input_guard import InputGuard
-from .services import generate_plan_html
-from core.langchain.chains import ChainFactory, create_safe_generation_chain
-from core.firebase import study_plan_repo
+from .guards.output_guard import RouterDecision, StudyPlan, study_plan_guard
+from .services import (
+    absolute_dates,
+    adapt_plan_dates,
+    callback_url_allowed,
+    generate_plan_html,
+    make_request_key,
+    job_queue,
+    make_request_namespace,
+    near_duplicate_index,
+    numeric_quantities,
+    response_cache,
+    single_flight,
+)
+from core.langchain.chains import (
+    ChainFactory,
+    RENDER_MODES,
+    ainvoke_llm_router,
+    arender_plan,
+    build_planner_inputs,
+    chain_registry,
+    create_safe_generation_chain,
+    model_name,
+    render_stats,
+    route_locally,
+)
+from core.langchain.speculation import speculation_stats
+from core.langchain.chunked import chunked_stats
+from core.langchain.cassette import cassette_store
+from core.langchain.regenerate import (
+    CHARS_PER_TOKEN,
+    full_regeneration_baseline,
+    refiner_inputs,
+    regenerate_stats,
+    savings_report,
+    stage_entry,
+)
+from core.langchain.admission import AdmissionRejected, admission_controller, admission_deadline
+from core.langchain.tracing import start_trace, trace_stats
+from core.langchain.resilience import (
+    StageTimeout,
+    parse_budget,
+    stage_stats,
+    start_deadline,
+    track_served_model,
+)
+from core.langchain.circuit_breaker import CircuitOpen, circuit_breakers
+from core.langchain.streaming import (
+    StreamTimer,
+    cached_events,
+    format_sse,
+    stream_generation,
+    stream_stats,
+)
+from core.langchain.local_router import local_router
+from core.firebase import feedback_repo, study_plan_repo
+from core.views import AsyncAPIView
+from core.langsmith.versioning import PromptManager
+from core.metrics import CLIENT_DISCONNECTS
+from .workers import job_worker_pool
 
 logger = logging.getLogger(__name__)
 
 
-def run_async(coro):
-    """Helper to run async code in sync context."""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop.run_until_complete(coro)
+def wants_timings(request) -> bool:
+    """`?timings=1` hoặc `"timings": true` trong body"""
+    flag = request.query_params.get("timings") or request.data.get("timings")
+    return str(flag).lower() in ("1", "true", "yes")
+
+
+def count_llm_calls(result: dict) -> int:
+    """Số LLM calls một generation đã dùng: planner + router LLM + coder"""
+    calls = 1
+    if (result.get("router_decision") or {}).get("source") == "llm":
+        calls += 1
+    if (result.get("render") or {}).get("mode") == "llm":
+        calls += 1
+    return calls
+
+
+def overloaded_body(error: AdmissionRejected) -> dict:
+    return {
+        "error": "Hệ thống đang quá tải. Vui lòng thử lại sau.",
+        "code": "OVERLOADED" if error.status_code == 429 else "QUEUE_TIMEOUT",
+        "retry_after": error.retry_after,
+    }
+
+
+def overloaded_response(error: AdmissionRejected) -> Response:
+    """429 (hàng đợi đầy) / 503 (hết hạn khi đang đợi) kèm Retry-After"""
+    return Response(
+        overloaded_body(error),
+        status=error.status_code,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
 
+def deadline_body(error: StageTimeout) -> dict:
+    return {
+        "error": "Tạo kế hoạch quá thời gian cho phép. Vui lòng thử lại.",
+        "code": "DEADLINE_EXCEEDED",
+        "stage": error.stage,
+    }
 
-class GeneratePlanView(APIView):
+
+def unavailable_body(error: CircuitOpen) -> dict:
+    return {
+        "error": "Model AI đang tạm thời gián đoạn. Vui lòng thử lại sau.",
+        "code": "MODEL_UNAVAILABLE",
+        "retry_after": error.retry_after,
+    }
+
+
+def unavailable_response(error: CircuitOpen) -> Response:
+    """503 kèm Retry-After: breaker của model đang open và không có fallback"""
+    return Response(
+        unavailable_body(error),
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def request_budget(request):
+    """Budget (giây) từ header X-Request-Timeout, None → REQUEST_DEFAULT_BUDGET_SECONDS"""
+    return parse_budget(request.headers.get("X-Request-Timeout"))
+
+
+class GeneratePlanView(AsyncAPIView):
     """
     POST /api/v1/generate/
     Generate study plan với security guards
@@ -38,7 +156,26 @@ class GeneratePlanView(APIView):
     - Output JSON parsing errors
     """
     
-    def post(self, request):
+    async def post(self, request):
+        trace = start_trace()
+        try:
+            response = await self._generate(request)
+        except asyncio.CancelledError:
+            # ASGI: client ngắt kết nối → Django cancel view, LLM calls đang chạy bị hủy theo
+            logger.info("Client disconnected, generation cancelled")
+            CLIENT_DISCONNECTS.inc(endpoint="generate")
+            raise
+        
+        # Thời gian + tokens từng stage: header Server-Timing, field `timings` khi được yêu cầu
+        response["Server-Timing"] = trace.server_timing()
+        if wants_timings(request) and response.status_code == status.HTTP_200_OK:
+            response.data["timings"] = trace.breakdown()
+        trace_stats.record(trace)
+        return response
+    
+    async def _generate(self, request):
+        deadline = start_deadline(request_budget(request))
+        admission_deadline.set(min(time.monotonic() + settings.ADMISSION_MAX_WAIT_SECONDS, deadline))
         user_input = request.data.get("input", "")
         
         # 1. Input Guard (fast fail)
@@ -49,31 +186,106 @@ class GeneratePlanView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        try:
-            # 2. Run generation chain
+        render_mode = request.data.get("render_mode") or settings.PLAN_RENDER_MODE
+        if render_mode not in RENDER_MODES:
+            return Response(
+                {
+                    "error": f"render_mode must be one of: {', '.join(RENDER_MODES)}",
+                    "code": "INVALID_RENDER_MODE",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        study_hours_per_day = request.data.get("study_hours_per_day", "3-4")
+        available_days = request.data.get("available_days", "Tất cả các ngày")
+        
+        # 2. Response cache (bỏ qua khi user bấm regenerate)
+        use_cache = settings.RESPONSE_CACHE_ENABLED
+        cache_key = make_request_key(user_input, study_hours_per_day, available_days, render_mode)
+        if use_cache and request.data.get("regenerate"):
+            response_cache.record_bypass()
+        elif use_cache:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return Response({
+                    "success": True,
+                    "planId": str(uuid.uuid4()),
+                    **cached,
+                    "cached": True,
+                })
+        
+        # 3. Near-duplicate input (typo, đổi thứ tự dòng...) → dùng lại plan đã có
+        use_near_duplicate = settings.NEAR_DUPLICATE_ENABLED and not request.data.get("regenerate")
+        namespace = make_request_namespace(study_hours_per_day, available_days, render_mode)
+        if use_near_duplicate:
+            reused = self._reuse_near_duplicate(user_input, namespace, render_mode)
+            if reused is not None:
+                return Response({
+                    "success": True,
+                    "planId": str(uuid.uuid4()),
+                    **reused,
+                    "cached": True,
+                })
+        
+        async def generate():
+            # Planner calls đợi slot Flash/Pro; mọi lane đều đầy → 429 ngay, trước Router
+            if settings.ADMISSION_ENABLED:
+                admission_controller.precheck()
             chain = create_safe_generation_chain()
-            result = chain.invoke({
+            return await chain.ainvoke({
                 "user_input": user_input,
-                "study_hours_per_day": request.data.get("study_hours_per_day", "3-4"),
-                "available_days": request.data.get("available_days", "Tất cả các ngày"),
+                "study_hours_per_day": study_hours_per_day,
+                "available_days": available_days,
+                "render_mode": render_mode,
             })
+        
+        try:
+            # 4. Run generation chain (router → planner → render)
+            #    Request giống hệt đang chạy → đợi và dùng chung kết quả
+            if settings.SINGLE_FLIGHT_ENABLED:
+                flight_key = f"{cache_key}:regenerate" if request.data.get("regenerate") else cache_key
+                result, coalesced = await single_flight.run(flight_key, generate, count_llm_calls)
+            else:
+                result, coalesced = await generate(), False
             
-            # 3. Generate HTML from plan
-            plan_data = result.get("plan", {})
-            html_content = generate_plan_html(plan_data)
+            payload = {
+                "plan": result.get("plan", {}),
+                "html": result.get("html"),
+                "model_used": result.get("model_used"),
+                "router_decision": result.get("router_decision"),
+                "render": result.get("render"),
+            }
+            # Leader đã lưu cache cho cả nhóm
+            if use_cache and not coalesced:
+                response_cache.set(cache_key, payload)
+            if settings.NEAR_DUPLICATE_ENABLED and not coalesced:
+                near_duplicate_index.insert(user_input, namespace, {
+                    "generated_on": timezone.localdate().isoformat(),
+                    "response": payload,
+                    "dates": absolute_dates(user_input),
+                    "quantities": numeric_quantities(user_input),
+                })
             
-            # 4. Generate plan ID
+            # 5. Generate plan ID
             plan_id = str(uuid.uuid4())
             
             return Response({
                 "success": True,
                 "planId": plan_id,
-                "plan": plan_data,
-                "html": html_content,
-                "model_used": result.get("model_used"),
-                "router_decision": result.get("router_decision"),
+                **payload,
+                "cached": False,
+                "coalesced": coalesced,
             })
-            
+        
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        
+        except StageTimeout as e:
+            return Response(deadline_body(e), status=status.HTTP_504_GATEWAY_TIMEOUT)
+        
+        except CircuitOpen as e:
+            return unavailable_response(e)
+        
         except ValueError as e:
             error_msg = str(e)
             
@@ -105,16 +317,515 @@ class GeneratePlanView(APIView):
                 },
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
+    
+    
+    @staticmethod
+    def _reuse_near_duplicate(user_input, namespace, render_mode):
+        """
+        Plan của input gần giống nhất, đã dời ngày về hôm nay (None nếu không có)
+        """
+        match = near_duplicate_index.lookup(user_input, namespace)
+        if match is None:
+            return None
+        
+        response = match.payload["response"]
+        today = timezone.localdate()
+        shift_days = (today - date.fromisoformat(match.payload["generated_on"])).days
+        
+        # Ngày thi / deadline tuyệt đối: chỉ dùng lại khi cùng các ngày đó và cùng ngày generate
+        # (dời lịch sẽ dời cả ngày thi của học sinh)
+        dates = absolute_dates(user_input)
+        if dates != match.payload.get("dates", []) or (dates and shift_days):
+            return None
+        # Số tuần / số giờ / số chương khác → plan khác dù input gần giống
+        if numeric_quantities(user_input) != match.payload.get("quantities"):
+            return None
+        
+        if shift_days:
+            # HTML do coder LLM tạo không dời ngày được → generate lại
+            if render_mode != "template":
+                return None
+            plan = adapt_plan_dates(response["plan"], shift_days)
+            response = {**response, "plan": plan, "html": generate_plan_html(plan)}
+        
+        logger.info(f"Reusing near-duplicate plan (similarity {match.similarity:.2f})")
+        return {
+            **response,
+            "near_duplicate": {"similarity": round(match.similarity, 3)},
+        }
+
+
+class GenerateStreamView(AsyncAPIView):
+    """
+    POST /api/v1/generate/stream/
+    Generate study plan, stream tiến độ bằng Server-Sent Events
+    
+    Cùng request body với /generate/. Lỗi validate trả về JSON 400 như
+    /generate/; lỗi sau khi stream đã mở được gửi bằng event `error`.
+    Xem core/langchain/streaming.py cho danh sách events.
+    """
+    
+    async def post(self, request):
+        started_at = time.perf_counter()
+        user_input = request.data.get("input", "")
+        
+        # 1. Input Guard (fast fail, trước khi mở stream)
+        is_safe, reason = InputGuard.check_input(user_input)
+        if not is_safe:
+            return Response(
+                {"error": reason, "code": "INPUT_BLOCKED"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        render_mode = request.data.get("render_mode") or settings.PLAN_RENDER_MODE
+        if render_mode not in RENDER_MODES:
+            return Response(
+                {
+                    "error": f"render_mode must be one of: {', '.join(RENDER_MODES)}",
+                    "code": "INVALID_RENDER_MODE",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if settings.ADMISSION_ENABLED:
+            try:
+                admission_controller.precheck()
+            except AdmissionRejected as e:
+                return overloaded_response(e)
+        
+        data = {
+            "user_input": user_input,
+            "study_hours_per_day": request.data.get("study_hours_per_day", "3-4"),
+            "available_days": request.data.get("available_days", "Tất cả các ngày"),
+            "render_mode": render_mode,
+        }
+        
+        response = StreamingHttpResponse(
+            self._stream(
+                data, bool(request.data.get("regenerate")), StreamTimer(started_at), request_budget(request)
+            ),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx: không buffer SSE
+        return response
+    
+    @staticmethod
+    async def _stream(data, regenerate, timer, budget=None):
+        """SSE frames; dùng chung response cache với /generate/"""
+        use_cache = settings.RESPONSE_CACHE_ENABLED
+        cache_key = make_request_key(
+            data["user_input"], data["study_hours_per_day"], data["available_days"], data["render_mode"]
+        )
+        
+        cached = None
+        if use_cache and regenerate:
+            response_cache.record_bypass()
+        elif use_cache:
+            cached = response_cache.get(cache_key)
+        
+        trace = start_trace()
+        events = cached_events(cached, timer) if cached is not None else stream_generation(data, timer)
+        payload = {}
+        completed = False
+        elapsed = timer.elapsed_ms() / 1000
+        deadline = start_deadline((budget or settings.REQUEST_DEFAULT_BUDGET_SECONDS) - elapsed)
+        admission_deadline.set(
+            min(time.monotonic() + settings.ADMISSION_MAX_WAIT_SECONDS - elapsed, deadline)
+        )
+        
+        try:
+            async for event, event_data in events:
+                if event == "router_decision":
+                    payload["router_decision"] = {
+                        k: v for k, v in event_data.items() if k != "model_used"
+                    }
+                    payload["model_used"] = event_data.get("model_used")
+                elif event == "plan":
+                    payload["plan"] = event_data["plan"]
+                elif event == "html":
+                    payload["html"] = event_data["html"]
+                    payload["render"] = event_data["render"]
+                elif event == "done":
+                    event_data = {**event_data, "planId": str(uuid.uuid4()), "trace": trace.breakdown()}
+                    completed = True
+                    # Plan stream không theo các chế độ đang bật → không ghi vào cache của chúng
+                    if cached is None and not event_data.get("skipped_modes"):
+                        GenerateStreamView._store(data, cache_key, payload, use_cache)
+                
+                timer.mark_first_byte()
+                yield format_sse(event, event_data)
+        
+        except AdmissionRejected as e:
+            yield format_sse("error", overloaded_body(e))
+        
+        except StageTimeout as e:
+            yield format_sse("error", deadline_body(e))
+        
+        except CircuitOpen as e:
+            yield format_sse("error", unavailable_body(e))
+        
+        except asyncio.CancelledError:
+            logger.info("Client disconnected, stream cancelled")
+            CLIENT_DISCONNECTS.inc(endpoint="generate_stream")
+            raise
+        
+        except ValueError as e:
+            error_msg = str(e)
+            if "safety" in error_msg.lower() or "blocked" in error_msg.lower():
+                yield format_sse("error", {
+                    "error": "Nội dung không phù hợp. Vui lòng thử lại với input khác.",
+                    "code": "SAFETY_BLOCKED",
+                })
+            else:
+                logger.error(f"Streaming generation failed: {error_msg}")
+                yield format_sse("error", {"error": error_msg, "code": "GENERATION_FAILED"})
+        
+        except Exception:
+            logger.exception("Unexpected error in generate stream")
+            yield format_sse("error", {
+                "error": "Generation failed. Please try again.",
+                "code": "API_ERROR",
+            })
+        
+        finally:
+            timings = timer.summary()
+            stream_stats.record(timings, completed=completed)
+            trace_stats.record(trace)
+            logger.info(
+                f"Stream finished: ttfb={timings['ttfb_ms']}ms "
+                f"ttfc={timings['ttfc_ms']}ms total={timings['total_ms']}ms"
+            )
+    
+    @staticmethod
+    def _store(data, cache_key, payload, use_cache):
+        if use_cache:
+            response_cache.set(cache_key, payload)
+        if settings.NEAR_DUPLICATE_ENABLED:
+            namespace = make_request_namespace(
+                data["study_hours_per_day"], data["available_days"], data["render_mode"]
+            )
+            near_duplicate_index.insert(data["user_input"], namespace, {
+                "generated_on": timezone.localdate().isoformat(),
+                "response": payload,
+                "dates": absolute_dates(data["user_input"]),
+                "quantities": numeric_quantities(data["user_input"]),
+            })
+
+
+class GenerateBatchView(AsyncAPIView):
+    """
+    POST /api/v1/generate/batch/
+    Generate nhiều plans trong một request, kết quả trả về dạng NDJSON
+    
+    Body: {"items": [{"id"?, "input", "study_hours_per_day"?, "available_days"?,
+                      "render_mode"?}, ...], "max_concurrency"?}
+    (field thừa như description/expected_* được bỏ qua, nên post thẳng được
+    danh sách trong tests/sample_inputs.json)
+    
+    Input Guard chạy cho mọi item trước, sau đó các item hợp lệ chạy bằng
+    full chain abatch_as_completed (tối đa max_concurrency cùng lúc). Mỗi dòng
+    là một item xong trước (không theo thứ tự gửi); dòng cuối là summary.
+    Lỗi của một item chỉ nằm trong dòng của item đó. Mỗi item có budget riêng
+    (X-Request-Timeout), tính từ lúc item bắt đầu chạy.
+    """
+    
+    async def post(self, request):
+        items = request.data.get("items")
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"error": "items must be a non-empty list", "code": "INVALID_BATCH"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.BATCH_MAX_ITEMS:
+            return Response(
+                {
+                    "error": f"Batch too large (max {settings.BATCH_MAX_ITEMS} items)",
+                    "code": "BATCH_TOO_LARGE",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            max_concurrency = int(request.data.get("max_concurrency") or settings.BATCH_MAX_CONCURRENCY)
+        except (TypeError, ValueError):
+            max_concurrency = settings.BATCH_MAX_CONCURRENCY
+        max_concurrency = max(1, min(max_concurrency, settings.BATCH_MAX_CONCURRENCY))
+        
+        response = StreamingHttpResponse(
+            self._stream(items, max_concurrency, request_budget(request)),
+            content_type="application/x-ndjson",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+    
+    @staticmethod
+    async def _stream(items, max_concurrency, budget=None):
+        started_at = time.perf_counter()
+        use_cache = settings.RESPONSE_CACHE_ENABLED
+        succeeded = 0
+        pending = []  # (index, item_id, cache_key, chain input)
+        
+        # 1. Input Guard + cache cho mọi item trước khi gọi LLM
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {"input": item}
+            item_id = item.get("id", index)
+            user_input = item.get("input", "")
+            user_input = user_input if isinstance(user_input, str) else ""
+            render_mode = item.get("render_mode") or settings.PLAN_RENDER_MODE
+            
+            is_safe, reason = InputGuard.check_input(user_input)
+            if not is_safe:
+                yield _ndjson(_batch_error(index, item_id, reason, "INPUT_BLOCKED"))
+                continue
+            if render_mode not in RENDER_MODES:
+                yield _ndjson(_batch_error(
+                    index, item_id, f"render_mode must be one of: {', '.join(RENDER_MODES)}",
+                    "INVALID_RENDER_MODE",
+                ))
+                continue
+            
+            data = {
+                "user_input": user_input,
+                "study_hours_per_day": item.get("study_hours_per_day", "3-4"),
+                "available_days": item.get("available_days", "Tất cả các ngày"),
+                "render_mode": render_mode,
+            }
+            cache_key = make_request_key(
+                user_input, data["study_hours_per_day"], data["available_days"], render_mode
+            )
+            cached = response_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                succeeded += 1
+                yield _ndjson(_batch_result(index, item_id, cached, cached=True))
+                continue
+            
+            pending.append((index, item_id, cache_key, data))
+        
+        # 2. Full chain (đã build sẵn) cho các item còn lại, xong item nào trả item đó
+        if pending:
+            chain = _with_item_deadline(chain_registry.get("full"), budget)
+            results = chain.abatch_as_completed(
+                [data for _, _, _, data in pending],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True,
+            )
+            async with aclosing(results):
+                async for position, result in results:
+                    index, item_id, cache_key, _ = pending[position]
+                    if isinstance(result, Exception):
+                        yield _ndjson(_batch_exception(index, item_id, result))
+                        continue
+                    
+                    payload = {
+                        "plan": result.get("plan", {}),
+                        "html": result.get("html"),
+                        "model_used": result.get("model_used"),
+                        "router_decision": result.get("router_decision"),
+                        "render": result.get("render"),
+                    }
+                    if use_cache:
+                        response_cache.set(cache_key, payload)
+                    succeeded += 1
+                    yield _ndjson(_batch_result(index, item_id, payload, cached=False))
+        
+        duration_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        logger.info(
+            f"Batch finished: {succeeded}/{len(items)} succeeded in {duration_ms}ms "
+            f"(max_concurrency={max_concurrency})"
+        )
+        yield _ndjson({
+            "type": "summary",
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded,
+            "max_concurrency": max_concurrency,
+            "duration_ms": duration_ms,
+        })
+
+
+def _with_item_deadline(chain, budget):
+    """Deadline (và admission deadline) riêng cho từng batch item, set trong task của item"""
+    async def run(data, config):
+        deadline = start_deadline(budget)
+        admission_deadline.set(min(time.monotonic() + settings.ADMISSION_MAX_WAIT_SECONDS, deadline))
+        return await chain.ainvoke(data, config)
+    
+    return RunnableLambda(run, name="batch_item")
+
+
+def _ndjson(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _batch_result(index, item_id, payload, cached):
+    return {
+        "type": "item",
+        "index": index,
+        "id": item_id,
+        "success": True,
+        "planId": str(uuid.uuid4()),
+        **payload,
+        "cached": cached,
+    }
+
+
+def _batch_error(index, item_id, error, code, **extra):
+    return {
+        "type": "item",
+        "index": index,
+        "id": item_id,
+        "success": False,
+        "error": error,
+        "code": code,
+        **extra,
+    }
+
+
+def _batch_exception(index, item_id, exc):
+    """Map lỗi của một item giống các mã lỗi của /generate/"""
+    if isinstance(exc, AdmissionRejected):
+        body = overloaded_body(exc)
+        return _batch_error(index, item_id, body["error"], body["code"], retry_after=body["retry_after"])
+    
+    if isinstance(exc, CircuitOpen):
+        body = unavailable_body(exc)
+        return _batch_error(index, item_id, body["error"], body["code"], retry_after=body["retry_after"])
+    
+    if isinstance(exc, StageTimeout):
+        body = deadline_body(exc)
+        return _batch_error(index, item_id, body["error"], body["code"], stage=body["stage"])
+    
+    if isinstance(exc, ValueError):
+        error_msg = str(exc)
+        if "safety" in error_msg.lower() or "blocked" in error_msg.lower():
+            return _batch_error(
+                index, item_id,
+                "Nội dung không phù hợp. Vui lòng thử lại với input khác.", "SAFETY_BLOCKED",
+            )
+        logger.error(f"Batch item {item_id} failed: {error_msg}")
+        return _batch_error(index, item_id, error_msg, "GENERATION_FAILED")
+    
+    logger.error(f"Batch item {item_id} failed: {exc!r}")
+    return _batch_error(index, item_id, "Generation failed. Please try again.", "API_ERROR")
 
 
-class PlanDetailView(APIView):
+class JobCreateView(AsyncAPIView):
+    """
+    POST /api/v1/jobs/
+    Tạo generation job, trả về jobId ngay (202) thay vì giữ connection
+    
+    Cùng body với /generate/, thêm:
+    - priority: int, số lớn chạy trước (default 0)
+    - callback_url: POST kết quả (JSON) tới URL này khi job xong / dead
+    - userId: lưu kèm plan trong Firestore
+    
+    Theo dõi bằng GET /api/v1/jobs/{jobId}/
+    """
+    
+    async def post(self, request):
+        user_input = request.data.get("input", "")
+        
+        is_safe, reason = InputGuard.check_input(user_input)
+        if not is_safe:
+            return Response(
+                {"error": reason, "code": "INPUT_BLOCKED"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        render_mode = request.data.get("render_mode") or settings.PLAN_RENDER_MODE
+        if render_mode not in RENDER_MODES:
+            return Response(
+                {
+                    "error": f"render_mode must be one of: {', '.join(RENDER_MODES)}",
+                    "code": "INVALID_RENDER_MODE",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            priority = int(request.data.get("priority") or 0)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "priority must be an integer", "code": "INVALID_PRIORITY"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        callback_url = request.data.get("callback_url") or ""
+        if callback_url and not await asyncio.to_thread(callback_url_allowed, callback_url):
+            return Response(
+                {"error": "callback_url must be an allowed http(s) URL", "code": "INVALID_CALLBACK"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job = await asyncio.to_thread(job_queue.enqueue, {
+            "user_input": user_input,
+            "study_hours_per_day": request.data.get("study_hours_per_day", "3-4"),
+            "available_days": request.data.get("available_days", "Tất cả các ngày"),
+            "render_mode": render_mode,
+            "user_id": request.data.get("userId"),
+        }, priority, callback_url)
+        
+        if settings.JOB_WORKERS_IN_PROCESS:
+            job_worker_pool.start()
+            job_worker_pool.notify()
+        
+        return Response(
+            {
+                "success": True,
+                "jobId": job["id"],
+                "status": job["status"],
+                "statusUrl": f"/api/v1/jobs/{job['id']}/",
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class JobDetailView(AsyncAPIView):
+    """
+    GET /api/v1/jobs/{id}/
+    Trạng thái job: queued | running | succeeded (kèm kết quả) | dead (kèm lỗi)
+    """
+    
+    async def get(self, request, job_id):
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        
+        if not job:
+            return Response(
+                {"error": "Job not found", "code": "NOT_FOUND"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        body = {
+            "success": True,
+            "jobId": job["id"],
+            "status": job["status"],
+            "priority": job["priority"],
+            "attempts": job["attempts"],
+            "maxAttempts": job["max_attempts"],
+            "createdAt": job["created_at"],
+            "finishedAt": job["finished_at"],
+        }
+        if job["status"] == "succeeded":
+            body["result"] = job["result"]
+        elif job["error"]:
+            # queued: lỗi của lần thử trước (đang đợi retry)
+            body["error"] = job["error"]
+        if job["callback_url"]:
+            body["callbackStatus"] = job["callback_status"]
+        
+        return Response(body)
+
+
+class PlanDetailView(AsyncAPIView):
     """
     GET /api/v1/plans/{id}/
     Get saved plan by ID
     """
     
-    def get(self, request, plan_id):
-        plan = run_async(study_plan_repo.get(plan_id))
+    async def get(self, request, plan_id):
+        plan = await study_plan_repo.get(plan_id)
         
         if not plan:
             return Response(
@@ -129,13 +840,13 @@ class PlanDetailView(APIView):
 
 
 
-class PlanCreateView(APIView):
+class PlanCreateView(AsyncAPIView):
     """
     POST /api/v1/plans/
     Save new plan to Firestore
     """
     
-    def post(self, request):
+    async def post(self, request):
         plan_id = request.data.get("planId") or str(uuid.uuid4())
         plan_data = request.data.get("plan", {})
         html_content = request.data.get("html", "")
@@ -154,7 +865,18 @@ class PlanCreateView(APIView):
             "userId": user_id,
         }
         
-        saved = run_async(study_plan_repo.save(plan_id, document))
+        # Context của lần generate (cho regenerate: không cần gọi lại Router)
+        if request.data.get("input"):
+            document.update({
+                "input": request.data["input"],
+                "studyHoursPerDay": request.data.get("study_hours_per_day", "3-4"),
+                "availableDays": request.data.get("available_days", "Tất cả các ngày"),
+                "routerDecision": request.data.get("router_decision"),
+                "modelUsed": request.data.get("model_used"),
+                "regenerateCount": 0,
+            })
+        
+        saved = await study_plan_repo.save(plan_id, document)
         
         return Response({
             "success": True,
@@ -163,15 +885,216 @@ class PlanCreateView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class HealthCheckView(APIView):
+class RegeneratePlanView(AsyncAPIView):
+    """
+    POST /api/v1/plans/{id}/regenerate/
+    Tạo lại plan đã lưu (user không hài lòng) bằng refiner prompt
+    
+    Body: {"attempt": 2, "feedback": "...", "session_id": "...", "render_mode": "template"}
+    
+    Input gốc + router decision lấy từ plan đã lưu (POST /plans/ với `input`,
+    `router_decision`) nên không gọi Router; plan trước được rút gọn gửi cho
+    refiner. Feedback event được ghi song song với refiner call. Response có
+    `savings`: tokens / latency so với generate lại từ đầu.
+    """
+    
+    async def post(self, request, plan_id):
+        trace = start_trace()
+        response = await self._regenerate(request, plan_id, trace)
+        
+        response["Server-Timing"] = trace.server_timing()
+        if wants_timings(request) and response.status_code == status.HTTP_200_OK:
+            response.data["timings"] = trace.breakdown()
+        trace_stats.record(trace)
+        return response
+    
+    async def _regenerate(self, request, plan_id, trace):
+        deadline = start_deadline(request_budget(request))
+        admission_deadline.set(min(time.monotonic() + settings.ADMISSION_MAX_WAIT_SECONDS, deadline))
+        
+        document = await study_plan_repo.get(plan_id)
+        if not document:
+            return Response(
+                {"error": "Plan not found", "code": "NOT_FOUND"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Plan lưu trước khi có context → client gửi lại input
+        user_input = document.get("input") or request.data.get("input", "")
+        feedback = request.data.get("feedback") or ""
+        if not user_input:
+            return Response(
+                {"error": "Original input is not stored for this plan", "code": "MISSING_INPUT"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        for text in (user_input, feedback):
+            is_safe, reason = InputGuard.check_input(text) if text else (True, "")
+            if not is_safe:
+                return Response(
+                    {"error": reason, "code": "INPUT_BLOCKED"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        try:
+            attempt = int(request.data.get("attempt") or document.get("regenerateCount", 0) + 1)
+        except (TypeError, ValueError):
+            attempt = 0
+        if attempt < 1:
+            return Response(
+                {"error": "attempt must be a positive integer", "code": "INVALID_ATTEMPT"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        render_mode = request.data.get("render_mode") or settings.PLAN_RENDER_MODE
+        if render_mode not in RENDER_MODES:
+            return Response(
+                {
+                    "error": f"render_mode must be one of: {', '.join(RENDER_MODES)}",
+                    "code": "INVALID_RENDER_MODE",
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        context = build_planner_inputs({
+            "user_input": user_input,
+            "study_hours_per_day": document.get("studyHoursPerDay", "3-4"),
+            "available_days": document.get("availableDays", "Tất cả các ngày"),
+        })
+        # Plan do client gửi lên POST /plans/, chưa được validate
+        try:
+            previous_plan = StudyPlan.model_validate(document.get("plan") or {}).model_dump()
+            inputs = refiner_inputs(context, previous_plan, attempt, feedback)
+        except ValueError as e:
+            logger.warning(f"Plan {plan_id} cannot be regenerated: {e}")
+            return Response(
+                {"error": "Stored plan is not a valid study plan", "code": "INVALID_STORED_PLAN"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            router_decision = await self._router_decision(document, user_input)
+            use_pro = router_decision.get("complexity", "easy") == "hard"
+            chain = chain_registry.get("refiner_hard" if use_pro else "refiner_easy")
+            
+            # Feedback event ghi cùng lúc với refiner call
+            with track_served_model() as served:
+                plan, _ = await asyncio.gather(
+                    chain.ainvoke(inputs),
+                    feedback_repo.save(str(uuid.uuid4()), {
+                        "planId": plan_id,
+                        "action": "regenerate",
+                        "attempt": attempt,
+                        "feedback": feedback,
+                        "sessionId": request.data.get("session_id"),
+                        "userId": document.get("userId"),
+                    }),
+                )
+            model_used = served.get("model", model_name(use_pro))
+            html, render = await arender_plan(plan, render_mode, chain_registry.get("coder"))
+            
+            await study_plan_repo.update(plan_id, {
+                "plan": plan,
+                "html": html,
+                "routerDecision": router_decision,
+                "modelUsed": model_used,
+                "regenerateCount": attempt,
+            })
+        
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        
+        except StageTimeout as e:
+            return Response(deadline_body(e), status=status.HTTP_504_GATEWAY_TIMEOUT)
+        
+        except CircuitOpen as e:
+            return unavailable_response(e)
+        
+        except ValueError as e:
+            logger.error(f"Regeneration failed: {e}")
+            return Response(
+                {"error": str(e), "code": "GENERATION_FAILED"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        except Exception:
+            logger.exception("Unexpected error in regenerate")
+            return Response(
+                {
+                    "error": "Generation failed. Please try again.",
+                    "code": "API_ERROR"
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        # Plan trước rút gọn vs gửi nguyên JSON cho refiner
+        savings = {
+            "previous_plan": {
+                "json_tokens": len(json.dumps(previous_plan, ensure_ascii=False)) // CHARS_PER_TOKEN,
+                "compact_tokens": len(inputs["previous_plan"]) // CHARS_PER_TOKEN,
+            },
+        }
+        # Tokens / latency của refiner call so với Router + Planner từ đầu (chỉ khi đã có số đo)
+        breakdown = trace.breakdown()
+        refiner = stage_entry(breakdown, "refiner")
+        baseline = full_regeneration_baseline("planner_pro" if use_pro else "planner_flash")
+        if refiner is not None and baseline is not None:
+            savings.update(savings_report(baseline, [refiner, stage_entry(breakdown, "router")]))
+        
+        return Response({
+            "success": True,
+            "planId": plan_id,
+            "attempt": attempt,
+            "plan": plan,
+            "html": html,
+            "model_used": model_used,
+            "router_decision": router_decision,
+            "render": render,
+            "savings": savings,
+        })
+    
+    @staticmethod
+    async def _router_decision(document, user_input):
+        """Router decision đã lưu; plan cũ chưa có → local router, rồi Router LLM"""
+        try:
+            stored = RouterDecision.model_validate(document["routerDecision"])
+        except (KeyError, ValidationError):
+            stored = None  # chưa lưu / client gửi decision không hợp lệ → route lại
+        if stored is not None:
+            regenerate_stats.record_router_skipped()
+            return {**stored.model_dump(), "source": "stored"}
+        
+        local_decision, confident = route_locally(user_input)
+        if confident:
+            return {**local_decision.model_dump(), "source": "local"}
+        return await ainvoke_llm_router(chain_registry.get("router"), user_input, local_decision)
+
+
+class HealthCheckView(AsyncAPIView):
     """
     GET /api/v1/health/
     Health check endpoint
     """
     
-    def get(self, request):
+    async def get(self, request):
         return Response({
             "status": "healthy",
             "service": "student-planner-api",
             "version": "1.0.0",
+            "prompt_cache": PromptManager.cache_stats(),
+            "render": render_stats.snapshot(),
+            "speculation": speculation_stats.snapshot(),
+            "local_router": local_router.stats(),
+            "response_cache": response_cache.stats(),
+            "near_duplicate": near_duplicate_index.stats(),
+            "streaming": stream_stats.snapshot(),
+            "output_guard": study_plan_guard.stats(),
+            "admission": admission_controller.stats(),
+            "single_flight": single_flight.stats(),
+            "jobs": {**await asyncio.to_thread(job_queue.stats), "workers": job_worker_pool.stats()},
+            "tracing": trace_stats.snapshot(),
+            "stages": stage_stats.stats(),
+            "circuit_breakers": circuit_breakers.stats(),
+            "chunked_planner": chunked_stats.snapshot(),
+            "regenerate": regenerate_stats.snapshot(),
+            "llm_backend": cassette_store.stats(),
         })
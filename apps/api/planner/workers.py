@@ -0,0 +1,238 @@
+"""
+Generation Job Workers
+
+Worker pool chạy jobs trong planner.services.job_queue: mỗi worker là một
+coroutine trên event loop riêng (background thread), claim job → chạy
+generation chain → lưu plan vào StudyPlanRepository → gọi callback_url.
+
+Chạy trong process web (JOB_WORKERS_IN_PROCESS, start khi có job đầu tiên)
+hoặc process riêng: `python manage.py run_job_workers`.
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from django.conf import settings
+
+from planner.services import callback_url_allowed, job_queue
+from core.firebase import study_plan_repo
+from core.langchain.admission import AdmissionRejected
+from core.langchain.circuit_breaker import CircuitOpen
+from core.langchain.chains import create_safe_generation_chain
+from core.langchain.resilience import start_deadline
+from core.langchain.tracing import start_trace, trace_stats
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_TIMEOUT_SECONDS = 10
+# complete / fail gặp lỗi SQLite (vd. "database is locked" sau busy timeout): thử lại
+# thay vì bỏ job ở trạng thái running (sẽ bị chạy lại, tốn thêm LLM calls)
+QUEUE_WRITE_ATTEMPTS = 6
+QUEUE_WRITE_MAX_DELAY_SECONDS = 10.0
+
+
+def is_retryable(error: Exception) -> bool:
+    """Input bị chặn / Safety Filter: chạy lại cũng bị chặn → dead letter ngay"""
+    if isinstance(error, ValueError):
+        message = str(error).lower()
+        return not ("safety" in message or "blocked" in message)
+    return True
+
+
+class JobWorkerPool:
+    """
+    Usage:
+        job_worker_pool.start()          # idempotent, chạy nền
+        job_worker_pool.notify()         # có job mới → worker rảnh claim ngay
+        asyncio.run(pool.run_forever())  # chạy trên thread hiện tại (management command)
+    """
+    
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._busy = 0
+        self._prefix = uuid.uuid4().hex[:8]
+    
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=lambda: asyncio.run(self.run_forever()),
+                name="job-workers",
+                daemon=True,
+            )
+            self._thread.start()
+            logger.info(f"Started {self.workers} job workers")
+    
+    def notify(self) -> None:
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None:
+            loop.call_soon_threadsafe(wakeup.set)
+    
+    async def run_forever(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await asyncio.gather(*(
+            self._worker(f"{self._prefix}-{i}") for i in range(self.workers)
+        ))
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "busy": self._busy,
+            "running": self._thread is not None and self._thread.is_alive(),
+        }
+    
+    # ============================================
+    # Worker loop
+    # ============================================
+    
+    async def _worker(self, worker_id: str) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(job_queue.claim, worker_id)
+            except Exception:
+                logger.exception("Job queue claim failed")
+                job = None
+            
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            self._busy += 1
+            try:
+                await self._run(job, worker_id)
+            except Exception:
+                # Một job lỗi không được dừng worker (gather của run_forever dừng cả pool)
+                logger.exception(f"Job {job['id']}: worker {worker_id} failed to finish the job")
+            finally:
+                self._busy -= 1
+    
+    async def _run(self, job: Dict[str, Any], worker_id: str) -> None:
+        job_id = job["id"]
+        started_at = time.perf_counter()
+        trace = start_trace()
+        # Deadline cho cả job (không chỉ từng stage): xong trước visibility timeout → không bị chạy lặp
+        start_deadline(settings.JOB_BUDGET_SECONDS)
+        # Heartbeat chạy tới khi complete / fail ghi xong (kể cả lúc đang retry)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, worker_id))
+        try:
+            await self._execute(job, worker_id, trace, started_at)
+        finally:
+            heartbeat.cancel()
+    
+    async def _execute(self, job: Dict[str, Any], worker_id: str, trace, started_at: float) -> None:
+        job_id = job["id"]
+        plan_id = str(uuid.uuid4())
+        try:
+            result = await create_safe_generation_chain().ainvoke(job["payload"])
+            payload = {
+                "plan": result.get("plan", {}),
+                "html": result.get("html"),
+                "model_used": result.get("model_used"),
+                "router_decision": result.get("router_decision"),
+                "render": result.get("render"),
+            }
+            await study_plan_repo.save(plan_id, {
+                "plan": payload["plan"],
+                "html": payload["html"],
+                "userId": job["payload"].get("user_id"),
+                "jobId": job_id,
+            })
+        except Exception as e:
+            retry_after = e.retry_after if isinstance(e, (AdmissionRejected, CircuitOpen)) else 0.0
+            status = await self._queue_write(
+                job_queue.fail, job_id, worker_id, str(e) or type(e).__name__,
+                is_retryable(e), retry_after,
+            )
+            if status == "dead":
+                await self._callback(job_id, {"jobId": job_id, "status": "dead", "error": str(e)})
+            return
+        
+        trace_stats.record(trace)
+        completed = await self._queue_write(
+            job_queue.complete, job_id, worker_id,
+            {"planId": plan_id, **payload, "timings": trace.breakdown()},
+        )
+        if completed:
+            logger.info(
+                f"Job {job_id} succeeded in {(time.perf_counter() - started_at):.1f}s "
+                f"(attempt {job['attempts']}, {payload['model_used']})"
+            )
+            await self._callback(job_id, {
+                "jobId": job_id, "status": "succeeded", "planId": plan_id, **payload,
+            })
+    
+    async def _queue_write(self, func: Callable[..., Any], *args: Any) -> Any:
+        """job_queue.complete / fail, thử lại với backoff khi SQLite lỗi (database is locked)"""
+        delay = 0.5
+        for attempt in range(1, QUEUE_WRITE_ATTEMPTS + 1):
+            try:
+                return await asyncio.to_thread(func, *args)
+            except Exception as e:
+                if attempt == QUEUE_WRITE_ATTEMPTS:
+                    raise
+                logger.warning(
+                    f"Job queue {func.__name__} failed (attempt {attempt}/{QUEUE_WRITE_ATTEMPTS}), "
+                    f"retry in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, QUEUE_WRITE_MAX_DELAY_SECONDS)
+    
+    async def _heartbeat(self, job_id: str, worker_id: str) -> None:
+        """Gia hạn lease trong lúc chain chạy (Pro có thể lâu hơn visibility timeout)"""
+        interval = max(job_queue.visibility_timeout / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(job_queue.extend_lease, job_id, worker_id)
+            except Exception as e:
+                logger.warning(f"Job {job_id}: failed to extend lease: {e}")
+    
+    async def _callback(self, job_id: str, body: Dict[str, Any]) -> None:
+        try:
+            await self._send_callback(job_id, body)
+        except Exception:
+            # Job đã xong: lỗi callback (kể cả lỗi SQLite) chỉ được log
+            logger.exception(f"Job {job_id} callback failed")
+    
+    async def _send_callback(self, job_id: str, body: Dict[str, Any]) -> None:
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if not job or not job["callback_url"]:
+            return
+        # Kiểm tra lại lúc gửi: allow-list có thể đã đổi, DNS có thể trỏ sang địa chỉ nội bộ
+        if not await asyncio.to_thread(callback_url_allowed, job["callback_url"]):
+            logger.warning(f"Job {job_id} callback skipped: host not allowed")
+            await asyncio.to_thread(job_queue.set_callback_status, job_id, "rejected: host not allowed")
+            return
+        
+        try:
+            async with httpx.AsyncClient(timeout=CALLBACK_TIMEOUT_SECONDS) as client:
+                response = await client.post(job["callback_url"], json=body)
+            callback_status = str(response.status_code)
+        except httpx.HTTPError as e:
+            logger.warning(f"Job {job_id} callback failed: {e}")
+            callback_status = f"error: {type(e).__name__}"
+        
+        await asyncio.to_thread(job_queue.set_callback_status, job_id, callback_status)
+
+
+# Singleton instance
+job_worker_pool = JobWorkerPool(
+    workers=settings.JOB_WORKERS,
+    poll_interval=settings.JOB_POLL_INTERVAL_SECONDS,
+)